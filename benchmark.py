@@ -0,0 +1,395 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+
+import numpy as np
+
+import config
+import synthetic
+import workflow
+from engines import ENGINES, Environment, get_engine
+from pipeline import Stage
+from profiling import format_bytes, measure
+
+# Representative stages timed on their own by the stages benchmark
+MICRO_BENCHMARKS = ('slope', 'distance', 'rescale', 'overlay', 'regions')
+
+# Settings that must match for two results to be compared
+RESULT_KEY = ('benchmark', 'name', 'area', 'engine', 'jobs', 'threads', 'memory_mb')
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def max_difference(engine, path_a, path_b, max_distance):
+    # Largest absolute difference between two rasters over cells that are within max_distance in both
+    a, b = engine.read(path_a), engine.read(path_b)
+    largest = 0.0
+    for window in engine.tiles(16):
+        tile_a, tile_b = a.compute(window), b.compute(window)
+        valid = (tile_a < max_distance) & (tile_b < max_distance)
+        if valid.any():
+            largest = max(largest, float(np.abs(tile_a[valid] - tile_b[valid]).max()))
+    return largest
+
+
+def benchmark_distance(env, model, engines, output_dir='benchmark'):
+    """Time every distance surface of the model with each engine, capped and uncapped.
+
+    Outputs are written to output_dir in the workspace. When the arcpy engine runs too,
+    each numpy surface is compared against the arcpy one.
+    """
+    workspace = env.workspace
+    results = []
+    for name, entry in model['distances'].items():
+        features, max_distance = entry['features'], entry['max_distance']
+        if not os.path.exists(os.path.join(workspace, features)):
+            print(f'Skipping {name}; {features} does not exist')
+            continue
+
+        for engine_name in engines:
+            engine = get_engine(Environment(**{**vars(env), 'engine': engine_name}))
+            for mode, cap in (('capped', max_distance), ('full', None)):
+                path = os.path.join(output_dir, f'{name}_{engine_name}_{mode}.tif')
+                seconds = timed(lambda: engine.save(engine.distance(features, cap), path, 'distance'))
+                results.append({'stage': name, 'engine': engine_name, 'mode': mode, 'seconds': seconds, 'path': path})
+                print(f'{name:<22} {engine_name:<6} {mode:<7} {seconds:8.2f} s')
+
+        if 'arcpy' in engines and 'numpy' in engines:
+            engine = get_engine(Environment(**{**vars(env), 'engine': 'numpy'}))
+            difference = max_difference(engine, os.path.join(output_dir, f'{name}_numpy_capped.tif'),
+                                        os.path.join(output_dir, f'{name}_arcpy_capped.tif'), max_distance)
+            print(f'{name:<22} largest numpy/arcpy difference below {max_distance} m: {difference:.3f} m')
+
+    return results
+
+
+def git_commit():
+    # (commit, whether tracked files differ from it) of the tree this script is in, or (None, None) outside git
+    folder = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=folder, capture_output=True, text=True, check=True)
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=folder,
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.stdout.strip(), bool(status.stdout.strip())
+
+
+def host():
+    # The machine results were measured on, for sizing hardware from them
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 2 ** 20
+    except (AttributeError, ValueError, OSError):
+        memory = None
+    return {
+        'name': platform.node(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+        'memory_mb': memory,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'gdal': synthetic.gdal.__version__ if synthetic.gdal is not None else None,
+    }
+
+
+def version(record):
+    # Commit a result was measured at; uncommitted changes are marked so they are not mistaken for the commit
+    if record['commit'] is None:
+        return 'unknown'
+    return record['commit'][:10] + ('-dirty' if record['dirty'] else '')
+
+
+def read_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_results(path, records):
+    # One JSON object per line, so results from every commit accumulate in one file
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def parse_size(text):
+    # Study area size in km: WIDTHxHEIGHT or a single number for a square
+    try:
+        width, _, height = text.lower().partition('x')
+        size = float(width), float(height or width)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected a size in km such as 20 or 40x20, got {text!r}')
+    if min(size) <= 0:
+        raise argparse.ArgumentTypeError(f'sizes must be positive, got {text!r}')
+    return size
+
+
+def synthetic_area(root, width_km, height_km, cell_size, seed, margin_km):
+    # Workspace of a synthetic study area under root, generated if it is missing or was made with other settings
+    name = f'{width_km:g}x{height_km:g}km_{cell_size:g}m_seed{seed}'
+    workspace = os.path.join(root, 'areas', name)
+    settings = synthetic.generate(workspace, width_km, height_km, cell_size, margin_km, seed)
+    return name, workspace, settings
+
+
+def micro_stages(model, pipeline):
+    """One representative stage per micro-benchmark, by benchmark name.
+
+    slope, overlay and regions are the pipeline's slope mask, suitability and first
+    regions stages. distance is the distance surface with the largest cap, which reads
+    the widest strips, and rescale rescales it with its criterion's function (a rescale
+    stage is built even when the overlay fuses rescaling).
+    """
+    stages = {}
+    for name, mask in model['masks'].items():
+        if mask['type'] == 'slope':
+            stages['slope'] = pipeline.stages[f'{name}_mask']
+            break
+
+    distances = model['distances']
+    farthest = max(distances, key=lambda name: distances[name]['max_distance'])
+    stages['distance'] = pipeline.stages[farthest]
+
+    criterion = next((name for name, entry in model['criteria'].items() if entry['distance'] == farthest),
+                     next(iter(model['criteria'])))
+    transform = workflow.criterion_transform(model, criterion)
+    stages['rescale'] = Stage(f'rescale_{criterion}', workflow.rescale,
+                              inputs={'distance': distances[model['criteria'][criterion]['distance']]['output']},
+                              outputs={'output': f'rescaled_{criterion}.tif'},
+                              params={'function': transform['function'], 'args': transform['args'], 'label': criterion,
+                                      'max_distance': transform['max_distance']})
+
+    stages['overlay'] = pipeline.stages['suitability']
+    stages['regions'] = pipeline.stages[f'{next(iter(model["models"].values()))}_regions']
+    return stages
+
+
+def redirect(stage, folder):
+    # Copy of a stage that writes its outputs under folder, so benchmarks never replace the pipeline's outputs
+    outputs = {role: [os.path.join(folder, path) for path in value] if isinstance(value, list) else os.path.join(folder, value)
+               for role, value in stage.outputs.items()}
+    return Stage(stage.name, stage.func, stage.inputs, outputs, stage.params)
+
+
+def result(benchmark, name, area, env, cells, metrics, jobs=1, **fields):
+    commit, dirty = git_commit()
+    return {
+        'benchmark': benchmark,
+        'name': name,
+        'area': area,
+        'engine': env.engine,
+        'jobs': jobs,
+        'threads': env.threads,
+        'memory_mb': env.memory_mb,
+        'cell_size': env.cell_size,
+        'cells': cells,
+        **metrics,
+        'seconds_per_mcell': metrics['wall_seconds'] / cells * 1e6 if cells else None,
+        **fields,
+        'commit': commit,
+        'dirty': dirty,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': host(),
+    }
+
+
+def grid_cells(env):
+    spec = get_engine(env).spec()
+    return spec.rows * spec.cols
+
+
+def benchmark_stages(env, model, area, names=MICRO_BENCHMARKS, repeat=3, jobs=1, output_dir='benchmark/stages'):
+    """Time representative stages on their own, repeat times each.
+
+    The model's pipeline is first brought up to date (unmeasured, on jobs processes) so
+    every stage has its inputs; each stage then runs again in this process with its
+    outputs redirected to output_dir in the workspace. Returns one result per run.
+    """
+    pipeline = workflow.build_pipeline(env, model, variants=[])
+    pipeline.run(jobs=jobs)
+    cells = grid_cells(env)
+    stages = micro_stages(model, pipeline)
+
+    results = []
+    for name in names:
+        if name not in stages:
+            print(f'Skipping {name}; the model has no such stage')
+            continue
+        stage = redirect(stages[name], output_dir)
+        for run in range(repeat):
+            _, metrics = measure(stage.run, env)
+            print(f'{name:<10} run {run + 1}/{repeat} {metrics["wall_seconds"]:8.2f} s')
+            results.append(result('stage', name, area, env, cells, metrics, stage=stage.name, run=run))
+    return results
+
+
+def benchmark_pipeline(env, model, area, jobs=1):
+    """Run the whole model from the source layers (every stage forced) and time it.
+
+    The run report is written to reports/benchmark_<date>_<time> in the workspace and
+    its totals and per-stage records are returned as one result.
+    """
+    pipeline = workflow.build_pipeline(env, model)
+    pipeline.run(force=True, jobs=jobs, report=time.strftime('reports/benchmark_%Y%m%d_%H%M%S'))
+    totals = pipeline.report.totals()
+    cells = grid_cells(env)
+    metrics = {key: totals[key] for key in ('wall_seconds', 'cpu_seconds', 'peak_rss_mb')}
+    metrics['read_bytes'] = sum(record['read_bytes'] or 0 for record in pipeline.report.records)
+    metrics['written_bytes'] = sum(record['written_bytes'] or 0 for record in pipeline.report.records)
+    return [result('pipeline', 'pipeline', area, env, cells, metrics, jobs=jobs, stage_seconds=totals['stage_seconds'],
+                   stages=[{key: record[key] for key in ('stage', 'wall_seconds', 'cpu_seconds', 'peak_rss_mb')}
+                           for record in pipeline.report.records if record['status'] == 'ran'])]
+
+
+def summarise(results, target_km2=None):
+    """Table of the fastest run of each benchmark with its throughput and peak memory.
+
+    With target_km2, wall time is also extrapolated linearly in the number of cells to a
+    study area of that size at the same cell size (tiles keep peak memory near
+    memory_mb whatever the size, so it is not extrapolated).
+    """
+    best = {}
+    for record in results:
+        key = tuple(record[field] for field in RESULT_KEY)
+        if key not in best or record['wall_seconds'] < best[key]['wall_seconds']:
+            best[key] = record
+
+    lines = [f'{"benchmark":<10} {"area":<26} {"cells":>12} {"wall s":>9} {"cpu s":>9} {"s/Mcell":>9} '
+             f'{"peak RSS":>10} {"written":>10}' + (f' {"est. h":>8}' if target_km2 else '')]
+    for record in best.values():
+        peak = record['peak_rss_mb']
+        line = (f'{record["name"]:<10} {record["area"]:<26} {record["cells"]:>12,} {record["wall_seconds"]:9.2f} '
+                f'{record["cpu_seconds"]:9.2f} {record["seconds_per_mcell"]:9.3f} '
+                f'{format_bytes(peak * 2 ** 20 if peak is not None else None):>10} {format_bytes(record["written_bytes"]):>10}')
+        if target_km2:
+            target_cells = target_km2 * 1e6 / record['cell_size'] ** 2
+            line += f' {record["seconds_per_mcell"] * target_cells / 1e6 / 3600:8.2f}'
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def compare(results, baseline=None, current=None, tolerance=0.1):
+    """Compare the fastest runs of each benchmark between two commits.
+
+    current defaults to the last commit with results and baseline to the one recorded
+    before it; either can be given as a commit prefix. Benchmarks more than tolerance
+    slower than the baseline are flagged.
+    """
+    versions = list(dict.fromkeys(version(record) for record in results))
+
+    def find(prefix, default):
+        if prefix is None:
+            return default
+        matches = [name for name in versions if name.startswith(prefix)]
+        if not matches:
+            raise ValueError(f'No benchmark results for commit {prefix}')
+        return matches[-1]
+
+    current = find(current, versions[-1] if versions else None)
+    earlier = [name for name in versions if name != current]
+    baseline = find(baseline, earlier[-1] if earlier else None)
+    if current is None or baseline is None:
+        raise ValueError('Comparing needs benchmark results from two commits')
+
+    best = {}
+    for record in results:
+        if version(record) in (baseline, current):
+            key = (version(record),) + tuple(record[field] for field in RESULT_KEY)
+            best[key] = min(best.get(key, float('inf')), record['wall_seconds'])
+
+    lines = [f'{baseline} -> {current}',
+             f'{"benchmark":<10} {"area":<26} {"engine":<6} {"jobs":>4} {"base s":>9} {"new s":>9} {"change":>8}']
+    for key in dict.fromkeys(key[1:] for key in best):
+        if (baseline,) + key not in best or (current,) + key not in best:
+            continue
+        before, after = best[(baseline,) + key], best[(current,) + key]
+        change = after / before - 1 if before else 0.0
+        flag = '  slower' if change > tolerance else '  faster' if change < -tolerance else ''
+        _, name, area, engine, jobs, _, _ = key
+        lines.append(f'{name:<10} {area:<26} {engine:<6} {jobs:>4} {before:9.2f} {after:9.2f} {change:+8.1%}{flag}')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark stages of the suitability model.')
+    parser.add_argument('benchmark', choices=['distance', 'generate', 'stages', 'pipeline', 'all', 'compare'],
+                        help='distance: compare engines on the model\'s own data; generate: write synthetic study areas; '
+                             'stages/pipeline/all: time stages or the whole model on synthetic areas; '
+                             'compare: compare recorded results between commits')
+    parser.add_argument('--config', default=config.DEFAULT_CONFIG, help='model file (TOML or YAML)')
+    parser.add_argument('--area', help='study area (default: the first in the model file)')
+    parser.add_argument('--engines', nargs='+', default=['numpy', 'arcpy'], help='engines to compare')
+
+    synthetic_args = parser.add_argument_group('synthetic study areas')
+    synthetic_args.add_argument('--root', default='benchmark', help='folder for synthetic study areas and results.jsonl')
+    synthetic_args.add_argument('--size', type=parse_size, action='append',
+                                help='study area size in km, e.g. 20 or 40x20; repeat for several (default: 20)')
+    synthetic_args.add_argument('--cell-size', type=float, default=30, help='cell size in m (default: 30)')
+    synthetic_args.add_argument('--margin', type=float, default=5, help='km of data around the study area (default: 5)')
+    synthetic_args.add_argument('--seed', type=int, default=0, help='random seed of the synthetic layers')
+    synthetic_args.add_argument('--engine', choices=sorted(ENGINES), default='numpy', help='engine to benchmark')
+    synthetic_args.add_argument('--only', nargs='+', choices=MICRO_BENCHMARKS, default=list(MICRO_BENCHMARKS),
+                                help='stages to time with the stages benchmark')
+    synthetic_args.add_argument('--repeat', type=int, default=3, help='runs of each stage benchmark')
+    synthetic_args.add_argument('--jobs', type=int, default=os.cpu_count(), help='stages run at once by the pipeline (default: one per CPU)')
+    synthetic_args.add_argument('--threads', type=int, default=1, help='tiles computed at once within a stage')
+    synthetic_args.add_argument('--memory', type=int, default=1024, help='working memory (MB) per tiled operation')
+    synthetic_args.add_argument('--target-km2', type=float, help='also estimate hours for a study area of this size')
+
+    compare_args = parser.add_argument_group('compare')
+    compare_args.add_argument('--baseline', help='commit to compare against (default: the one recorded before --commit)')
+    compare_args.add_argument('--commit', help='commit to compare (default: the last one recorded)')
+    compare_args.add_argument('--tolerance', type=float, default=0.1, help='fractional slowdown flagged as a regression')
+    args = parser.parse_args()
+
+    model = config.load_config(args.config)
+    area_name = args.area or next(iter(model['areas']))
+    results_path = os.path.join(args.root, 'results.jsonl')
+
+    if args.benchmark == 'distance':
+        env = config.environment(model, area_name)
+        engines = []
+        for name in args.engines:
+            try:
+                get_engine(Environment(**{**vars(env), 'engine': name}))
+                engines.append(name)
+            except ImportError as error:
+                print(f'Skipping {name} engine: {error}')
+        benchmark_distance(env, model, engines)
+
+    elif args.benchmark == 'compare':
+        try:
+            print(compare(read_results(results_path), args.baseline, args.commit, args.tolerance))
+        except ValueError as error:
+            parser.exit(1, f'{error}\n')
+
+    else:
+        results = []
+        for width, height in args.size or [(20, 20)]:
+            name, workspace, settings = synthetic_area(args.root, width, height, args.cell_size, args.seed, args.margin)
+            if args.benchmark == 'generate':
+                continue
+            env = config.environment(model, area_name, workspace=os.path.abspath(workspace), engine=args.engine,
+                                     cell_size=args.cell_size, epsg=settings['epsg'], memory_mb=args.memory,
+                                     threads=args.threads)
+            if args.benchmark in ('pipeline', 'all'):
+                results += benchmark_pipeline(env, model, name, args.jobs)
+            if args.benchmark in ('stages', 'all'):
+                results += benchmark_stages(env, model, name, args.only, args.repeat, args.jobs)
+
+        if results:
+            append_results(results_path, results)
+            print(summarise(results, args.target_km2))
+            print(f'Results added to {results_path}')
@@ -0,0 +1,275 @@
+import copy
+import inspect
+import os
+
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from engines import ENGINES, Environment
+from formats import MAX_WEIGHT_SUM
+from transforms import TRANSFORMS
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model.toml')
+
+# Environment settings a study area can set; workspace is required
+ENVIRONMENT_KEYS = tuple(inspect.signature(Environment).parameters)
+
+SECTIONS = ('defaults', 'areas', 'reproject', 'selections', 'distances', 'masks', 'water', 'criteria', 'overlay',
+            'weights', 'models', 'regions', 'variants')
+
+# Required and optional keys of each entry, by section (and mask type)
+SCHEMAS = {
+    'selections': ({'label': str, 'source': str, 'where': str, 'output': str}, {'dissolve': bool}),
+    'distances': ({'label': str, 'features': str, 'output': str, 'max_distance': float}, {}),
+    'slope': ({'dem': str, 'output': str, 'max_degrees': float}, {'label': str}),
+    'land_use': ({'label': str, 'land_use': str, 'output': str, 'classes': list}, {}),
+    'buffer': ({'label': str, 'distance': str, 'output': str, 'minimum': float, 'maximum': float}, {}),
+    'water': ({'label': str, 'distance': str, 'output': str, 'maximum': float, 'buffers': dict}, {}),
+    'criteria': ({'distance': str, 'function': str, 'parameters': list, 'lower_threshold': float,
+                  'upper_threshold': float}, {'output': str, 'value_below': float, 'value_above': float}),
+    'overlay': ({}, {'fuse_rescale': bool}),
+    'reproject': ({}, {'categorical': list, 'exclude': list}),
+    'regions': ({'water': str, 'threshold': float, 'min_area': float}, {}),
+}
+
+
+class ConfigError(ValueError):
+    # Every problem found in a model file, so they can all be fixed at once
+    def __init__(self, path, problems):
+        self.problems = problems
+        super().__init__(f'{path} is not a valid model:\n' + '\n'.join(f'  {problem}' for problem in problems))
+
+
+def read_file(path):
+    # TOML (.toml) or YAML (.yaml/.yml) into plain dicts and lists
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.toml':
+        if tomllib is None:
+            raise ImportError('Reading TOML model files requires Python 3.11 or tomli')
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    if ext in ('.yaml', '.yml'):
+        if yaml is None:
+            raise ImportError('Reading YAML model files requires PyYAML')
+        with open(path) as f:
+            return yaml.safe_load(f) or {}
+    raise ValueError(f'{path}: model files must be .toml, .yaml or .yml')
+
+
+def merge(base, overrides):
+    # Tables are merged key by key; any other value replaces the base value
+    merged = copy.deepcopy(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def is_type(value, kind):
+    if kind is float:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, kind)
+
+
+def check_entry(problems, where, entry, schema):
+    required, optional = schema
+    if not isinstance(entry, dict):
+        problems.append(f'{where}: expected a table')
+        return False
+    for key, kind in required.items():
+        if key not in entry:
+            problems.append(f'{where}.{key}: missing')
+        elif not is_type(entry[key], kind):
+            problems.append(f'{where}.{key}: expected {kind.__name__}, got {entry[key]!r}')
+    for key, value in entry.items():
+        if key in optional:
+            if value is not None and not is_type(value, optional[key]):
+                problems.append(f'{where}.{key}: expected {optional[key].__name__}, got {value!r}')
+        elif key not in required and key != 'type':
+            problems.append(f'{where}.{key}: unknown setting')
+    return True
+
+
+def check_model(model, problems, prefix='', engine=None):
+    # Checks the model sections (everything but areas and variants) of a merged model; engine overrides the
+    # engines the model's defaults and areas set
+    def table(name):
+        value = model.get(name, {})
+        if not isinstance(value, dict):
+            problems.append(f'{prefix}{name}: expected a table')
+            return {}
+        return value
+
+    for name in ('selections', 'distances', 'criteria'):
+        if not table(name) and name != 'selections':
+            problems.append(f'{prefix}{name}: at least one entry is needed')
+        for key, entry in table(name).items():
+            check_entry(problems, f'{prefix}{name}.{key}', entry, SCHEMAS[name])
+
+    distances = table('distances')
+    for key, entry in table('distances').items():
+        if isinstance(entry, dict) and is_type(entry.get('max_distance'), float) and entry['max_distance'] <= 0:
+            problems.append(f'{prefix}distances.{key}.max_distance: must be positive')
+
+    if not table('masks'):
+        problems.append(f'{prefix}masks: at least one entry is needed')
+    for key, entry in table('masks').items():
+        kind = entry.get('type') if isinstance(entry, dict) else None
+        if kind not in ('slope', 'land_use', 'buffer'):
+            problems.append(f'{prefix}masks.{key}.type: expected slope, land_use or buffer, got {kind!r}')
+            continue
+        if check_entry(problems, f'{prefix}masks.{key}', entry, SCHEMAS[kind]) and kind == 'buffer':
+            if entry.get('distance') not in distances:
+                problems.append(f'{prefix}masks.{key}.distance: no distance named {entry.get("distance")!r}')
+
+    water = table('water')
+    if check_entry(problems, f'{prefix}water', water, SCHEMAS['water']):
+        if 'distance' in water and water['distance'] not in distances:
+            problems.append(f'{prefix}water.distance: no distance named {water["distance"]!r}')
+        if is_type(water.get('output'), str) and '{buffer}' not in water['output']:
+            problems.append(f'{prefix}water.output: must contain {{buffer}}')
+        buffers = water.get('buffers')
+        if isinstance(buffers, dict):
+            if not buffers:
+                problems.append(f'{prefix}water.buffers: at least one buffer is needed')
+            for name, buffer in buffers.items():
+                if not is_type(buffer, float) or buffer < 0:
+                    problems.append(f'{prefix}water.buffers.{name}: expected a distance in m, got {buffer!r}')
+
+    criteria = table('criteria')
+    engines = {engine} if engine else {model.get('defaults', {}).get('engine')} | {
+        area.get('engine') for area in model.get('areas', {}).values() if isinstance(area, dict)}
+    for key, entry in criteria.items():
+        if not isinstance(entry, dict):
+            continue
+        if 'distance' in entry and entry['distance'] not in distances:
+            problems.append(f'{prefix}criteria.{key}.distance: no distance named {entry["distance"]!r}')
+        if 'output' not in entry and not model.get('overlay', {}).get('fuse_rescale', False):
+            problems.append(f'{prefix}criteria.{key}.output: missing (needed unless overlay.fuse_rescale is set)')
+        if 'numpy' in engines and is_type(entry.get('function'), str) and entry['function'] not in TRANSFORMS:
+            problems.append(f'{prefix}criteria.{key}.function: the numpy engine supports {", ".join(sorted(TRANSFORMS))}')
+        if isinstance(entry.get('parameters'), list) and not all(is_type(value, float) for value in entry['parameters']):
+            problems.append(f'{prefix}criteria.{key}.parameters: expected numbers')
+
+    weights = table('weights')
+    if not weights:
+        problems.append(f'{prefix}weights: at least one weight set is needed')
+    for person, weight_set in weights.items():
+        if not isinstance(weight_set, dict):
+            problems.append(f'{prefix}weights.{person}: expected a table of criterion weights')
+            continue
+        if set(weight_set) != set(criteria):
+            missing, extra = set(criteria) - set(weight_set), set(weight_set) - set(criteria)
+            problems.append(f'{prefix}weights.{person}: ' + '; '.join(
+                part for part in (missing and f'missing {", ".join(sorted(missing))}',
+                                  extra and f'unknown criteria {", ".join(sorted(extra))}') if part))
+        for name, weight in weight_set.items():
+            if not is_type(weight, float) or weight < 0:
+                problems.append(f'{prefix}weights.{person}.{name}: expected a non-negative number, got {weight!r}')
+        if all(is_type(weight, float) for weight in weight_set.values()) and sum(weight_set.values()) > MAX_WEIGHT_SUM:
+            problems.append(f'{prefix}weights.{person}: weights sum to {sum(weight_set.values()):g}; at most '
+                            f'{MAX_WEIGHT_SUM:g} is supported so scores fit suitability rasters')
+
+    models = table('models')
+    if not models:
+        problems.append(f'{prefix}models: at least one entry is needed')
+    for person, name in models.items():
+        if person not in weights:
+            problems.append(f'{prefix}models.{person}: no weight set named {person!r}')
+        if not isinstance(name, str):
+            problems.append(f'{prefix}models.{person}: expected an output name, got {name!r}')
+    if len(set(map(str, models.values()))) != len(models):
+        problems.append(f'{prefix}models: output names must be unique')
+
+    regions = table('regions')
+    if check_entry(problems, f'{prefix}regions', regions, SCHEMAS['regions']):
+        if isinstance(water.get('buffers'), dict) and 'water' in regions and regions['water'] not in water['buffers']:
+            problems.append(f'{prefix}regions.water: no waterbody buffer named {regions["water"]!r}')
+
+    check_entry(problems, f'{prefix}reproject', table('reproject'), SCHEMAS['reproject'])
+    check_entry(problems, f'{prefix}overlay', table('overlay'), SCHEMAS['overlay'])
+
+
+def validate(config, path='model', engine=None):
+    """Check a whole model file before anything runs; raises ConfigError listing every problem.
+
+    The base model and each variant (the base with the variant's settings merged in)
+    are checked separately, so a variant cannot break a setting the base relies on.
+    engine is the engine chosen on the command line, if any; it replaces the engines
+    of the model file when checking what the engine supports.
+    """
+    problems = []
+    for section in config:
+        if section not in SECTIONS:
+            problems.append(f'{section}: unknown section')
+
+    defaults = config.get('defaults', {})
+    areas = config.get('areas', {})
+    if not isinstance(areas, dict) or not areas:
+        problems.append('areas: at least one study area is needed')
+        areas = {}
+
+    for where, settings in [('defaults', defaults)] + [(f'areas.{name}', area) for name, area in areas.items()]:
+        if not isinstance(settings, dict):
+            problems.append(f'{where}: expected a table')
+            continue
+        for key, value in settings.items():
+            if key not in ENVIRONMENT_KEYS:
+                problems.append(f'{where}.{key}: unknown setting')
+            elif key == 'engine' and value not in ENGINES:
+                problems.append(f'{where}.engine: expected one of {", ".join(sorted(ENGINES))}, got {value!r}')
+            elif key in ('cell_size', 'memory_mb') and (not is_type(value, float) or value <= 0):
+                problems.append(f'{where}.{key}: expected a positive number, got {value!r}')
+            elif key in ('epsg', 'threads') and (not isinstance(value, int) or value <= 0):
+                problems.append(f'{where}.{key}: expected a positive integer, got {value!r}')
+    for name, area in areas.items():
+        if isinstance(area, dict) and not isinstance(area.get('workspace'), str):
+            problems.append(f'areas.{name}.workspace: missing')
+
+    check_model(config, problems, engine=engine)
+
+    variants = config.get('variants', {})
+    for name, overrides in variants.items():
+        if not isinstance(overrides, dict):
+            problems.append(f'variants.{name}: expected a table')
+            continue
+        for section in overrides:
+            if section in ('defaults', 'areas', 'variants', 'reproject') or section not in SECTIONS:
+                problems.append(f'variants.{name}.{section}: variants can only change model settings')
+        check_model(merge(config, overrides), problems, f'variants.{name}: ', engine)
+
+    if problems:
+        raise ConfigError(path, problems)
+    return config
+
+
+def load_config(path=DEFAULT_CONFIG, engine=None):
+    return validate(read_file(path), path, engine)
+
+
+def environment(config, area, **overrides):
+    # Environment of a study area: defaults, then the area's settings, then any overrides that are not None
+    settings = {**config.get('defaults', {}), **config['areas'][area]}
+    settings.update({key: value for key, value in overrides.items() if value is not None})
+    return Environment(**settings)
+
+
+def variant_models(config, variants=None):
+    # (variant name, merged model) pairs; None is the base model and always comes first
+    names = list(config.get('variants', {})) if variants is None else variants
+    unknown = [name for name in names if name not in config.get('variants', {})]
+    if unknown:
+        raise KeyError(f'Unknown variant {unknown[0]!r}')
+    return [(None, config)] + [(name, merge(config, config['variants'][name])) for name in names]
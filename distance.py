@@ -0,0 +1,116 @@
+import numpy as np
+
+
+def column_distances(sources):
+    # Distance in cells from each cell to the nearest source in its own column (inf if the column has none)
+    rows = sources.shape[0]
+    index = np.arange(rows, dtype=np.float64)[:, None]
+
+    above = np.maximum.accumulate(np.where(sources, index, -np.inf), axis=0)
+    below = np.minimum.accumulate(np.where(sources, index, np.inf)[::-1], axis=0)[::-1]
+    return np.minimum(index - above, below - index)
+
+
+def lower_envelope(f):
+    """Squared distance transform of every row of f at once (Felzenszwalb & Huttenlocher).
+
+    f holds each row's sampled function (here the squared column distances). The result
+    is min over q' of (q - q')^2 + f[q'] for every q, computed from the lower envelope
+    of the parabolas rooted at each finite sample in linear time per row. The rows are
+    processed in lockstep so each step is a vector operation across all rows.
+    """
+    rows, cols = f.shape
+    r = np.arange(rows)
+    v = np.zeros((rows, cols), np.int64)           # parabola roots in the envelope
+    z = np.full((rows, cols + 1), np.inf)           # boundaries between envelope parabolas
+    k = np.full(rows, -1, np.int64)                 # index of the last envelope parabola per row
+
+    for q in range(cols):
+        fq = f[:, q]
+        active = np.isfinite(fq)
+        if not active.any():
+            continue
+
+        # Pop parabolas hidden by the new one
+        s = np.full(rows, -np.inf)
+        while True:
+            has = active & (k >= 0)
+            vk = v[r, np.maximum(k, 0)]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                s = np.where(has, ((fq + q * q) - (f[r, vk] + vk * vk)) / (2 * q - 2 * vk), -np.inf)
+            pop = has & (s <= z[r, np.maximum(k, 0)])
+            if not pop.any():
+                break
+            k[pop] -= 1
+
+        k[active] += 1
+        rows_in = r[active]
+        v[rows_in, k[active]] = q
+        z[rows_in, k[active]] = np.where(k[active] == 0, -np.inf, s[active])
+        z[rows_in, k[active] + 1] = np.inf
+
+    out = np.full((rows, cols), np.inf)
+    found = k >= 0
+    k = np.zeros(rows, np.int64)
+    for q in range(cols):
+        while True:
+            advance = found & (z[r, k + 1] < q)
+            if not advance.any():
+                break
+            k[advance] += 1
+        vk = v[r, k]
+        out[found, q] = ((q - vk) ** 2 + f[r, vk])[found]
+
+    return out
+
+
+def capped_column_distances(sources, reach):
+    # Distance in cells to the nearest source in the same column, as reach + 1 where there is none within reach cells
+    return np.minimum(column_distances(sources), reach + 1)
+
+
+def capped_row_distances(columns, cell_size, max_distance):
+    """Distances capped at max_distance from the capped column distances of the same cells.
+
+    columns holds capped_column_distances() of every column the rows of the result can
+    reach, so each row is transformed on its own; cells with no source within reach are
+    max_distance.
+    """
+    reach = int(np.ceil(max_distance / cell_size))
+    out = np.full(columns.shape, max_distance, np.float64)
+    g = columns.astype(np.float64)
+    g[g > reach] = np.inf
+
+    # Rows with no column source within reach are already at max_distance
+    near = np.isfinite(g).any(axis=1)
+    squared = lower_envelope(g[near] ** 2)
+    out[near] = np.minimum(np.sqrt(squared) * cell_size, max_distance)
+    return out
+
+
+def euclidean_distance(sources, cell_size=1.0, max_distance=None):
+    """Exact Euclidean distance from every cell to the nearest source cell.
+
+    sources is a boolean array. Distances are in map units (cells x cell_size); cells
+    with no source at all are inf. With max_distance, cells farther than max_distance
+    are set to max_distance, and work is limited to the rows and columns within
+    max_distance of a source instead of the whole array.
+    """
+    rows, cols = sources.shape
+    if max_distance is None:
+        return np.sqrt(lower_envelope(column_distances(sources) ** 2)) * cell_size
+
+    out = np.full((rows, cols), max_distance, np.float64)
+    if not sources.any():
+        return out
+
+    # Only the sources' bounding box grown by max_distance can be closer than max_distance
+    reach = int(np.ceil(max_distance / cell_size))
+    source_rows = np.flatnonzero(sources.any(axis=1))
+    source_cols = np.flatnonzero(sources.any(axis=0))
+    row0, row1 = max(source_rows[0] - reach, 0), min(source_rows[-1] + reach + 1, rows)
+    col0, col1 = max(source_cols[0] - reach, 0), min(source_cols[-1] + reach + 1, cols)
+
+    columns = capped_column_distances(sources[row0:row1, col0:col1], reach)
+    out[row0:row1, col0:col1] = capped_row_distances(columns, cell_size, max_distance)
+    return out
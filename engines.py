@@ -0,0 +1,795 @@
+import math
+import os
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from distance import capped_column_distances, capped_row_distances, euclidean_distance
+from formats import BLOCK_SIZE, FORMATS, NODATA
+from overlay import fused_overlay
+from regions import MAXIMUM_SCORE, extract_regions, write_region_table
+from tiling import MIN_TILE_SIZE, Window, crop, expand, strip_length_for, tile_size_for, windows
+from transforms import MAX_TABLE_SIZE, DistanceLookup, Rescale, distance_table_size, remap_range, remap_value
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from osgeo import gdal, ogr, osr
+    gdal.UseExceptions()
+    ogr.UseExceptions()
+except ImportError:
+    gdal = ogr = osr = None
+
+RESAMPLING = {
+    'NEAREST': 'near',
+    'BILINEAR': 'bilinear',
+    'CUBIC': 'cubic',
+}
+
+
+class Environment:
+    # Geoprocessing settings shared by every stage; also part of each stage's fingerprint
+    def __init__(self, workspace, cell_size=30, extent='administrative_regions/grand_casablanca.shp',
+                 mask='administrative_regions/grand_casablanca.shp',
+                 snap_raster='land_use/REPROJECTED_n29_30_2020lc030.tif', epsg=32629, engine='arcpy', memory_mb=1024,
+                 threads=1):
+        self.workspace = workspace
+        self.cell_size = cell_size
+        self.extent = extent
+        self.mask = mask
+        self.snap_raster = snap_raster
+        self.epsg = epsg
+        self.engine = engine
+        # Working memory and threads per tiled operation; these only change how rasters are processed, not the results
+        self.memory_mb = memory_mb
+        self.threads = threads
+
+    def fingerprint(self):
+        # Settings that change stage outputs
+        return {key: value for key, value in vars(self).items() if key not in ('memory_mb', 'threads')}
+
+
+class Engine:
+    """Raster and feature operations used by the suitability model.
+
+    Rasters are opaque objects returned by read() and the raster operations; they
+    support +, -, * and / with each other and with numbers. Feature classes are
+    always passed around as paths relative to the workspace.
+    """
+
+    name = None
+
+    def __init__(self, env):
+        self.env = env
+
+    def crs_name(self):
+        return f'EPSG:{self.env.epsg}'
+
+    def read(self, path):
+        raise NotImplementedError
+
+    def save(self, raster, path, kind='float'):
+        # kind names the storage format in formats.FORMATS (e.g. 'mask' for 0/1 rasters)
+        raise NotImplementedError
+
+    def project_raster(self, source, output, resampling, clip=None, margin=0):
+        # With clip (a feature class already in the output coordinate system), only the clip
+        # layer's extent grown by margin map units is kept
+        raise NotImplementedError
+
+    def project_features(self, source, output, clip=None, margin=0):
+        # With clip, only features within margin map units of the clip layer's extent are kept, uncut
+        raise NotImplementedError
+
+    def select_features(self, source, where, output, dissolve=False):
+        raise NotImplementedError
+
+    def slope(self, raster):
+        # Slope in degrees
+        raise NotImplementedError
+
+    def reclassify_range(self, raster, ranges):
+        # ranges is a list of [start, end, new value]; unmatched cells become NoData
+        raise NotImplementedError
+
+    def reclassify_value(self, raster, values):
+        # values is a list of [old value, new value]; unmatched cells become NoData
+        raise NotImplementedError
+
+    def distance(self, features, max_distance=None):
+        # Euclidean distance to the nearest feature; with max_distance, farther cells are capped at max_distance
+        raise NotImplementedError
+
+    def rescale(self, raster, function, args, from_scale, to_scale, max_distance=None):
+        # function is the name of an arcpy.sa transformation class (e.g. 'TfSmall') and args its arguments.
+        # max_distance says raster is a distance surface from distance() capped at max_distance.
+        raise NotImplementedError
+
+    def criterion(self, path, transform=None):
+        # A criterion raster, rescaled on the fly when transform holds rescale()'s keyword arguments
+        raster = self.read(path)
+        return self.rescale(raster, **transform) if transform else raster
+
+    def raster_to_polygon(self, raster, output):
+        raise NotImplementedError
+
+    def calculate_area(self, polygons, field):
+        raise NotImplementedError
+
+    def polygon_to_raster(self, polygons, field, output, where=None):
+        raise NotImplementedError
+
+    def extract_regions(self, suitability, threshold, min_area, output, table, polygons=None):
+        # Regions of cells scoring from threshold to regions.MAXIMUM_SCORE that cover at least min_area. output gets each
+        # region's id, table one row per region (regions.TABLE_FIELDS) and polygons their outlines.
+        raise NotImplementedError
+
+    def weighted_overlay(self, criteria, weights, masks, variants, outputs, variant_outputs=None, transforms=None):
+        # Scores every weight set (rows of weights) against every variant mask; outputs lists the
+        # paths weight set by weight set. The shared masks are multiplied once and each weighted
+        # sum is built once and reused for every variant. transforms optionally rescales each
+        # criterion as it is read (see criterion()), so rescaled criteria need not be saved.
+        layers = [self.criterion(path, transform) for path, transform in zip(criteria, transforms or [None] * len(criteria))]
+        base = self.read(masks[0])
+        for path in masks[1:]:
+            base = base * self.read(path)
+
+        final_masks = [base * self.read(path) for path in variants]
+        for final_mask, path in zip(final_masks, variant_outputs or []):
+            self.save(final_mask, path, 'mask')
+
+        paths = iter(outputs)
+        for row in weights:
+            score = layers[0] * row[0]
+            for layer, weight in zip(layers[1:], row[1:]):
+                score = score + (layer * weight)
+            for final_mask in final_masks:
+                self.save(score * final_mask, next(paths), 'score')
+
+
+class ArcpyEngine(Engine):
+    name = 'arcpy'
+
+    def __init__(self, env):
+        super().__init__(env)
+        import arcpy
+        self.arcpy = arcpy
+
+        arcpy.env.workspace = env.workspace
+        arcpy.env.cellSize = env.cell_size
+        arcpy.env.extent = env.extent
+        arcpy.env.mask = env.mask
+        arcpy.env.snapRaster = env.snap_raster
+        arcpy.env.outputCoordinateSystem = arcpy.SpatialReference(env.epsg)
+        arcpy.env.overwriteOutput = True
+        # Compressed tiled output with pyramids, the closest Spatial Analyst gets to the numpy engine's COGs
+        arcpy.env.compression = 'LZ77'
+        arcpy.env.tileSize = f'{BLOCK_SIZE} {BLOCK_SIZE}'
+        arcpy.env.pyramid = 'PYRAMIDS -1 NEAREST'
+
+    def crs_name(self):
+        return self.arcpy.SpatialReference(self.env.epsg).name
+
+    def read(self, path):
+        return self.arcpy.Raster(path)
+
+    def save(self, raster, path, kind='float'):
+        # Integer kinds are copied to their pixel type; quantized scores stay float as arcpy has no scale/offset
+        pixel_types = {'mask': '8_BIT_UNSIGNED', 'region': '32_BIT_UNSIGNED'}
+        if kind in pixel_types:
+            self.arcpy.management.CopyRaster(raster, path, nodata_value=str(FORMATS[kind].nodata), pixel_type=pixel_types[kind])
+        else:
+            raster.save(path)
+
+    def clip_extent(self, clip, margin):
+        extent = self.arcpy.Describe(clip).extent
+        return self.arcpy.Extent(extent.XMin - margin, extent.YMin - margin, extent.XMax + margin, extent.YMax + margin,
+                                 spatial_reference=extent.spatialReference)
+
+    def project_raster(self, source, output, resampling, clip=None, margin=0):
+        arcpy = self.arcpy
+        with arcpy.EnvManager(extent=self.clip_extent(clip, margin) if clip else None):
+            arcpy.management.ProjectRaster(source, output, arcpy.SpatialReference(self.env.epsg), resampling)
+
+    def project_features(self, source, output, clip=None, margin=0):
+        arcpy = self.arcpy
+        if clip:
+            source = arcpy.management.SelectLayerByLocation(arcpy.management.MakeFeatureLayer(source, 'clipped_source'),
+                                                            'WITHIN_A_DISTANCE', clip, f'{margin} Meters')
+        arcpy.management.Project(source, output, arcpy.SpatialReference(self.env.epsg))
+
+    def select_features(self, source, where, output, dissolve=False):
+        selection = self.arcpy.SelectLayerByAttribute_management(source, 'NEW_SELECTION', where)
+        if dissolve:
+            self.arcpy.Dissolve_management(selection, output)
+        else:
+            self.arcpy.management.CopyFeatures(selection, output)
+
+    def slope(self, raster):
+        return self.arcpy.sa.Slope(raster, 'DEGREE')
+
+    def reclassify_range(self, raster, ranges):
+        return self.arcpy.sa.Reclassify(raster, 'VALUE', self.arcpy.sa.RemapRange(ranges), 'NODATA')
+
+    def reclassify_value(self, raster, values):
+        return self.arcpy.sa.Reclassify(raster, 'VALUE', self.arcpy.sa.RemapValue(values), 'NODATA')
+
+    def distance(self, features, max_distance=None):
+        distance = self.arcpy.sa.DistanceAccumulation(features)
+        if max_distance is not None:
+            distance = self.arcpy.sa.Con(distance > max_distance, max_distance, distance)
+        return distance
+
+    def rescale(self, raster, function, args, from_scale, to_scale, max_distance=None):
+        transform = getattr(self.arcpy.sa, function)(*args)
+        return self.arcpy.sa.RescaleByFunction(raster, transform, from_scale, to_scale)
+
+    def raster_to_polygon(self, raster, output):
+        self.arcpy.conversion.RasterToPolygon(raster, output, 'SIMPLIFY', 'VALUE')
+
+    def calculate_area(self, polygons, field):
+        self.arcpy.management.CalculateGeometryAttributes(polygons, f'{field} AREA', None, 'SQUARE_METERS', None, 'SAME_AS_INPUT')
+
+    def polygon_to_raster(self, polygons, field, output, where=None):
+        if where:
+            polygons = self.arcpy.SelectLayerByAttribute_management(polygons, 'NEW_SELECTION', where)
+        self.arcpy.conversion.PolygonToRaster(polygons, field, output)
+
+    def extract_regions(self, suitability, threshold, min_area, output, table, polygons=None):
+        # Spatial Analyst has no streaming region labeller, so this keeps the vector round trip
+        arcpy = self.arcpy
+        polygons = polygons or os.path.join(arcpy.env.scratchFolder, 'regions.shp')
+
+        binary = self.reclassify_range(self.read(suitability), [[threshold, MAXIMUM_SCORE, 1]])
+        self.raster_to_polygon(binary, polygons)
+        self.calculate_area(polygons, 'SHAPE_AREA')
+        small = arcpy.management.MakeFeatureLayer(polygons, 'small_regions', f'SHAPE_AREA < {min_area}')
+        arcpy.management.DeleteFeatures(small)
+
+        arcpy.management.AddField(polygons, 'region', 'LONG')
+        arcpy.management.CalculateField(polygons, 'region', '!FID! + 1', 'PYTHON3')
+        self.polygon_to_raster(polygons, 'region', output)
+
+        statistics = arcpy.sa.ZonalStatisticsAsTable(output, 'VALUE', suitability, 'memory/region_statistics', 'DATA', 'ALL')
+        scores = {row[0]: row[1:] for row in arcpy.da.SearchCursor(statistics, ['VALUE', 'COUNT', 'MEAN', 'MAX'])}
+        rows = []
+        for region, area, shape in arcpy.da.SearchCursor(polygons, ['region', 'SHAPE_AREA', 'SHAPE@']):
+            count, mean, highest = scores.get(region, (0, None, None))
+            extent = shape.extent
+            rows.append({'region': region, 'cells': count, 'area': area, 'mean_score': mean, 'max_score': highest,
+                         'xmin': extent.XMin, 'ymin': extent.YMin, 'xmax': extent.XMax, 'ymax': extent.YMax})
+        write_region_table(os.path.join(self.env.workspace, table), rows)
+        return rows
+
+
+class GridSpec:
+    # Origin (upper left corner), cell size, shape and coordinate system of an analysis grid
+    def __init__(self, x0, y0, cell_size, rows, cols, wkt):
+        self.x0 = x0
+        self.y0 = y0
+        self.cell_size = cell_size
+        self.rows = rows
+        self.cols = cols
+        self.wkt = wkt
+
+    def geotransform(self, window=None):
+        # Geotransform of the whole grid, or of a window of it
+        row, col = (window.row, window.col) if window else (0, 0)
+        return (self.x0 + col * self.cell_size, self.cell_size, 0.0, self.y0 - row * self.cell_size, 0.0, -self.cell_size)
+
+    def bounds(self):
+        return (self.x0, self.y0 - self.rows * self.cell_size, self.x0 + self.cols * self.cell_size, self.y0)
+
+    def matches(self, dataset):
+        expected = self.geotransform()
+        actual = dataset.GetGeoTransform()
+        return (dataset.RasterXSize == self.cols and dataset.RasterYSize == self.rows
+                and all(math.isclose(a, b, abs_tol=1e-6) for a, b in zip(actual, expected)))
+
+
+class Grid:
+    """Lazily evaluated raster on the analysis grid.
+
+    compute(window) returns the float32 cells of a window with NoData as NaN, so NoData
+    propagates through raster algebra. Nothing is evaluated until the raster is saved,
+    which streams it tile by tile. halo is how far outside a window compute() reads and
+    cell_bytes roughly how much memory it needs per cell, and both size the tiles.
+    """
+
+    def __init__(self, compute, spec, halo=0, cell_bytes=4):
+        self.compute = compute
+        self.spec = spec
+        self.halo = halo
+        self.cell_bytes = cell_bytes
+
+    def _apply(self, other, op):
+        if isinstance(other, Grid):
+            return Grid(lambda window: op(self.compute(window), other.compute(window)), self.spec,
+                        max(self.halo, other.halo), self.cell_bytes + other.cell_bytes)
+        return Grid(lambda window: op(self.compute(window), other), self.spec, self.halo, self.cell_bytes)
+
+    def __add__(self, other):
+        return self._apply(other, np.add)
+
+    def __radd__(self, other):
+        return self._apply(other, np.add)
+
+    def __sub__(self, other):
+        return self._apply(other, np.subtract)
+
+    def __rsub__(self, other):
+        return self._apply(other, lambda a, b: np.subtract(b, a))
+
+    def __mul__(self, other):
+        return self._apply(other, np.multiply)
+
+    def __rmul__(self, other):
+        return self._apply(other, np.multiply)
+
+    def __truediv__(self, other):
+        return self._apply(other, np.true_divide)
+
+    def map(self, func, cell_bytes=8):
+        # Cell-by-cell operation on each window
+        return Grid(lambda window: func(self.compute(window)), self.spec, self.halo, self.cell_bytes + cell_bytes)
+
+
+def horn_slope(padded, cell_size):
+    # Slope in degrees of the interior of an array padded by one cell on every side (Horn's method).
+    # NoData neighbours take the centre cell's value like ArcGIS.
+    rows, cols = padded.shape[0] - 2, padded.shape[1] - 2
+    z = padded[1:-1, 1:-1]
+
+    def neighbour(dy, dx):
+        values = padded[1 + dy:1 + dy + rows, 1 + dx:1 + dx + cols]
+        return np.where(np.isnan(values), z, values)
+
+    a, b, c = neighbour(-1, -1), neighbour(-1, 0), neighbour(-1, 1)
+    d, f = neighbour(0, -1), neighbour(0, 1)
+    g, h, i = neighbour(1, -1), neighbour(1, 0), neighbour(1, 1)
+
+    dz_dx = ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * cell_size)
+    dz_dy = ((g + 2 * h + i) - (a + 2 * b + c)) / (8 * cell_size)
+    return np.degrees(np.arctan(np.hypot(dz_dx, dz_dy))).astype(np.float32)
+
+
+class NumpyEngine(Engine):
+    """Engine built on NumPy and GDAL that runs without an ArcGIS licence.
+
+    Every raster is resampled (nearest neighbour) onto an analysis grid built the same
+    way the arcpy environment settings build it: the extent layer's bounds snapped to
+    the snap raster's cell edges at the configured cell size. Cells outside the mask
+    layer are written as NoData.
+
+    Rasters are processed out of core: reads, raster algebra, slope, reclassify,
+    rescale and bounded distances are evaluated tile by tile with tiles sized so a
+    tile's working set stays within env.memory_mb, whatever the extent. With
+    env.threads > 1 tiles are computed concurrently (the memory limit is shared between
+    the tiles in flight) and written in order from the calling thread.
+    """
+
+    name = 'numpy'
+
+    def __init__(self, env):
+        super().__init__(env)
+        if np is None or gdal is None:
+            raise ImportError('The numpy engine requires numpy and GDAL (osgeo)')
+        self._spec = None
+        # GDAL handles and the mask cache are per thread
+        self._local = threading.local()
+        # Rasters being written, by partial file: (output path, storage format)
+        self._partial = {}
+
+    def path(self, path):
+        return os.path.join(self.env.workspace, path)
+
+    def srs(self):
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(self.env.epsg)
+        return srs
+
+    def spec(self):
+        if self._spec is not None:
+            return self._spec
+
+        layer_ds = ogr.Open(self.path(self.env.extent))
+        min_x, max_x, min_y, max_y = layer_ds.GetLayer().GetExtent()
+        cell = float(self.env.cell_size)
+
+        # Snap the extent outwards to the snap raster's cell edges; without a snap raster the grid starts at the extent
+        snap_x, snap_y = min_x, max_y
+        if self.env.snap_raster:
+            if not os.path.exists(self.path(self.env.snap_raster)):
+                raise FileNotFoundError(f'Snap raster {self.env.snap_raster} does not exist; run the stage that produces it '
+                                        f'first or set snap_raster to an existing raster')
+            transform = gdal.Open(self.path(self.env.snap_raster)).GetGeoTransform()
+            snap_x, snap_y = transform[0], transform[3]
+
+        x0 = snap_x + math.floor((min_x - snap_x) / cell) * cell
+        x1 = snap_x + math.ceil((max_x - snap_x) / cell) * cell
+        y0 = snap_y - math.floor((snap_y - max_y) / cell) * cell
+        y1 = snap_y - math.ceil((snap_y - min_y) / cell) * cell
+
+        self._spec = GridSpec(x0, y0, cell, int(round((y0 - y1) / cell)), int(round((x1 - x0) / cell)), self.srs().ExportToWkt())
+        return self._spec
+
+    def in_flight(self):
+        return 1 if self.env.threads <= 1 else 2 * self.env.threads
+
+    def tiles(self, cell_bytes, halo=0):
+        spec = self.spec()
+        return windows(spec.rows, spec.cols, tile_size_for(self.env.memory_mb / self.in_flight(), cell_bytes, halo, BLOCK_SIZE))
+
+    def map_tiles(self, func, tiles):
+        # Yields (window, func(window)) in order, computing up to in_flight() tiles concurrently
+        if self.env.threads <= 1:
+            for window in tiles:
+                yield window, func(window)
+            return
+
+        with ThreadPoolExecutor(self.env.threads) as pool:
+            queue = deque()
+            for window in tiles:
+                queue.append((window, pool.submit(func, window)))
+                if len(queue) >= self.in_flight():
+                    window, future = queue.popleft()
+                    yield window, future.result()
+            while queue:
+                window, future = queue.popleft()
+                yield window, future.result()
+
+    def temporary_array(self, dtype):
+        # Grid sized array backed by a temporary file in the workspace, removed once the array is no longer used
+        spec = self.spec()
+        return np.memmap(tempfile.TemporaryFile(dir=self.env.workspace), dtype, 'w+', shape=(spec.rows, spec.cols))
+
+    def memory_raster(self, data_type, window, fill=None):
+        spec = self.spec()
+        ds = gdal.GetDriverByName('MEM').Create('', window.cols, window.rows, 1, data_type)
+        ds.SetGeoTransform(spec.geotransform(window))
+        ds.SetProjection(spec.wkt)
+        if fill is not None:
+            ds.GetRasterBand(1).SetNoDataValue(fill)
+            ds.GetRasterBand(1).Fill(fill)
+        return ds
+
+    def rasterize(self, features, window, **options):
+        ds = self.memory_raster(gdal.GDT_Byte, window, 0)
+        layer_ds = ogr.Open(self.path(features))
+        gdal.RasterizeLayer(ds, [1], layer_ds.GetLayer(), burn_values=[1], options=[f'{k}={v}' for k, v in options.items()])
+        return ds.GetRasterBand(1).ReadAsArray().astype(bool)
+
+    def mask(self, window):
+        # Analysis mask for a window; the last window is kept because several outputs are often written per window
+        if not self.env.mask:
+            return np.ones((window.rows, window.cols), bool)
+        cached = getattr(self._local, 'mask', None)
+        if cached is None or cached[0] != window:
+            cached = self._local.mask = (window, self.rasterize(self.env.mask, window))
+        return cached[1]
+
+    def open(self, path):
+        # Open a raster aligned to the analysis grid; unaligned rasters are warped lazily through a VRT
+        spec = self.spec()
+        ds = gdal.Open(self.path(path))
+        if not spec.matches(ds):
+            ds = gdal.Warp('', ds, format='VRT', outputBounds=spec.bounds(), width=spec.cols, height=spec.rows,
+                           dstSRS=spec.wkt, resampleAlg='near', dstNodata=NODATA)
+        return ds
+
+    def read_window(self, ds, window):
+        # Values as float32 with NoData as NaN; quantized rasters are scaled back to their values
+        band = ds.GetRasterBand(1)
+        stored = band.ReadAsArray(window.col, window.row, window.cols, window.rows)
+        array = stored.astype(np.float32)
+        nodata = band.GetNoDataValue()
+        if nodata is not None:
+            array[stored == np.array(nodata).astype(stored.dtype)] = np.nan
+        scale, offset = band.GetScale() or 1.0, band.GetOffset() or 0.0
+        if scale != 1.0 or offset != 0.0:
+            array = array * np.float32(scale) + np.float32(offset)
+        return array
+
+    def create(self, path, kind='float'):
+        # Tiles are written to a plain tiled GeoTIFF next to the output; finish() turns it into a COG
+        spec = self.spec()
+        raster_format = FORMATS[kind]
+        output = self.path(path)
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        partial = output + '.partial.tif'
+        ds = gdal.GetDriverByName('GTiff').Create(partial, spec.cols, spec.rows, 1, gdal.GetDataTypeByName(raster_format.gdal_type),
+                                                  ['TILED=YES', f'BLOCKXSIZE={BLOCK_SIZE}', f'BLOCKYSIZE={BLOCK_SIZE}',
+                                                   'COMPRESS=DEFLATE', 'ZLEVEL=1', 'BIGTIFF=IF_SAFER'])
+        ds.SetGeoTransform(spec.geotransform())
+        ds.SetProjection(spec.wkt)
+        band = ds.GetRasterBand(1)
+        band.SetNoDataValue(raster_format.nodata)
+        if raster_format.scale != 1.0 or raster_format.offset != 0.0:
+            band.SetScale(raster_format.scale)
+            band.SetOffset(raster_format.offset)
+        self._partial[partial] = (output, raster_format)
+        return ds
+
+    def encode(self, window, array, kind='float'):
+        # Cells outside the analysis mask and NaN cells become NoData
+        return FORMATS[kind].encode(array, self.mask(window))
+
+    def write_window(self, ds, window, array):
+        ds.GetRasterBand(1).WriteArray(array, window.col, window.row)
+
+    def finish(self, ds):
+        """Close a raster from create() and write it as a compressed Cloud Optimized GeoTIFF with overviews."""
+        partial = ds.GetDescription()
+        output, raster_format = self._partial.pop(partial)
+        ds.FlushCache()
+        ds = None
+
+        options = ['COMPRESS=DEFLATE', 'PREDICTOR=YES', f'BLOCKSIZE={BLOCK_SIZE}', 'BIGTIFF=IF_SAFER',
+                   f'RESAMPLING={raster_format.resampling}', f'NUM_THREADS={max(self.env.threads, 1)}']
+        if gdal.GetDriverByName('COG') is not None:
+            gdal.Translate(output, partial, format='COG', creationOptions=options)
+            gdal.GetDriverByName('GTiff').Delete(partial)
+        else:
+            # GDAL before 3.1 has no COG driver; internal overviews on the tiled GeoTIFF come closest
+            ds = gdal.Open(partial, gdal.GA_Update)
+            ds.BuildOverviews(raster_format.resampling, [2 ** level for level in range(1, 8)
+                                                         if max(ds.RasterXSize, ds.RasterYSize) >> level >= BLOCK_SIZE // 2])
+            ds = None
+            gdal.GetDriverByName('GTiff').Rename(output, partial)
+
+    def read(self, path):
+        spec = self.spec()
+        local = threading.local()
+
+        def compute(window):
+            # GDAL datasets must not be shared between threads
+            if not hasattr(local, 'ds'):
+                local.ds = self.open(path)
+            return self.read_window(local.ds, window)
+
+        return Grid(compute, spec)
+
+    def save(self, raster, path, kind='float'):
+        ds = self.create(path, kind)
+        # The output tile and the mask are alive alongside the raster's own working set
+        tiles = self.tiles(raster.cell_bytes + 5, raster.halo)
+        for window, array in self.map_tiles(lambda window: self.encode(window, raster.compute(window), kind), tiles):
+            self.write_window(ds, window, array)
+        self.finish(ds)
+
+    def clip_bounds(self, clip, margin):
+        # (min x, min y, max x, max y) of the clip layer grown by margin
+        min_x, max_x, min_y, max_y = ogr.Open(self.path(clip)).GetLayer().GetExtent()
+        return min_x - margin, min_y - margin, max_x + margin, max_y + margin
+
+    def project_raster(self, source, output, resampling, clip=None, margin=0):
+        # Clipping happens inside the warp, so cells outside the clip extent are never resampled
+        gdal.Warp(self.path(output), self.path(source), dstSRS=self.crs_name(), resampleAlg=RESAMPLING[resampling],
+                  outputBounds=self.clip_bounds(clip, margin) if clip else None, multithread=self.env.threads > 1,
+                  warpOptions=[f'NUM_THREADS={max(self.env.threads, 1)}'],
+                  creationOptions=['TILED=YES', 'COMPRESS=DEFLATE', 'PREDICTOR=YES', 'BIGTIFF=IF_SAFER'])
+
+    def delete_features(self, path):
+        driver = ogr.GetDriverByName('ESRI Shapefile')
+        if os.path.exists(path):
+            driver.DeleteDataSource(path)
+        return driver
+
+    def project_features(self, source, output, clip=None, margin=0):
+        self.delete_features(self.path(output))
+        gdal.VectorTranslate(self.path(output), self.path(source), dstSRS=self.crs_name(), reproject=True,
+                             spatFilter=self.clip_bounds(clip, margin) if clip else None,
+                             spatSRS=self.crs_name() if clip else None)
+
+    def select_features(self, source, where, output, dissolve=False):
+        where = ' '.join(where.split())
+        if not dissolve:
+            self.delete_features(self.path(output))
+            gdal.VectorTranslate(self.path(output), self.path(source), where=where)
+            return
+
+        source_ds = ogr.Open(self.path(source))
+        layer = source_ds.GetLayer()
+        layer.SetAttributeFilter(where)
+        dissolved = None
+        for feature in layer:
+            geometry = feature.GetGeometryRef()
+            dissolved = geometry.Clone() if dissolved is None else dissolved.Union(geometry)
+
+        driver = self.delete_features(self.path(output))
+        output_ds = driver.CreateDataSource(self.path(output))
+        output_layer = output_ds.CreateLayer(os.path.splitext(os.path.basename(output))[0], layer.GetSpatialRef(), ogr.wkbMultiPolygon)
+        feature = ogr.Feature(output_layer.GetLayerDefn())
+        feature.SetGeometry(dissolved)
+        output_layer.CreateFeature(feature)
+
+    def slope(self, raster):
+        spec = raster.spec
+
+        def compute(window):
+            # One cell halo; cells beyond the raster edge are NoData
+            outer, pad = expand(window, 1, spec.rows, spec.cols)
+            padded = np.pad(raster.compute(outer).astype(np.float64), pad, constant_values=np.nan)
+            return horn_slope(padded, spec.cell_size)
+
+        return Grid(compute, spec, raster.halo + 1, raster.cell_bytes + 80)
+
+    def reclassify_range(self, raster, ranges):
+        return raster.map(lambda values: remap_range(values, ranges))
+
+    def reclassify_value(self, raster, values):
+        return raster.map(lambda cells: remap_value(cells, values), cell_bytes=16)
+
+    def distance(self, features, max_distance=None):
+        spec = self.spec()
+
+        if max_distance is None:
+            # Without a maximum distance every cell can depend on any source, so the whole grid is computed at once
+            cache = {}
+            lock = threading.Lock()
+
+            def compute(window):
+                with lock:
+                    if 'distance' not in cache:
+                        full = Window(0, 0, spec.rows, spec.cols)
+                        sources = self.rasterize(features, full, ALL_TOUCHED='TRUE')
+                        distance = euclidean_distance(sources, spec.cell_size)
+                        # No sources at all is NoData, like ArcGIS
+                        cache['distance'] = np.where(np.isinf(distance), np.nan, distance).astype(np.float32)
+                return crop(cache['distance'], Window(0, 0, spec.rows, spec.cols), window).copy()
+
+            return Grid(compute, spec)
+
+        # Any source within max_distance of a cell lies within reach cells of it. The transform is separable:
+        # first each column's distance to its nearest source (capped at reach), then a pass along each row.
+        # Each pass reads a halo of reach cells along one axis only, so the memory a strip needs grows with
+        # the cap instead of its square. Both passes run over the whole grid the first time a window is
+        # asked for and keep their results in temporary files in the workspace.
+        reach = int(math.ceil(max_distance / spec.cell_size))
+        memory_mb = self.env.memory_mb / self.in_flight()
+        cache = {}
+        lock = threading.Lock()
+
+        def column_pass(window):
+            row0, row1 = max(window.row - reach, 0), min(window.row + window.rows + reach, spec.rows)
+            outer = Window(row0, window.col, row1 - row0, window.cols)
+            sources = self.rasterize(features, outer, ALL_TOUCHED='TRUE')
+            return crop(capped_column_distances(sources, reach), outer, window)
+
+        def row_pass(columns, window):
+            col0, col1 = max(window.col - reach, 0), min(window.col + window.cols + reach, spec.cols)
+            outer = Window(window.row, col0, window.rows, col1 - col0)
+            distance = capped_row_distances(crop(columns, Window(0, 0, spec.rows, spec.cols), outer), spec.cell_size, max_distance)
+            return crop(distance, outer, window)
+
+        def distances():
+            columns = self.temporary_array(np.uint16 if reach < np.iinfo(np.uint16).max else np.uint32)
+            # Strips a block wide (narrower if memory is short) and as tall as memory allows: the source mask,
+            # column distances and their work arrays
+            shortest = min(spec.rows, MIN_TILE_SIZE + 2 * reach)
+            width = min(spec.cols, BLOCK_SIZE, max(MIN_TILE_SIZE, int(memory_mb * 2 ** 20 / (41 * shortest))))
+            length = strip_length_for(memory_mb, 41, width, reach, BLOCK_SIZE, spec.rows)
+            for window, values in self.map_tiles(column_pass, windows(spec.rows, spec.cols, length, width)):
+                columns[window.row:window.row + window.rows, window.col:window.col + window.cols] = values
+
+            # Rows are transformed together, so strips 2 x reach wide balance the columns read beside each
+            # strip against how many rows fit; the column distances, the envelope arrays and the output
+            out = self.temporary_array(np.float32)
+            width = min(spec.cols, max(BLOCK_SIZE, 2 * reach))
+            length = strip_length_for(memory_mb, 72, min(spec.cols, width + 2 * reach), total=spec.rows)
+            strips = windows(spec.rows, spec.cols, length, width)
+            for window, values in self.map_tiles(lambda window: row_pass(columns, window), strips):
+                out[window.row:window.row + window.rows, window.col:window.col + window.cols] = values
+            return out
+
+        def compute(window):
+            with lock:
+                if 'distance' not in cache:
+                    cache['distance'] = distances()
+            return np.array(crop(cache['distance'], Window(0, 0, spec.rows, spec.cols), window))
+
+        return Grid(compute, spec)
+
+    def rescale(self, raster, function, args, from_scale, to_scale, max_distance=None):
+        transform = Rescale(function, args, from_scale, to_scale)
+        if max_distance is not None and distance_table_size(raster.spec.cell_size, max_distance) <= MAX_TABLE_SIZE:
+            # Capped distances take few distinct values, so the function is evaluated once per value
+            return raster.map(DistanceLookup(transform, raster.spec.cell_size, max_distance), cell_bytes=12)
+        return raster.map(transform, cell_bytes=24)
+
+    def raster_to_polygon(self, raster, output):
+        # Stream the raster to a temporary GeoTIFF so GDAL can polygonize it line by line
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(self.path(output)) or None) as folder:
+            values = os.path.join(folder, 'values.tif')
+            self.save(raster, os.path.relpath(values, self.env.workspace))
+            values_ds = gdal.Open(values)
+            band = values_ds.GetRasterBand(1)
+
+            driver = self.delete_features(self.path(output))
+            output_ds = driver.CreateDataSource(self.path(output))
+            layer = output_ds.CreateLayer(os.path.splitext(os.path.basename(output))[0], self.srs(), ogr.wkbPolygon)
+            layer.CreateField(ogr.FieldDefn('gridcode', ogr.OFTInteger))
+            gdal.Polygonize(band, band.GetMaskBand(), layer, 0)
+            values_ds = band = None
+
+    def calculate_area(self, polygons, field):
+        ds = ogr.Open(self.path(polygons), 1)
+        layer = ds.GetLayer()
+        if layer.FindFieldIndex(field, True) < 0:
+            layer.CreateField(ogr.FieldDefn(field, ogr.OFTReal))
+        layer.ResetReading()
+        for feature in layer:
+            feature.SetField(field, feature.GetGeometryRef().GetArea())
+            layer.SetFeature(feature)
+
+    def polygon_to_raster(self, polygons, field, output, where=None):
+        layer_ds = ogr.Open(self.path(polygons))
+        layer = layer_ds.GetLayer()
+        if where:
+            layer.SetAttributeFilter(' '.join(where.split()))
+
+        target = self.create(output)
+        for window in self.tiles(8 + 4 + 5):
+            ds = self.memory_raster(gdal.GDT_Float64, window, NODATA)
+            gdal.RasterizeLayer(ds, [1], layer, options=[f'ATTRIBUTE={field}'])
+            array = ds.GetRasterBand(1).ReadAsArray()
+            self.write_window(target, window, self.encode(window, np.where(array == NODATA, np.nan, array)))
+        self.finish(target)
+
+    def extract_regions(self, suitability, threshold, min_area, output, table, polygons=None):
+        return extract_regions(self, suitability, threshold, min_area, output, table, polygons)
+
+    def weighted_overlay(self, criteria, weights, masks, variants, outputs, variant_outputs=None, transforms=None):
+        # Single pass over the analysis grid: each input tile is read once and every output tile written once
+        sources = [self.criterion(path, transform) for path, transform in zip(criteria, transforms or [None] * len(criteria))]
+        mask_sources = [self.read(path) for path in masks]
+        variant_sources = [self.read(path) for path in variants]
+
+        targets = [self.create(path, 'score') for path in outputs]
+        variant_targets = [self.create(path, 'mask') for path in variant_outputs or []]
+
+        def compute(window):
+            stack = np.stack([grid.compute(window) for grid in sources])
+            tiles = fused_overlay(stack, weights,
+                                  [grid.compute(window) for grid in mask_sources],
+                                  [grid.compute(window) for grid in variant_sources])
+            encoded = []
+            for kind, *index, tile in tiles:
+                if kind == 'mask':
+                    if variant_targets:
+                        encoded.append((variant_targets[index[0]], self.encode(window, tile, 'mask')))
+                else:
+                    i, j = index
+                    encoded.append((targets[i * len(variants) + j], self.encode(window, tile, 'score')))
+            return encoded
+
+        # Input tiles, per weight set sums, final masks, the score buffer and every encoded output tile
+        layers = len(criteria) + len(masks) + 2 * len(variants) + len(weights) + 1 + len(outputs) + len(variant_targets)
+        for window, encoded in self.map_tiles(compute, self.tiles(4 * layers + 5)):
+            for ds, array in encoded:
+                self.write_window(ds, window, array)
+
+        for ds in targets + variant_targets:
+            self.finish(ds)
+
+
+ENGINES = {
+    'arcpy': ArcpyEngine,
+    'numpy': NumpyEngine,
+}
+
+_engines = {}
+
+
+def get_engine(env):
+    # One engine per process and environment, so the analysis grid and mask are only built once
+    key = tuple(sorted(vars(env).items()))
+    if key not in _engines:
+        if env.engine not in ENGINES:
+            raise ValueError(f'Unknown engine {env.engine!r}; choose from {", ".join(ENGINES)}')
+        _engines[key] = ENGINES[env.engine](env)
+    return _engines[key]
@@ -0,0 +1,74 @@
+import numpy as np
+
+# NoData of float rasters; matches the arcpy default for 32 bit float output
+NODATA = -3.4028234663852886e+38
+
+# Internal tile edge of written rasters; processing tiles are aligned to it so each block is decoded once
+BLOCK_SIZE = 512
+
+
+class RasterFormat:
+    """How values of one kind of raster are stored on disk.
+
+    Values are stored as round((value - offset) / scale) in dtype, with nodata for
+    NaN and masked cells. Readers apply the scale and offset stored with the raster,
+    so quantized rasters read back as floats within scale / 2 of the value written.
+    resampling is used for the overviews.
+    """
+
+    def __init__(self, name, dtype, gdal_type, nodata, scale=1.0, offset=0.0, resampling='NEAREST'):
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self.gdal_type = gdal_type
+        self.nodata = nodata
+        self.scale = scale
+        self.offset = offset
+        self.resampling = resampling
+
+    def limits(self):
+        # Smallest and largest storable value other than nodata
+        if self.dtype.kind == 'f':
+            return -np.inf, np.inf
+        info = np.iinfo(self.dtype)
+        low, high = info.min, info.max
+        if self.nodata == low:
+            low += 1
+        if self.nodata == high:
+            high -= 1
+        return low * self.scale + self.offset, high * self.scale + self.offset
+
+    def encode(self, array, valid):
+        # Typed array of array's values; cells that are not valid or NaN become nodata
+        valid = valid & ~np.isnan(array)
+        if self.dtype.kind == 'f':
+            return np.where(valid, array, self.nodata).astype(self.dtype)
+
+        values = array[valid]
+        if values.size:
+            low, high = self.limits()
+            if values.min() < low - self.scale / 2 or values.max() > high + self.scale / 2:
+                raise ValueError(f'Values from {values.min():g} to {values.max():g} do not fit {self.name} rasters '
+                                 f'({low:g} to {high:g})')
+        stored = np.rint((np.where(valid, array, self.offset) - self.offset) / self.scale)
+        return np.where(valid, stored, self.nodata).astype(self.dtype)
+
+
+# 0/1 masks and category ids; DEFLATE packs runs of a byte per cell close to one bit per cell
+MASK = RasterFormat('mask', np.uint8, 'Byte', 255)
+
+# Rescaled criteria and suitability scores (1 to 10 times the weight sum) to within 1/4096. Scores are
+# rounded to the nearest 1/2048, so one within 1/4096 below a threshold can read back at it (7.4999
+# is stored as 7.5); thresholds compare the stored values, not the unrounded ones
+SCORE = RasterFormat('score', np.uint16, 'UInt16', 65535, scale=1 / 2048, resampling='AVERAGE')
+
+# Largest weight sum whose scores (at most 10 times the sum) fit SCORE rasters; just under 3.2, as a score of 32 does not fit
+MAX_WEIGHT_SUM = SCORE.limits()[1] / 10
+
+DISTANCE = RasterFormat('distance', np.float32, 'Float32', NODATA, resampling='AVERAGE')
+
+# Region ids from 1; 0 is outside every region
+REGION = RasterFormat('region', np.uint32, 'UInt32', 0)
+
+FLOAT = RasterFormat('float', np.float32, 'Float32', NODATA, resampling='AVERAGE')
+
+FORMATS = {raster_format.name: raster_format for raster_format in (MASK, SCORE, DISTANCE, REGION, FLOAT)}
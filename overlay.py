@@ -0,0 +1,33 @@
+import numpy as np
+
+
+def fused_overlay(criteria, weights, masks, variants):
+    """Weighted overlay of every weight set against every mask variant for one tile.
+
+    criteria is a (k, rows, cols) stack of criterion tiles, weights an (m, k) matrix with
+    one weight set per row, masks a list of tiles shared by every variant and variants a
+    list of tiles that each produce their own final mask. The weighted sums are computed
+    once per weight set and the shared mask product once per tile, so the cost no longer
+    grows with weight sets x variants full raster passes.
+
+    Yields ('mask', j, tile) for each final mask and then ('score', i, j, tile) for each
+    weight set i and variant j. The score buffer is reused between yields, so callers
+    must write or copy a tile before asking for the next one.
+    """
+    base = masks[0].copy()
+    for mask in masks[1:]:
+        base *= mask
+
+    final_masks = []
+    for j, variant in enumerate(variants):
+        final_mask = base * variant
+        final_masks.append(final_mask)
+        yield 'mask', j, final_mask
+
+    # (m, k) x (k, rows, cols) -> (m, rows, cols); NoData (NaN) in any criterion propagates to the score
+    scores = np.tensordot(np.asarray(weights, dtype=criteria.dtype), criteria, axes=1)
+    out = np.empty_like(base)
+    for i in range(scores.shape[0]):
+        for j, final_mask in enumerate(final_masks):
+            np.multiply(scores[i], final_mask, out=out)
+            yield 'score', i, j, out
@@ -0,0 +1,272 @@
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from contextlib import nullcontext
+
+from profiling import RunReport, measure
+
+# Files that together make up a single shapefile dataset
+SHAPEFILE_PARTS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+
+
+def as_paths(value):
+    # Stage inputs/outputs may be a single path or a list of paths
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def function_name(func):
+    # module.name of a stage function; a script run directly is named by its file, so running workflow.py
+    # and importing workflow from another script give the same fingerprints
+    module = func.__module__
+    if module == '__main__':
+        module = os.path.splitext(os.path.basename(getattr(sys.modules['__main__'], '__file__', '') or module))[0]
+    return f'{module}.{func.__qualname__}'
+
+
+def dataset_files(path):
+    # A shapefile is only unchanged if all of its sidecar files are unchanged
+    root, ext = os.path.splitext(path)
+    if ext.lower() != '.shp':
+        return [path]
+    return [root + part for part in SHAPEFILE_PARTS if os.path.exists(root + part)]
+
+
+class Stage:
+    """A named step of the model with declared inputs, outputs and parameters.
+
+    The stage function is called as func(context, **inputs, **outputs, **params),
+    so each input/output role and parameter becomes a keyword argument.
+    """
+
+    def __init__(self, name, func, inputs=None, outputs=None, params=None):
+        self.name = name
+        self.func = func
+        self.inputs = dict(inputs or {})
+        self.outputs = dict(outputs or {})
+        self.params = dict(params or {})
+
+    def run(self, context):
+        return self.func(context, **self.inputs, **self.outputs, **self.params)
+
+
+class Pipeline:
+    """Dependency graph of stages that skips stages whose fingerprint is unchanged.
+
+    A stage's fingerprint is a hash of its function, parameters, outputs, the shared
+    context and its inputs. Inputs produced by another stage contribute that stage's
+    fingerprint; all other inputs contribute a hash of their file contents.
+    """
+
+    def __init__(self, workspace, context=None, cache_file='.stage_cache.json'):
+        self.workspace = workspace
+        self.context = context
+        self.cache_path = os.path.join(workspace, cache_file)
+        self.stages = {}
+        self.producers = {}
+
+    def add(self, stage):
+        if stage.name in self.stages:
+            raise ValueError(f'Duplicate stage name {stage.name!r}')
+
+        for value in stage.outputs.values():
+            for path in as_paths(value):
+                key = os.path.normpath(path)
+                if key in self.producers:
+                    raise ValueError(f'{path} is produced by both {self.producers[key]!r} and {stage.name!r}')
+                self.producers[key] = stage.name
+
+        self.stages[stage.name] = stage
+        return stage
+
+    def produces(self, path):
+        return os.path.normpath(path) in self.producers
+
+    def upstream(self, stage):
+        names = []
+        for value in stage.inputs.values():
+            for path in as_paths(value):
+                producer = self.producers.get(os.path.normpath(path))
+                if producer is not None and producer not in names:
+                    names.append(producer)
+        return names
+
+    def order(self, targets=None):
+        # Depth first topological sort of the targets and everything upstream of them
+        ordered = []
+        state = {}
+
+        def visit(name):
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise ValueError(f'Stage {name!r} depends on itself')
+            state[name] = 'visiting'
+            for upstream in self.upstream(self.stages[name]):
+                visit(upstream)
+            state[name] = 'done'
+            ordered.append(name)
+
+        for name in targets or self.stages:
+            if name not in self.stages:
+                raise KeyError(f'Unknown stage {name!r}')
+            visit(name)
+
+        return ordered
+
+    def path(self, path):
+        return os.path.join(self.workspace, path)
+
+    def file_digest(self, path, files):
+        # Content hashes are cached by size and modification time so large sources are only read once
+        digests = []
+        for part in dataset_files(self.path(path)):
+            stat = os.stat(part)
+            cached = files.get(part)
+            if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+                digests.append(cached[2])
+                continue
+
+            sha = hashlib.sha256()
+            with open(part, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(chunk)
+            files[part] = [stat.st_size, stat.st_mtime_ns, sha.hexdigest()]
+            digests.append(sha.hexdigest())
+
+        return digests or None
+
+    def context_fingerprint(self):
+        # Contexts can leave out settings that do not change results (such as memory limits)
+        if self.context is None:
+            return None
+        if hasattr(self.context, 'fingerprint'):
+            return self.context.fingerprint()
+        return vars(self.context)
+
+    def fingerprint(self, stage, fingerprints, files):
+        inputs = {}
+        for role, value in stage.inputs.items():
+            inputs[role] = []
+            for path in as_paths(value):
+                producer = self.producers.get(os.path.normpath(path))
+                if producer is not None:
+                    inputs[role].append(fingerprints[producer])
+                else:
+                    inputs[role].append(self.file_digest(path, files))
+
+        description = {
+            'function': function_name(stage.func),
+            'params': stage.params,
+            'inputs': inputs,
+            'outputs': stage.outputs,
+            'context': self.context_fingerprint(),
+        }
+        encoded = json.dumps(description, sort_keys=True, default=repr)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def outputs_exist(self, stage):
+        return all(os.path.exists(self.path(path)) for value in stage.outputs.values() for path in as_paths(value))
+
+    def load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return {'stages': {}, 'files': {}}
+        with open(self.cache_path) as f:
+            return json.load(f)
+
+    def save_cache(self, cache):
+        with open(self.cache_path, 'w') as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+
+    def files(self, stage, role):
+        # Every file behind a stage's inputs or outputs, shapefile sidecars included
+        values = getattr(stage, role).values()
+        return [part for value in values for path in as_paths(value) for part in dataset_files(self.path(path))]
+
+    def submit(self, pool, stage):
+        # Stages are measured where they run, so a pool worker reports its own time, memory and I/O
+        if pool is not None:
+            return pool.submit(measure, stage.run, self.context)
+
+        # Run in this process when there is no pool, but report through a future the same way
+        future = Future()
+        try:
+            future.set_result(measure(stage.run, self.context))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+    def run(self, targets=None, force=False, jobs=1, report=None):
+        """Run the targets (default: every stage) and anything out of date upstream of them.
+
+        Stages whose upstream stages have all finished are independent of each other, so
+        with jobs > 1 they run concurrently on a pool of that many processes. Stage
+        functions and the context must then be picklable (module level functions).
+
+        Every stage is profiled (see profiling.RunReport); the report is kept as
+        self.report and, with report set to a path prefix in the workspace, written
+        to report.json and report.csv.
+        """
+        self.report = RunReport()
+        cache = self.load_cache()
+        fingerprints = {}
+        executed = []
+        pending = self.order(targets)
+        running = {}
+        failure = None
+
+        with ProcessPoolExecutor(jobs) if jobs > 1 else nullcontext() as pool:
+            while pending or running:
+                # Start (or skip) every stage whose upstream stages are done; skipping can unblock others
+                ready = True
+                while ready and failure is None:
+                    ready = False
+                    for name in list(pending):
+                        stage = self.stages[name]
+                        if not all(upstream in fingerprints for upstream in self.upstream(stage)):
+                            continue
+
+                        pending.remove(name)
+                        fingerprint = self.fingerprint(stage, fingerprints, cache['files'])
+                        if not force and cache['stages'].get(name) == fingerprint and self.outputs_exist(stage):
+                            print(f'Skipping {name} (up to date)...')
+                            self.report.add(name, 'cached', self.files(stage, 'inputs'))
+                            fingerprints[name] = fingerprint
+                            ready = True
+                        else:
+                            running[self.submit(pool, stage)] = (name, fingerprint)
+                            if pool is None:
+                                break
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, fingerprint = running.pop(future)
+                    stage = self.stages[name]
+                    if future.exception() is not None:
+                        # Let running stages finish but start nothing new
+                        failure = failure or future.exception()
+                        self.report.add(name, 'failed', self.files(stage, 'inputs'))
+                        continue
+
+                    _, metrics = future.result()
+                    self.report.add(name, 'ran', self.files(stage, 'inputs'), self.files(stage, 'outputs'), metrics)
+                    fingerprints[name] = fingerprint
+                    executed.append(name)
+
+                    # Record progress after every stage so an interrupted run can resume
+                    cache['stages'][name] = fingerprint
+                    self.save_cache(cache)
+
+        self.save_cache(cache)
+        if report:
+            self.report.write(self.path(report))
+        print(self.report.summary())
+        if failure is not None:
+            raise failure
+        return executed
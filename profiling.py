@@ -0,0 +1,202 @@
+import csv
+import json
+import os
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    from osgeo import gdal
+    gdal.UseExceptions()
+except ImportError:
+    gdal = None
+
+# Columns of the CSV report, one row per stage
+REPORT_FIELDS = ('stage', 'status', 'wall_seconds', 'cpu_seconds', 'peak_rss_mb', 'read_bytes', 'written_bytes',
+                 'input_bytes', 'output_bytes', 'rasters', 'raster_cells', 'largest_raster')
+
+
+def reset_peak_rss():
+    # Linux can reset the high water mark, so a pool worker reports each stage's own peak
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss():
+    # Peak resident set size of this process in bytes, or None where it cannot be read
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
+    return None
+
+
+def io_bytes():
+    # Bytes this process has read and written through system calls (cached reads included), or None
+    try:
+        counters = {}
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, value = line.split(':')
+                counters[key] = int(value)
+        return counters['rchar'], counters['wchar']
+    except (OSError, KeyError, ValueError):
+        pass
+    if psutil is not None:
+        counters = psutil.Process().io_counters()
+        return counters.read_bytes, counters.write_bytes
+    return None
+
+
+def measure(func, *args):
+    """Call func(*args) and measure it from inside the process that runs it.
+
+    Returns the result and a dict with wall and CPU seconds (all threads of the process),
+    peak RSS and bytes read and written during the call. Stages run on a process pool are
+    measured in the worker, so the numbers are per stage rather than per run.
+    """
+    reset_peak_rss()
+    io_before = io_bytes()
+    wall, cpu = time.perf_counter(), time.process_time()
+
+    result = func(*args)
+
+    metrics = {
+        'wall_seconds': time.perf_counter() - wall,
+        'cpu_seconds': time.process_time() - cpu,
+        'peak_rss_mb': None,
+        'read_bytes': None,
+        'written_bytes': None,
+    }
+    peak = peak_rss()
+    if peak is not None:
+        metrics['peak_rss_mb'] = peak / 2 ** 20
+    io_after = io_bytes()
+    if io_before is not None and io_after is not None:
+        metrics['read_bytes'] = io_after[0] - io_before[0]
+        metrics['written_bytes'] = io_after[1] - io_before[1]
+    return result, metrics
+
+
+def raster_shape(path):
+    # (rows, cols, bands) of a raster, or None if it is not one or GDAL is unavailable
+    if gdal is None or not path.lower().endswith(('.tif', '.tiff', '.img', '.vrt')):
+        return None
+    try:
+        ds = gdal.Open(path)
+    except RuntimeError:
+        return None
+    return ds.RasterYSize, ds.RasterXSize, ds.RasterCount
+
+
+def total_size(files):
+    return sum(os.path.getsize(path) for path in files if os.path.exists(path))
+
+
+def format_bytes(count):
+    if count is None:
+        return '-'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(count) < 1024 or unit == 'GB':
+            return f'{count:.0f} {unit}' if unit == 'B' else f'{count:.1f} {unit}'
+        count /= 1024
+
+
+class RunReport:
+    """Per-stage measurements of one pipeline run.
+
+    Every stage the run visits gets a record: 'cached' for stages skipped because they
+    were up to date, 'ran' with the measure() numbers, file sizes and raster dimensions
+    of its outputs, or 'failed'.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.wall = time.perf_counter()
+        self.records = []
+
+    def add(self, name, status, inputs=(), outputs=(), metrics=None):
+        record = {field: None for field in REPORT_FIELDS}
+        record.update(metrics or {})
+        record.update({'stage': name, 'status': status, 'input_bytes': total_size(inputs)})
+
+        if status == 'ran':
+            record['output_bytes'] = total_size(outputs)
+            shapes = {path: shape for path in outputs if (shape := raster_shape(path))}
+            record['raster_shapes'] = {path: list(shape) for path, shape in shapes.items()}
+            record['rasters'] = len(shapes)
+            if shapes:
+                cells = {path: rows * cols for path, (rows, cols, _) in shapes.items()}
+                record['raster_cells'] = sum(cells.values())
+                rows, cols, _ = shapes[max(cells, key=cells.get)]
+                record['largest_raster'] = f'{rows}x{cols}'
+
+        self.records.append(record)
+        return record
+
+    def totals(self):
+        ran = [record for record in self.records if record['status'] == 'ran']
+        peaks = [record['peak_rss_mb'] for record in ran if record['peak_rss_mb'] is not None]
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'wall_seconds': time.perf_counter() - self.wall,
+            'stage_seconds': sum(record['wall_seconds'] for record in ran),
+            'cpu_seconds': sum(record['cpu_seconds'] for record in ran),
+            'peak_rss_mb': max(peaks, default=None),
+            'ran': len(ran),
+            'cached': sum(record['status'] == 'cached' for record in self.records),
+            'failed': sum(record['status'] == 'failed' for record in self.records),
+        }
+
+    def write(self, prefix):
+        # prefix.json holds the totals and full records, prefix.csv one flat row per stage
+        folder = os.path.dirname(prefix)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(prefix + '.json', 'w') as f:
+            json.dump({'run': self.totals(), 'stages': self.records}, f, indent=1)
+        with open(prefix + '.csv', 'w', newline='') as f:
+            writer = csv.DictWriter(f, REPORT_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(self.records)
+
+    def summary(self, top=10):
+        totals = self.totals()
+        lines = [f'Ran {totals["ran"]} stages ({totals["cached"]} up to date, {totals["failed"]} failed) '
+                 f'in {totals["wall_seconds"]:.1f} s; stages took {totals["stage_seconds"]:.1f} s wall and '
+                 f'{totals["cpu_seconds"]:.1f} s CPU']
+
+        ran = sorted((record for record in self.records if record['status'] == 'ran'),
+                     key=lambda record: record['wall_seconds'], reverse=True)
+        if ran:
+            lines.append(f'{"stage":<32} {"wall s":>8} {"cpu s":>8} {"peak RSS":>10} {"read":>10} {"written":>10}  raster')
+            for record in ran[:top]:
+                peak = record['peak_rss_mb']
+                lines.append(f'{record["stage"]:<32} {record["wall_seconds"]:8.2f} {record["cpu_seconds"]:8.2f} '
+                             f'{format_bytes(peak * 2 ** 20 if peak is not None else None):>10} '
+                             f'{format_bytes(record["read_bytes"]):>10} {format_bytes(record["written_bytes"]):>10}  '
+                             f'{record["largest_raster"] or "-"}')
+            if len(ran) > top:
+                lines.append(f'... and {len(ran) - top} more stages')
+        return '\n'.join(lines)
@@ -0,0 +1,432 @@
+import argparse
+import inspect
+import io
+import json
+import math
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+import config
+import workflow
+from engines import Environment, get_engine
+from pipeline import Stage
+from regions import label_tile, tile_summary
+from tiling import Window
+
+# Folder in the workspace holding the uncompressed query rasters
+QUERY_FOLDER = 'query'
+
+# Pyramid levels; level L has cells 2**L times the analysis cell size
+LEVELS = 6
+
+# Most cells an area or region query computes, and a preview shows; larger windows are answered from a coarser level
+MAX_CELLS = 1 << 24
+PREVIEW_CELLS = 1 << 20
+
+# Rows of a level read at once when building the next level
+STRIP_CELLS = 1 << 24
+
+
+def query_paths(levels=LEVELS):
+    # Criteria and final mask arrays of each level, and the index describing them
+    return ([os.path.join(QUERY_FOLDER, f'criteria_{level}.npy') for level in range(levels)],
+            [os.path.join(QUERY_FOLDER, f'masks_{level}.npy') for level in range(levels)],
+            os.path.join(QUERY_FOLDER, 'index.json'))
+
+
+def downsample(source, path):
+    # 2 x 2 block means of a (bands, rows, cols) array ignoring NaN, written strip by strip to a new .npy file
+    bands, rows, cols = source.shape
+    target = np.lib.format.open_memmap(path, 'w+', np.float32, (bands, (rows + 1) // 2, (cols + 1) // 2))
+    strip = max(2, STRIP_CELLS // max(bands * cols, 1) // 2 * 2)
+    for row in range(0, rows, strip):
+        block = np.array(source[:, row:row + strip], np.float32)
+        # Odd edges are padded with NaN so edge blocks average the cells they have
+        block = np.pad(block, ((0, 0), (0, block.shape[1] % 2), (0, cols % 2)), constant_values=np.nan)
+        block = block.reshape(bands, block.shape[1] // 2, 2, block.shape[2] // 2, 2)
+        valid = ~np.isnan(block)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(valid, block, 0).sum(axis=(2, 4)) / valid.sum(axis=(2, 4))
+        target[:, row // 2:row // 2 + mean.shape[1]] = mean
+    target.flush()
+    return target
+
+
+def query_rasters(env, criteria, masks, variants, criteria_outputs, mask_outputs, index, names, variant_names,
+                  transforms=None):
+    """Write the overlay inputs as uncompressed arrays that the query service memory-maps.
+
+    Compressed rasters cannot be memory-mapped, so the criteria (rescaled with transforms
+    when the overlay fuses rescaling) are written once as a (criteria, rows, cols) float32
+    .npy stack with NaN as NoData, and the final mask of each waterbody variant (1 where
+    every shared mask and the variant are 1, else 0) as a (variants, rows, cols) stack.
+    Each further level averages 2 x 2 blocks of the one before: criteria over their valid
+    cells and masks into the fraction of suitable cells. index describes every level.
+    """
+    print(f'Write {len(criteria)} criteria and {len(variants)} final masks as {len(criteria_outputs)} query levels...')
+    # The arrays are written tile by tile, which needs the numpy engine whichever engine runs the model
+    engine = get_engine(Environment(**{**vars(env), 'engine': 'numpy'}))
+    spec = engine.spec()
+    sources = [engine.criterion(path, transform) for path, transform in zip(criteria, transforms or [None] * len(criteria))]
+    mask_sources = [engine.read(path) for path in masks]
+    variant_sources = [engine.read(path) for path in variants]
+
+    os.makedirs(os.path.dirname(engine.path(criteria_outputs[0])), exist_ok=True)
+    stack = np.lib.format.open_memmap(engine.path(criteria_outputs[0]), 'w+', np.float32, (len(sources), spec.rows, spec.cols))
+    final = np.lib.format.open_memmap(engine.path(mask_outputs[0]), 'w+', np.float32, (len(variants), spec.rows, spec.cols))
+
+    def compute(window):
+        base = np.ones((window.rows, window.cols), bool)
+        for grid in mask_sources:
+            base &= grid.compute(window) == 1
+        return [grid.compute(window) for grid in sources], [base & (grid.compute(window) == 1) for grid in variant_sources]
+
+    # Input tiles, the shared mask and a final mask per variant
+    layers = len(sources) + len(masks) + 2 * len(variants) + 1
+    for window, (tiles, finals) in engine.map_tiles(compute, engine.tiles(4 * layers)):
+        rows, cols = slice(window.row, window.row + window.rows), slice(window.col, window.col + window.cols)
+        for band, tile in enumerate(tiles):
+            stack[band, rows, cols] = tile
+        for band, tile in enumerate(finals):
+            final[band, rows, cols] = tile
+    stack.flush()
+    final.flush()
+
+    levels = []
+    for level, (criteria_path, mask_path) in enumerate(zip(criteria_outputs, mask_outputs)):
+        if level > 0:
+            stack = downsample(stack, engine.path(criteria_path))
+            final = downsample(final, engine.path(mask_path))
+        levels.append({'criteria': criteria_path, 'masks': mask_path, 'cell_size': spec.cell_size * 2 ** level,
+                       'rows': stack.shape[1], 'cols': stack.shape[2]})
+
+    with open(engine.path(index), 'w') as f:
+        json.dump({'criteria': names, 'variants': variant_names, 'x0': spec.x0, 'y0': spec.y0, 'crs': spec.wkt,
+                   'levels': levels}, f, indent=1)
+
+
+def query_stage(model, levels=LEVELS):
+    # Stage writing the query rasters from the same inputs as the suitability stage
+    criteria, transforms = workflow.overlay_criteria(model)
+    criteria_outputs, mask_outputs, index = query_paths(levels)
+    params = {'names': list(model['criteria']), 'variant_names': list(model['water']['buffers'])}
+    if transforms is not None:
+        params['transforms'] = transforms
+    return Stage('query_rasters', query_rasters,
+                 inputs={'criteria': criteria, 'masks': workflow.mask_paths(model), 'variants': workflow.water_mask_paths(model)},
+                 outputs={'criteria_outputs': criteria_outputs, 'mask_outputs': mask_outputs, 'index': index},
+                 params=params)
+
+
+def png(scores, low, high):
+    # 8 bit grey and alpha PNG of scores stretched from low to high; NoData is transparent
+    rows, cols = scores.shape
+    valid = ~np.isnan(scores)
+    grey = np.clip((np.where(valid, scores, low) - low) / max(high - low, 1e-9) * 255, 0, 255).astype(np.uint8)
+    pixels = np.dstack([grey, np.where(valid, 255, 0).astype(np.uint8)]).reshape(rows, 2 * cols)
+    raw = np.concatenate([np.zeros((rows, 1), np.uint8), pixels], axis=1).tobytes()
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', cols, rows, 8, 4, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b''))
+
+
+class QueryService:
+    """Weighted overlay, suitable area and top region queries for any weights over memory-mapped query rasters.
+
+    Queries take weights as {criterion: weight}; criteria left out take the weights of
+    the base stakeholder (by default the first weight set of the model), so "what if
+    health were 0.35" is {'health': 0.35}. bbox (min x, min y, max x, max y in the
+    study area's coordinate system) limits a query to part of the study area. Each
+    query is answered from the finest level (level 0 is the analysis grid) whose window
+    has at most max_cells cells, unless level is given; answers from coarser levels
+    are approximate. Recent answers are kept in an LRU cache of at most cache_bytes
+    (counting the arrays of overlay answers), so repeating a query costs a dictionary
+    lookup; an answer larger than the whole cache is not kept.
+    """
+
+    def __init__(self, workspace, model, cache_bytes=256 * 2 ** 20):
+        _, _, index = query_paths()
+        with open(os.path.join(workspace, index)) as f:
+            self.index = json.load(f)
+        self.levels = [(np.load(os.path.join(workspace, level['criteria']), mmap_mode='r'),
+                        np.load(os.path.join(workspace, level['masks']), mmap_mode='r'), level)
+                       for level in self.index['levels']]
+        self.criteria = self.index['criteria']
+        self.variants = self.index['variants']
+        self.weight_sets = model['weights']
+        self.defaults = model['regions']
+        self.cache_bytes = cache_bytes
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def info(self):
+        return {
+            'criteria': self.criteria,
+            'variants': self.variants,
+            'weights': self.weight_sets,
+            'defaults': self.defaults,
+            'levels': [{'level': number, 'cell_size': level['cell_size'], 'rows': level['rows'], 'cols': level['cols']}
+                       for number, (_, _, level) in enumerate(self.levels)],
+            'bounds': self.bounds(0, Window(0, 0, self.levels[0][2]['rows'], self.levels[0][2]['cols'])),
+            'cache': {'entries': len(self.cache), 'bytes': self.cached_bytes, 'limit': self.cache_bytes, 'hits': self.hits, 'misses': self.misses},
+        }
+
+    def weight_vector(self, weights=None, base=None):
+        base = base or next(iter(self.weight_sets))
+        if base not in self.weight_sets:
+            raise ValueError(f'No weight set named {base!r}; choose from {", ".join(self.weight_sets)}')
+        unknown = set(weights or {}) - set(self.criteria)
+        if unknown:
+            raise ValueError(f'Unknown criteria {", ".join(sorted(unknown))}; choose from {", ".join(self.criteria)}')
+        merged = {**self.weight_sets[base], **(weights or {})}
+        return tuple(float(merged[name]) for name in self.criteria)
+
+    def variant_index(self, variant=None):
+        variant = variant or self.defaults['water']
+        if variant not in self.variants:
+            raise ValueError(f'No waterbody variant named {variant!r}; choose from {", ".join(self.variants)}')
+        return self.variants.index(variant)
+
+    def window(self, level, bbox=None):
+        info = self.levels[level][2]
+        if bbox is None:
+            return Window(0, 0, info['rows'], info['cols'])
+        min_x, min_y, max_x, max_y = bbox
+        x0, y0, cell = self.index['x0'], self.index['y0'], info['cell_size']
+        col0, col1 = max(math.floor((min_x - x0) / cell), 0), min(math.ceil((max_x - x0) / cell), info['cols'])
+        row0, row1 = max(math.floor((y0 - max_y) / cell), 0), min(math.ceil((y0 - min_y) / cell), info['rows'])
+        if row1 <= row0 or col1 <= col0:
+            raise ValueError(f'bbox {bbox} does not overlap the study area')
+        return Window(row0, col0, row1 - row0, col1 - col0)
+
+    def bounds(self, level, window):
+        # (min x, min y, max x, max y) of a window of a level
+        x0, y0, cell = self.index['x0'], self.index['y0'], self.levels[level][2]['cell_size']
+        return (x0 + window.col * cell, y0 - (window.row + window.rows) * cell,
+                x0 + (window.col + window.cols) * cell, y0 - window.row * cell)
+
+    def choose_level(self, bbox, level, max_cells):
+        if level is not None:
+            if not 0 <= level < len(self.levels):
+                raise ValueError(f'level must be from 0 to {len(self.levels) - 1}')
+            return level
+        for level in range(len(self.levels)):
+            window = self.window(level, bbox)
+            if window.rows * window.cols <= max_cells:
+                return level
+        return len(self.levels) - 1
+
+    def scores(self, weights, variant, level, window):
+        # Weighted overlay of a window; cells where under half the area is suitable are NaN. Also returns the mask fractions
+        stack, masks, _ = self.levels[level]
+        rows, cols = slice(window.row, window.row + window.rows), slice(window.col, window.col + window.cols)
+        score = np.tensordot(np.asarray(weights, np.float32), stack[:, rows, cols], axes=1)
+        fraction = np.asarray(masks[variant, rows, cols])
+        score[fraction < 0.5] = np.nan
+        return score, fraction
+
+    def cached(self, key, compute):
+        # Answer from the LRU cache or compute and keep it; the answer is marked with whether it was cached
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return {**self.cache[key][0], 'cached': True}
+        answer = compute()
+        # Answers without arrays are counted as a small fixed size
+        size = sum(value.nbytes for value in answer.values() if isinstance(value, np.ndarray)) + 1024
+        with self.lock:
+            self.misses += 1
+            if size <= self.cache_bytes and key not in self.cache:
+                self.cache[key] = (answer, size)
+                self.cached_bytes += size
+                while self.cached_bytes > self.cache_bytes:
+                    _, (_, evicted) = self.cache.popitem(last=False)
+                    self.cached_bytes -= evicted
+        return {**answer, 'cached': False}
+
+    def prepare(self, weights, base, variant, bbox, level, max_cells):
+        vector = self.weight_vector(weights, base)
+        variant = self.variant_index(variant)
+        bbox = tuple(map(float, bbox)) if bbox is not None else None
+        level = self.choose_level(bbox, level, max_cells)
+        return vector, variant, bbox, level, self.window(level, bbox)
+
+    def overlay(self, weights=None, base=None, variant=None, bbox=None, level=None, max_cells=PREVIEW_CELLS):
+        """Suitability scores of a window as an array ('scores'), with its level, bounds and summary statistics."""
+        vector, variant, bbox, level, window = self.prepare(weights, base, variant, bbox, level, max_cells)
+
+        def compute():
+            score, _ = self.scores(vector, variant, level, window)
+            valid = score[~np.isnan(score)]
+            return {
+                'level': level, 'cell_size': self.levels[level][2]['cell_size'], 'bounds': self.bounds(level, window),
+                'shape': score.shape, 'weights': dict(zip(self.criteria, vector)), 'valid_cells': int(valid.size),
+                'min': float(valid.min()) if valid.size else None, 'mean': float(valid.mean()) if valid.size else None,
+                'max': float(valid.max()) if valid.size else None, 'scores': score,
+            }
+
+        return self.cached(('overlay', vector, variant, bbox, level), compute)
+
+    def area(self, weights=None, base=None, variant=None, bbox=None, threshold=None, level=None, max_cells=MAX_CELLS):
+        """Area (m2) scoring at least threshold (default: the model's region threshold) and the suitable area it is part of."""
+        vector, variant, bbox, level, window = self.prepare(weights, base, variant, bbox, level, max_cells)
+        threshold = self.defaults['threshold'] if threshold is None else float(threshold)
+
+        def compute():
+            score, fraction = self.scores(vector, variant, level, window)
+            cell_area = self.levels[level][2]['cell_size'] ** 2
+            above = score >= threshold
+            suitable = float(fraction[above].sum() * cell_area)
+            total = float(fraction.sum() * cell_area)
+            return {
+                'level': level, 'cell_size': self.levels[level][2]['cell_size'], 'bounds': self.bounds(level, window),
+                'threshold': threshold, 'cells': int(above.sum()), 'area': suitable, 'suitable_area': total,
+                'fraction': suitable / total if total else None,
+            }
+
+        return self.cached(('area', vector, variant, bbox, threshold, level), compute)
+
+    def regions(self, weights=None, base=None, variant=None, bbox=None, threshold=None, min_area=None, top=10,
+                level=None, max_cells=MAX_CELLS):
+        """The top regions by area of 4-connected cells scoring at least threshold, as rows like the region tables.
+
+        Regions are those of the window, so a region crossing the edge of bbox is cut at it.
+        What-if weights need not sum to 1, so scores above 10 count too and the regions
+        cover the same cells as area().
+        """
+        vector, variant, bbox, level, window = self.prepare(weights, base, variant, bbox, level, max_cells)
+        threshold = self.defaults['threshold'] if threshold is None else float(threshold)
+        min_area = self.defaults['min_area'] if min_area is None else float(min_area)
+
+        def compute():
+            score, _ = self.scores(vector, variant, level, window)
+            labels, count = label_tile(score, threshold, np.inf)
+            cells, total, highest, boxes = tile_summary(score, labels, count, window)
+            cell = self.levels[level][2]['cell_size']
+            x0, y0 = self.index['x0'], self.index['y0']
+            kept = np.flatnonzero(cells * cell ** 2 >= min_area)
+            order = kept[np.lexsort((-total[kept] / cells[kept], -cells[kept]))][:top]
+            rows = [{
+                'region': rank,
+                'cells': int(cells[label]),
+                'area': float(cells[label] * cell ** 2),
+                'mean_score': float(total[label] / cells[label]),
+                'max_score': float(highest[label]),
+                'xmin': float(x0 + boxes[label, 1] * cell),
+                'ymin': float(y0 - boxes[label, 2] * cell),
+                'xmax': float(x0 + boxes[label, 3] * cell),
+                'ymax': float(y0 - boxes[label, 0] * cell),
+            } for rank, label in enumerate(order, 1)]
+            return {
+                'level': level, 'cell_size': cell, 'bounds': self.bounds(level, window), 'threshold': threshold,
+                'min_area': min_area, 'count': int(len(kept)), 'regions': rows,
+            }
+
+        return self.cached(('regions', vector, variant, bbox, threshold, min_area, top, level), compute)
+
+
+def query_options(params):
+    # Keyword arguments of a QueryService query from URL parameters, e.g. weights=health:0.35,roads:0.2&bbox=x0,y0,x1,y1
+    options = {}
+    try:
+        if 'weights' in params:
+            pairs = [pair.split(':') for pair in params['weights'].split(',') if pair]
+            if any(len(pair) != 2 for pair in pairs):
+                raise ValueError('weights needs criterion:weight pairs separated by commas')
+            options['weights'] = {name: float(value) for name, value in pairs}
+        if 'bbox' in params:
+            options['bbox'] = tuple(float(value) for value in params['bbox'].split(','))
+            if len(options['bbox']) != 4:
+                raise ValueError('bbox needs min x, min y, max x and max y')
+        for name, kind in (('base', str), ('variant', str), ('threshold', float), ('min_area', float), ('top', int),
+                           ('level', int), ('max_cells', int)):
+            if name in params:
+                options[name] = kind(params[name])
+    except ValueError as error:
+        raise ValueError(f'Bad query: {error}')
+    return options
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    # GET /info, /overlay, /area, /regions and /preview (PNG); the service is the server's
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        service = self.server.service
+        start = time.perf_counter()
+        try:
+            if url.path == '/info':
+                return self.send(200, service.info())
+            query = {'/area': service.area, '/regions': service.regions, '/overlay': service.overlay,
+                     '/preview': service.overlay}.get(url.path)
+            if query is None:
+                return self.send(404, {'error': f'No such query {url.path}; use /info, /overlay, /area, /regions or /preview'})
+            # Options a query does not take (e.g. top for /area) are ignored
+            accepted = inspect.signature(query).parameters
+            answer = query(**{key: value for key, value in query_options(params).items() if key in accepted})
+            if query == service.overlay:
+                if url.path == '/preview':
+                    total = sum(answer['weights'].values())
+                    return self.send(200, png(answer['scores'], total, 10 * total), 'image/png')
+                if params.get('format') == 'npy':
+                    buffer = io.BytesIO()
+                    np.save(buffer, answer['scores'])
+                    return self.send(200, buffer.getvalue(), 'application/octet-stream')
+                answer = {key: value for key, value in answer.items() if key != 'scores'}
+        except (ValueError, TypeError) as error:
+            return self.send(400, {'error': str(error)})
+        self.send(200, {**answer, 'milliseconds': (time.perf_counter() - start) * 1000})
+
+    def send(self, status, body, content_type='application/json'):
+        if content_type == 'application/json':
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve weighted overlay, area and region queries for any weights.')
+    parser.add_argument('--config', default=config.DEFAULT_CONFIG, help='model file (TOML or YAML)')
+    parser.add_argument('--area', help='study area (default: the first in the model file)')
+    parser.add_argument('--engine', help='raster engine used to build the query rasters (default: from the model file)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='stages run at once while building inputs')
+    parser.add_argument('--levels', type=int, default=LEVELS, help='pyramid levels of the query rasters')
+    parser.add_argument('--cache-mb', type=float, default=256, help='memory (MB) for answers kept in the LRU cache')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on')
+    args = parser.parse_args()
+
+    try:
+        model = config.load_config(args.config, args.engine)
+    except config.ConfigError as error:
+        sys.exit(str(error))
+    area = args.area or next(iter(model['areas']))
+    env = config.environment(model, area, engine=args.engine)
+
+    # The query rasters are a pipeline stage, so only out of date inputs are rebuilt before serving
+    pipeline = workflow.build_pipeline(env, model, variants=[])
+    pipeline.add(query_stage(model, args.levels))
+    pipeline.run(['query_rasters'], jobs=args.jobs)
+
+    server = ThreadingHTTPServer((args.host, args.port), QueryHandler)
+    server.service = QueryService(env.workspace, model, int(args.cache_mb * 2 ** 20))
+    print(f'Serving {area} queries on http://{args.host}:{args.port}/ (e.g. /area?weights=health:0.35)')
+    server.serve_forever()
@@ -0,0 +1,191 @@
+import csv
+
+import numpy as np
+
+try:
+    from scipy import ndimage
+except ImportError:
+    ndimage = None
+
+# Highest score counted into regions; the pipeline and the query service use the same range
+MAXIMUM_SCORE = 10
+
+TABLE_FIELDS = ('region', 'cells', 'area', 'mean_score', 'max_score', 'xmin', 'ymin', 'xmax', 'ymax')
+
+
+class UnionFind:
+    # Disjoint sets over label ids 0..n-1 that grows as tiles add labels
+    def __init__(self):
+        self.parent = np.zeros(0, np.int64)
+
+    def add(self, count):
+        start = len(self.parent)
+        self.parent = np.concatenate([self.parent, np.arange(start, start + count)])
+        return start
+
+    def find(self, label):
+        parent = self.parent
+        while parent[label] != label:
+            parent[label] = parent[parent[label]]
+            label = parent[label]
+        return label
+
+    def union(self, pairs):
+        for a, b in pairs:
+            root_a, root_b = self.find(a), self.find(b)
+            if root_a != root_b:
+                # Smaller id as root keeps roots in raster scan order
+                self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    def roots(self):
+        roots = self.parent.copy()
+        while True:
+            jumped = roots[roots]
+            if np.array_equal(jumped, roots):
+                return roots
+            roots = jumped
+
+
+def label_tile(score, threshold, maximum):
+    # 4-connected patches of cells scoring within [threshold, maximum]; labels start at 1
+    binary = (score >= threshold) & (score <= maximum)
+    return ndimage.label(binary)
+
+
+def tile_summary(score, labels, count, window):
+    # Cell count, score sum, max score and bounding box (grid rows/cols) of each label in a tile
+    flat = labels.ravel()
+    values = np.nan_to_num(score.ravel())
+    cells = np.bincount(flat, minlength=count + 1)[1:]
+    total = np.bincount(flat, weights=values, minlength=count + 1)[1:]
+    highest = np.full(count + 1, -np.inf)
+    np.maximum.at(highest, flat, values)
+
+    boxes = np.array([[s[0].start, s[1].start, s[0].stop, s[1].stop] for s in ndimage.find_objects(labels)], np.int64).reshape(-1, 4)
+    boxes += [window.row, window.col, window.row, window.col]
+    return cells, total, highest[1:], boxes
+
+
+def seam_pairs(a, b):
+    # Pairs of labels that touch across a seam (a and b are the facing edges, -1 where there is no patch)
+    touching = (a >= 0) & (b >= 0)
+    return np.unique(np.stack([a[touching], b[touching]], axis=1), axis=0)
+
+
+def write_region_table(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, TABLE_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def extract_regions(engine, suitability, threshold, min_area, output, table, polygons=None, maximum=MAXIMUM_SCORE):
+    """Raster-native replacement for threshold -> RasterToPolygon -> area -> select -> PolygonToRaster.
+
+    Cells scoring within [threshold, maximum] are grouped into 4-connected regions in two
+    streaming passes over tiles. The first pass labels each tile, accumulates each label's
+    cell count, score sum, max score and bounding box, and unions labels that touch across
+    tile seams. Regions covering at least min_area (cells x cell area) are numbered from 1
+    in the order of the first tile they reach (tiles in row-major order), then in scan
+    order within that tile. The second pass relabels each tile and writes the region ids to
+    output as a region raster (formats.REGION); everything else is NoData. table gets one CSV row per region (TABLE_FIELDS)
+    and polygons, if given, the outlines of the kept regions only. When no cell scores within
+    the range, output is all NoData, the table has no rows and no polygons are written.
+    """
+    if ndimage is None:
+        raise ImportError('Region extraction requires scipy')
+
+    spec = engine.spec()
+    grid = engine.read(suitability)
+    tiles = list(engine.tiles(4 + 4 + 1 + 8 + 24))
+
+    def first_pass(window):
+        score = grid.compute(window)
+        labels, count = label_tile(score, threshold, maximum)
+        return labels, count, tile_summary(score, labels, count, window)
+
+    sets = UnionFind()
+    offsets = {}
+    summaries = []
+    previous_bottom = np.full(spec.cols, -1, np.int64)
+    current_bottom = np.full(spec.cols, -1, np.int64)
+    right_edge = None
+    for window, (labels, count, summary) in engine.map_tiles(first_pass, tiles):
+        if window.col == 0:
+            previous_bottom, current_bottom = current_bottom, np.full(spec.cols, -1, np.int64)
+            right_edge = None
+
+        offset = offsets[window] = sets.add(count)
+        summaries.append(summary)
+        ids = np.where(labels > 0, labels.astype(np.int64) + offset - 1, -1)
+
+        if window.row > 0:
+            sets.union(seam_pairs(previous_bottom[window.col:window.col + window.cols], ids[0]))
+        if right_edge is not None:
+            sets.union(seam_pairs(right_edge, ids[:, 0]))
+        right_edge = ids[:, -1]
+        current_bottom[window.col:window.col + window.cols] = ids[-1]
+
+    roots = sets.roots()
+    labels_total = len(roots)
+    if labels_total == 0:
+        target = engine.create(output, 'region')
+        for window in tiles:
+            engine.write_window(target, window, engine.encode(window, np.full((window.rows, window.cols), np.nan, np.float32), 'region'))
+        engine.finish(target)
+        write_region_table(engine.path(table), [])
+        return []
+
+    cells = np.zeros(labels_total, np.int64)
+    total = np.zeros(labels_total)
+    highest = np.full(labels_total, -np.inf)
+    boxes = np.tile(np.array([np.iinfo(np.int64).max, np.iinfo(np.int64).max, -1, -1]), (labels_total, 1))
+    position = 0
+    for tile_cells, tile_total, tile_highest, tile_boxes in summaries:
+        tile_roots = roots[position:position + len(tile_cells)]
+        np.add.at(cells, tile_roots, tile_cells)
+        np.add.at(total, tile_roots, tile_total)
+        np.maximum.at(highest, tile_roots, tile_highest)
+        np.minimum.at(boxes[:, 0], tile_roots, tile_boxes[:, 0])
+        np.minimum.at(boxes[:, 1], tile_roots, tile_boxes[:, 1])
+        np.maximum.at(boxes[:, 2], tile_roots, tile_boxes[:, 2])
+        np.maximum.at(boxes[:, 3], tile_roots, tile_boxes[:, 3])
+        position += len(tile_cells)
+
+    cell_area = spec.cell_size ** 2
+    kept = np.flatnonzero((roots == np.arange(labels_total)) & (cells * cell_area >= min_area))
+    region_of = np.zeros(labels_total + 1, np.float32)
+    region_of[kept] = np.arange(1, len(kept) + 1)
+
+    def second_pass(window):
+        labels, _ = label_tile(grid.compute(window), threshold, maximum)
+        ids = np.where(labels > 0, roots[np.maximum(labels.astype(np.int64) + offsets[window] - 1, 0)], labels_total)
+        region = region_of[ids]
+        return engine.encode(window, np.where(region > 0, region, np.nan), 'region')
+
+    target = engine.create(output, 'region')
+    for window, array in engine.map_tiles(second_pass, tiles):
+        engine.write_window(target, window, array)
+    engine.finish(target)
+
+    rows = []
+    for region, root in enumerate(kept, 1):
+        row0, col0, row1, col1 = boxes[root]
+        rows.append({
+            'region': region,
+            'cells': int(cells[root]),
+            'area': float(cells[root] * cell_area),
+            'mean_score': float(total[root] / cells[root]),
+            'max_score': float(highest[root]),
+            'xmin': spec.x0 + col0 * spec.cell_size,
+            'ymin': spec.y0 - row1 * spec.cell_size,
+            'xmax': spec.x0 + col1 * spec.cell_size,
+            'ymax': spec.y0 - row0 * spec.cell_size,
+        })
+    write_region_table(engine.path(table), rows)
+
+    if polygons:
+        # Only the kept regions are polygonized, so small patches never reach the vector layer
+        engine.raster_to_polygon(engine.read(output), polygons)
+
+    return rows
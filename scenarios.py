@@ -0,0 +1,216 @@
+import argparse
+import csv
+import os
+
+import numpy as np
+
+from engines import ENGINES, Environment, get_engine
+from formats import MAX_WEIGHT_SUM
+from pipeline import Stage
+
+# Per-pixel summaries written for each mask variant
+STATISTICS = ('mean', 'std', 'min', 'max', 'above')
+
+
+def dirichlet_weights(base, samples, concentration=100.0, seed=None):
+    # Monte Carlo weight sets around base; every set sums to 1 and larger concentrations stay closer to base
+    base = np.asarray(base, np.float64)
+    rng = np.random.default_rng(seed)
+    return rng.dirichlet(base / base.sum() * concentration, samples)
+
+
+def ahp_weights(pairwise):
+    # Weights from an AHP pairwise comparison matrix (principal eigenvector, normalised to sum to 1)
+    values, vectors = np.linalg.eig(np.asarray(pairwise, np.float64))
+    principal = np.abs(np.real(vectors[:, np.argmax(np.real(values))]))
+    return principal / principal.sum()
+
+
+def ahp_perturbations(pairwise, samples, spread=0.2, seed=None):
+    # Weight sets from randomly perturbed pairwise judgements; each judgement is scaled by a
+    # log-normal factor and its reciprocal kept consistent
+    pairwise = np.asarray(pairwise, np.float64)
+    rng = np.random.default_rng(seed)
+    upper = np.triu(np.ones(pairwise.shape, bool), 1)
+    sets = []
+    for _ in range(samples):
+        perturbed = np.ones(pairwise.shape)
+        perturbed[upper] = pairwise[upper] * np.exp(rng.normal(0, spread, upper.sum()))
+        perturbed.T[upper] = 1 / perturbed[upper]
+        sets.append(ahp_weights(perturbed))
+    return np.array(sets)
+
+
+def read_rows(path):
+    # Rows of a CSV file of numbers; a header row is skipped
+    with open(path, newline='') as f:
+        rows = [row for row in csv.reader(f) if row]
+    try:
+        float(rows[0][0])
+    except (IndexError, ValueError):
+        rows = rows[1:]
+    return rows
+
+
+def load_weights(path, criteria):
+    # One weight set per row of a CSV file, with a weight for each of the criteria; a header row is skipped
+    rows = read_rows(path)
+    if not rows:
+        raise ValueError(f'{path}: no weight sets')
+    for number, row in enumerate(rows, 1):
+        if len(row) != criteria:
+            raise ValueError(f'{path}: weight set {number} has {len(row)} weights; expected one for each of the '
+                             f'{criteria} criteria')
+    sets = np.array([[float(value) for value in row] for row in rows])
+    negative = np.flatnonzero((sets < 0).any(axis=1))
+    if negative.size:
+        raise ValueError(f'{path}: weight sets {", ".join(str(row + 1) for row in negative[:5])} have negative weights')
+    too_large = np.flatnonzero(sets.sum(axis=1) > MAX_WEIGHT_SUM)
+    if too_large.size:
+        raise ValueError(f'{path}: weight sets {", ".join(str(row + 1) for row in too_large[:5])} sum to more than '
+                         f'{MAX_WEIGHT_SUM:g}, so their scores do not fit suitability rasters')
+    return sets
+
+
+def load_pairwise(path, criteria):
+    # AHP pairwise comparison matrix from a CSV file with one row and column per criterion; a header row is skipped.
+    # Only the judgements above the diagonal are used, the rest follow as their reciprocals
+    rows = read_rows(path)
+    if len(rows) != criteria or any(len(row) != criteria for row in rows):
+        raise ValueError(f'{path}: expected a {criteria} x {criteria} matrix, one row and column per criterion')
+    pairwise = np.array([[float(value) for value in row] for row in rows])
+    if (pairwise <= 0).any():
+        raise ValueError(f'{path}: pairwise judgements must be positive')
+    return pairwise
+
+
+def statistics_paths(prefix, variants):
+    return [f'{prefix}_{variant}_{statistic}.tif' for variant in variants for statistic in STATISTICS]
+
+
+def scenario_statistics(engine, criteria, weights, masks, variants, outputs, threshold=7.5, batch_size=64, transforms=None):
+    """Summarise the weighted overlay of many weight sets without writing one raster per weight set.
+
+    weights is an (n, k) matrix of weight sets over the k criteria. Each criterion, mask
+    and variant tile is read once; the scores of batch_size weight sets at a time are a
+    single matrix product with the criterion stack and are folded into running per-pixel
+    sum, sum of squares, min, max and count at or above threshold. Masks are 1/NoData and
+    apply to every weight set equally, so the statistics are computed once per tile and
+    masked per variant. outputs lists the STATISTICS rasters of each variant in order.
+    transforms optionally rescales each criterion as it is read (see Engine.criterion).
+    """
+    weights = np.asarray(weights, np.float32)
+    samples = len(weights)
+    if not samples:
+        raise ValueError('At least one weight set is needed')
+    sources = [engine.criterion(path, transform) for path, transform in zip(criteria, transforms or [None] * len(criteria))]
+    mask_sources = [engine.read(path) for path in masks]
+    variant_sources = [engine.read(path) for path in variants]
+    # Every statistic is on the score scale (and above is a fraction), so all are stored as quantized scores
+    targets = [engine.create(path, 'score') for path in outputs]
+
+    def compute(window):
+        stack = np.stack([grid.compute(window) for grid in sources])
+        total = np.zeros(stack.shape[1:], np.float64)
+        squares = np.zeros_like(total)
+        low = np.full(stack.shape[1:], np.inf, np.float32)
+        high = np.full(stack.shape[1:], -np.inf, np.float32)
+        above = np.zeros(stack.shape[1:], np.int32)
+
+        for start in range(0, samples, batch_size):
+            scores = np.tensordot(weights[start:start + batch_size], stack, axes=1)
+            total += scores.sum(axis=0, dtype=np.float64)
+            squares += np.square(scores, dtype=np.float64).sum(axis=0)
+            np.minimum(low, scores.min(axis=0), out=low)
+            np.maximum(high, scores.max(axis=0), out=high)
+            above += (scores >= threshold).sum(axis=0, dtype=np.int32)
+
+        mean = total / samples
+        summaries = {
+            'mean': mean,
+            'std': np.sqrt(np.maximum(squares / samples - mean ** 2, 0)),
+            'min': low,
+            'max': high,
+            'above': above / samples,
+        }
+
+        base = mask_sources[0].compute(window)
+        for grid in mask_sources[1:]:
+            base = base * grid.compute(window)
+
+        encoded = []
+        for variant in variant_sources:
+            final_mask = base * variant.compute(window)
+            encoded.extend(engine.encode(window, summaries[statistic] * final_mask, 'score') for statistic in STATISTICS)
+        return encoded
+
+    # Criterion stack, one batch of scores, the accumulators and the encoded output tiles
+    cell_bytes = 4 * len(criteria) + 4 * min(batch_size, samples) + 40 + 4 * len(outputs) + 4 * (len(masks) + len(variants))
+    for window, encoded in engine.map_tiles(compute, engine.tiles(cell_bytes)):
+        for ds, array in zip(targets, encoded):
+            engine.write_window(ds, window, array)
+
+    for ds in targets:
+        engine.finish(ds)
+
+
+def scenarios(env, criteria, masks, variants, outputs, weights, threshold, transforms=None):
+    print(f'Summarise suitability scores of {len(weights)} weight sets over {len(variants)} waterbody masks...')
+    # Only the numpy engine can stream tiles; it reads criteria produced by either engine
+    engine = get_engine(Environment(**{**vars(env), 'engine': 'numpy'}))
+    scenario_statistics(engine, criteria, weights, masks, variants, outputs, threshold, transforms=transforms)
+
+
+if __name__ == '__main__':
+    import config
+    import workflow
+
+    parser = argparse.ArgumentParser(description='Per-pixel statistics of the suitability score over many weight sets.')
+    parser.add_argument('--config', default=config.DEFAULT_CONFIG, help='model file (TOML or YAML)')
+    parser.add_argument('--area', help='study area (default: the first in the model file)')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--weights', help='CSV file with one weight set per row (criteria in the order of the model file)')
+    source.add_argument('--perturb', metavar='PERSON', help='sample weight sets around this weight set of the model file')
+    source.add_argument('--ahp', metavar='PAIRWISE', help='sample weight sets from perturbed judgements of this CSV file '
+                                                          'of AHP pairwise comparisons (criteria in the order of the model file)')
+    parser.add_argument('--samples', type=int, default=1000, help='number of weight sets to sample with --perturb or --ahp')
+    parser.add_argument('--concentration', type=float, default=100.0, help='Dirichlet concentration for --perturb; higher stays closer to the weight set')
+    parser.add_argument('--spread', type=float, default=0.2, help='log-normal spread of each judgement for --ahp')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--threshold', type=float, default=7.5, help='score counted as suitable')
+    parser.add_argument('--name', default='sweep', help='outputs are written to scenarios/<name>_<mask>_<statistic>.tif')
+    parser.add_argument('--engine', choices=sorted(ENGINES), help='engine used for the stages the statistics depend on (default: from the model file)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    if args.samples < 1:
+        parser.error('--samples: at least one weight set is needed')
+
+    model = config.load_config(args.config, args.engine)
+    if args.weights:
+        try:
+            sets = load_weights(args.weights, len(model['criteria']))
+        except ValueError as error:
+            parser.error(f'--weights: {error}')
+    elif args.ahp:
+        try:
+            sets = ahp_perturbations(load_pairwise(args.ahp, len(model['criteria'])), args.samples, args.spread, args.seed)
+        except ValueError as error:
+            parser.error(f'--ahp: {error}')
+    else:
+        if args.perturb not in model['weights']:
+            parser.error(f'--perturb: no weight set named {args.perturb!r} in {args.config}')
+        base = [model['weights'][args.perturb][name] for name in model['criteria']]
+        sets = dirichlet_weights(base, args.samples, args.concentration, args.seed)
+
+    env = config.environment(model, args.area or next(iter(model['areas'])), engine=args.engine)
+    pipeline = workflow.build_pipeline(env, model, variants=[])
+    criteria, transforms = workflow.overlay_criteria(model)
+    pipeline.add(Stage(f'scenarios_{args.name}', scenarios,
+                       inputs={
+                           'criteria': criteria,
+                           'masks': workflow.mask_paths(model),
+                           'variants': workflow.water_mask_paths(model),
+                       },
+                       outputs={'outputs': statistics_paths(f'scenarios/{args.name}', model['water']['buffers'])},
+                       params={'weights': sets.tolist(), 'threshold': args.threshold, 'transforms': transforms}))
+    pipeline.run([f'scenarios_{args.name}'], jobs=args.jobs, report=f'reports/scenarios_{args.name}')
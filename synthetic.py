@@ -0,0 +1,336 @@
+import json
+import math
+import os
+
+import numpy as np
+
+try:
+    from osgeo import gdal, ogr, osr
+    gdal.UseExceptions()
+    ogr.UseExceptions()
+except ImportError:
+    gdal = ogr = osr = None
+
+from formats import BLOCK_SIZE
+from tiling import windows
+
+# Source layers model.toml reads, by the name the real data has
+DEM = 'dem/N33W008_FABDEM_V1-2.tif'
+LAND_USE = 'land_use/n29_30_2020lc030.tif'
+REGIONS = 'administrative_regions/casablanca.shp'
+AIRPORTS = 'airports_points/hotosm_mar_airports_points.shp'
+BUS_STOPS = 'bus_stops/bus-stops.shp'
+HEALTH = 'health_facilities_points/hotosm_mar_health_facilities_points.shp'
+HOTELS = 'hotels/hotels.shp'
+RAILWAYS = 'railway_lines/hotosm_mar_railways_lines.shp'
+ROADS = 'road_lines/hotosm_mar_roads_lines.shp'
+TRAIN_STOPS = 'train_stops/train-stops.shp'
+WATERWAYS = 'waterways/hotosm_mar_waterways_lines.shp'
+
+# Upper left corner of the study area (UTM zone 29N, near Casablanca)
+ORIGIN = (320000, 3740000)
+
+# Relief as (wavelength, amplitude) octaves in m; slopes are mostly under 5 degrees with a few steeper hills
+RELIEF = ((20000, 300), (5000, 60), (1000, 12), (250, 3))
+
+# GlobeLand30 classes and the share of the area each covers, in patches a few km across
+LAND_COVER = ((10, 0.30), (20, 0.08), (30, 0.20), (40, 0.15), (50, 0.02), (60, 0.03), (80, 0.17), (90, 0.05))
+LAND_PATCHES = ((6000, 1.0), (1500, 0.5), (400, 0.25))
+
+# Towns per km2 and the mean radius (m) of a town; points of interest and local roads cluster in towns
+TOWN_DENSITY = 1 / 40
+TOWN_RADIUS = 1000
+
+# Spacing (m) of local roads in towns and of vertices along generated lines
+STREET_SPACING = 250
+LINE_STEP = 250
+
+HEALTHCARE = (('hospital', 0.1), ('clinic', 0.3), ('pharmacy', 0.4), ('doctors', 0.2))
+
+SETTINGS_FILE = 'synthetic.json'
+
+
+class ValueNoise:
+    """Smooth random field as the sum of octaves of interpolated random lattices.
+
+    Each octave is a lattice of standard normal values every wavelength m, interpolated
+    with smoothstep weights and scaled by its amplitude. Any window can be evaluated on
+    its own and neighbouring windows join seamlessly, so rasters of any size are
+    generated tile by tile; only the lattices (one value per wavelength squared) are
+    held in memory.
+    """
+
+    def __init__(self, rng, width, height, octaves):
+        self.octaves = [(wavelength, amplitude,
+                         rng.standard_normal((int(height // wavelength) + 2, int(width // wavelength) + 2)).astype(np.float32))
+                        for wavelength, amplitude in octaves]
+
+    def __call__(self, x, y):
+        # Field at every (y, x) pair of offsets (m) from the top left corner, as a len(y) x len(x) array
+        total = np.zeros((len(y), len(x)), np.float32)
+        for wavelength, amplitude, lattice in self.octaves:
+            fy, fx = np.asarray(y) / wavelength, np.asarray(x) / wavelength
+            iy, ix = fy.astype(int), fx.astype(int)
+            ty, tx = smoothstep(fy - iy)[:, None], smoothstep(fx - ix)[None, :]
+            top = lattice[np.ix_(iy, ix)] * (1 - tx) + lattice[np.ix_(iy, ix + 1)] * tx
+            bottom = lattice[np.ix_(iy + 1, ix)] * (1 - tx) + lattice[np.ix_(iy + 1, ix + 1)] * tx
+            total += amplitude * (top * (1 - ty) + bottom * ty)
+        return total
+
+
+def smoothstep(t):
+    return (t * t * (3 - 2 * t)).astype(np.float32)
+
+
+def write_raster(path, bounds, cell_size, srs, data_type, nodata, compute):
+    # Tiled, compressed GeoTIFF over bounds whose tiles are compute(x, y) of the cell centre offsets from the top left corner
+    min_x, min_y, max_x, max_y = bounds
+    rows, cols = int(round((max_y - min_y) / cell_size)), int(round((max_x - min_x) / cell_size))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    ds = gdal.GetDriverByName('GTiff').Create(path, cols, rows, 1, data_type,
+                                              ['TILED=YES', f'BLOCKXSIZE={BLOCK_SIZE}', f'BLOCKYSIZE={BLOCK_SIZE}',
+                                               'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER'])
+    ds.SetGeoTransform((min_x, cell_size, 0.0, max_y, 0.0, -cell_size))
+    ds.SetProjection(srs.ExportToWkt())
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(nodata)
+    for window in windows(rows, cols, 4 * BLOCK_SIZE):
+        x = (np.arange(window.col, window.col + window.cols) + 0.5) * cell_size
+        y = (np.arange(window.row, window.row + window.rows) + 0.5) * cell_size
+        band.WriteArray(compute(x, y), window.col, window.row)
+    ds.FlushCache()
+
+
+def write_features(path, srs, geometry_type, fields, features):
+    # Shapefile of (geometry, {field: value}) pairs; fields maps each field name to its OGR type
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    driver = ogr.GetDriverByName('ESRI Shapefile')
+    if os.path.exists(path):
+        driver.DeleteDataSource(path)
+    ds = driver.CreateDataSource(path)
+    layer = ds.CreateLayer(os.path.splitext(os.path.basename(path))[0], srs, geometry_type)
+    for name, field_type in fields.items():
+        layer.CreateField(ogr.FieldDefn(name, field_type))
+    for geometry, values in features:
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetGeometry(geometry)
+        for name, value in values.items():
+            feature.SetField(name, value)
+        layer.CreateFeature(feature)
+    ds = None
+
+
+def point(x, y):
+    geometry = ogr.Geometry(ogr.wkbPoint)
+    geometry.AddPoint_2D(float(x), float(y))
+    return geometry
+
+
+def line(vertices):
+    geometry = ogr.Geometry(ogr.wkbLineString)
+    for x, y in vertices:
+        geometry.AddPoint_2D(float(x), float(y))
+    return geometry
+
+
+def polygon(vertices):
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for x, y in list(vertices) + [vertices[0]]:
+        ring.AddPoint_2D(float(x), float(y))
+    geometry = ogr.Geometry(ogr.wkbPolygon)
+    geometry.AddGeometry(ring)
+    return geometry
+
+
+def winding_line(rng, start, end, jitter):
+    # Vertices every LINE_STEP m from start to end, wandering sideways by about jitter times the length
+    start, end = np.asarray(start, float), np.asarray(end, float)
+    length = np.hypot(*(end - start))
+    steps = max(int(length // LINE_STEP), 1)
+    # A random walk pinned to zero at both ends (Brownian bridge) as the sideways offset
+    walk = np.concatenate([[0], np.cumsum(rng.standard_normal(steps))])
+    walk -= np.linspace(0, 1, steps + 1) * walk[-1]
+    walk *= jitter * length / max(np.abs(walk).max(), 1e-9)
+    along = np.linspace(0, 1, steps + 1)[:, None]
+    normal = np.array([start[1] - end[1], end[0] - start[0]]) / max(length, 1e-9)
+    return start + along * (end - start) + walk[:, None] * normal
+
+
+def towns(rng, bounds):
+    # (centres, radii) of towns spread uniformly over bounds
+    min_x, min_y, max_x, max_y = bounds
+    count = max(3, int(round((max_x - min_x) * (max_y - min_y) / 1e6 * TOWN_DENSITY)))
+    centres = np.column_stack([rng.uniform(min_x, max_x, count), rng.uniform(min_y, max_y, count)])
+    return centres, TOWN_RADIUS / 2 + rng.exponential(TOWN_RADIUS / 2, count)
+
+
+def scatter(rng, centres, radii, per_metre, base, bounds):
+    # Points clustered around each town; a town gets base + per_metre x radius of them on average
+    points = []
+    for centre, radius in zip(centres, radii):
+        count = rng.poisson(base + per_metre * radius)
+        points.append(centre + rng.normal(0, radius / 2, (count, 2)))
+    points = np.concatenate(points) if points else np.zeros((0, 2))
+    min_x, min_y, max_x, max_y = bounds
+    return np.clip(points, [min_x, min_y], [max_x, max_y])
+
+
+def road_network(rng, centres, radii):
+    # Roads joining each town to its two nearest towns, plus a grid of local roads in every town
+    roads = []
+    pairs = set()
+    for i, centre in enumerate(centres):
+        nearest = np.argsort(np.hypot(*(centres - centre).T))[1:3]
+        pairs.update(tuple(sorted((i, int(j)))) for j in nearest)
+    for i, j in sorted(pairs):
+        roads.append((winding_line(rng, centres[i], centres[j], 0.1), 'primary'))
+
+    for (x, y), radius in zip(centres, radii):
+        for offset in np.arange(-radius, radius + 1, STREET_SPACING):
+            half = math.sqrt(max(radius * radius - offset * offset, 0))
+            if half > 0:
+                roads.append((np.array([[x - half, y + offset], [x + half, y + offset]]), 'residential'))
+                roads.append((np.array([[x + offset, y - half], [x + offset, y + half]]), 'residential'))
+    return roads
+
+
+def railway(rng, centres, radii):
+    # A line through the larger quarter of the towns, visiting each nearest town in turn from the westernmost
+    order = np.argsort(radii)[::-1][:max(2, len(centres) // 4)]
+    stations = [int(order[np.argmin(centres[order, 0])])]
+    remaining = set(map(int, order)) - set(stations)
+    while remaining:
+        last = centres[stations[-1]]
+        stations.append(min(remaining, key=lambda town: np.hypot(*(centres[town] - last))))
+        remaining.remove(stations[-1])
+    segments = [winding_line(rng, centres[a], centres[b], 0.03) for a, b in zip(stations, stations[1:])]
+    return np.concatenate([segment[:-1] for segment in segments] + [segments[-1][-1:]]), centres[stations]
+
+
+def rivers(rng, bounds):
+    # Rivers entering from a random edge and meandering across until they leave the area
+    min_x, min_y, max_x, max_y = bounds
+    width, height = max_x - min_x, max_y - min_y
+    count = max(1, int(round(width * height / 1e6 / 150)))
+    centre = np.array([(min_x + max_x) / 2, (min_y + max_y) / 2])
+    lines = []
+    for _ in range(count):
+        edge = rng.integers(4)
+        t = rng.uniform()
+        start = [(min_x + t * width, min_y), (min_x + t * width, max_y), (min_x, min_y + t * height), (max_x, min_y + t * height)][edge]
+        heading = math.atan2(*(centre - start)[::-1]) + rng.uniform(-1, 1)
+        vertices = [np.array(start)]
+        for _ in range(int(4 * (width + height) / LINE_STEP)):
+            heading += rng.normal(0, 0.3)
+            vertices.append(vertices[-1] + LINE_STEP * np.array([math.cos(heading), math.sin(heading)]))
+            x, y = vertices[-1]
+            if not (min_x <= x <= max_x and min_y <= y <= max_y):
+                break
+        lines.append(np.array(vertices))
+    return lines
+
+
+def study_area(rng, box, vertices=64):
+    # Irregular polygon filling box: each vertex lies 80 to 100% of the way from the centre to the box edge
+    min_x, min_y, max_x, max_y = box
+    cx, cy = (min_x + max_x) / 2, (min_y + max_y) / 2
+    angles = np.linspace(0, 2 * math.pi, vertices, endpoint=False)
+    # Distance to the box edge along each angle
+    reach = np.minimum(np.abs((max_x - cx) / np.where(np.cos(angles) == 0, 1e-12, np.cos(angles))),
+                       np.abs((max_y - cy) / np.where(np.sin(angles) == 0, 1e-12, np.sin(angles))))
+    walk = np.cumsum(rng.normal(0, 0.04, vertices))
+    walk -= np.linspace(0, 1, vertices) * walk[-1]
+    fraction = 0.9 + 0.1 * np.clip(walk / max(np.abs(walk).max(), 1e-9), -1, 1)
+    return [(cx + r * math.cos(a), cy + r * math.sin(a)) for a, r in zip(angles, reach * fraction)]
+
+
+def generate(workspace, width_km=20, height_km=20, cell_size=30, margin_km=5, seed=0, epsg=32629, origin=ORIGIN):
+    """Write a synthetic study area with every source layer model.toml reads to workspace.
+
+    The study area (the 'Grand Casablanca' region) is an irregular polygon filling a
+    width_km x height_km box at origin; every other layer covers the box grown by
+    margin_km, so distances near the edge of the study area see features outside it.
+    Everything is written in the coordinate system epsg, rasters at cell_size m. The
+    same settings always give the same layers. Returns the settings, which are also
+    written to synthetic.json; a workspace already generated with the same settings is
+    left as it is.
+    """
+    if gdal is None:
+        raise ImportError('Generating synthetic study areas requires GDAL (osgeo)')
+
+    settings = {'width_km': width_km, 'height_km': height_km, 'cell_size': cell_size, 'margin_km': margin_km,
+                'seed': seed, 'epsg': epsg, 'origin': list(origin)}
+    settings_path = os.path.join(workspace, SETTINGS_FILE)
+    layers = (DEM, LAND_USE, REGIONS, AIRPORTS, BUS_STOPS, HEALTH, HOTELS, RAILWAYS, ROADS, TRAIN_STOPS, WATERWAYS)
+    if os.path.exists(settings_path) and all(os.path.exists(os.path.join(workspace, layer)) for layer in layers):
+        with open(settings_path) as f:
+            if json.load(f) == settings:
+                print(f'Synthetic study area in {workspace} is up to date')
+                return settings
+
+    print(f'Generating a {width_km:g} x {height_km:g} km synthetic study area at {cell_size:g} m in {workspace}...')
+    os.makedirs(workspace, exist_ok=True)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    x0, y0 = origin
+    box = (x0, y0 - height_km * 1000, x0 + width_km * 1000, y0)
+    margin = margin_km * 1000
+    bounds = (box[0] - margin, box[1] - margin, box[2] + margin, box[3] + margin)
+    width, height = bounds[2] - bounds[0], bounds[3] - bounds[1]
+
+    # A separate random stream per layer, so changing how one layer is generated leaves the others alone
+    def stream(layer):
+        return np.random.default_rng([seed, layers.index(layer)])
+
+    relief = ValueNoise(stream(DEM), width, height, RELIEF)
+    write_raster(os.path.join(workspace, DEM), bounds, cell_size, srs, gdal.GDT_Float32, -9999,
+                 lambda x, y: 150 + relief(x, y))
+
+    # Class boundaries at quantiles of the patch field, estimated from a coarse sample of it
+    patches = ValueNoise(stream(LAND_USE), width, height, LAND_PATCHES)
+    sample = patches(np.linspace(0, width, 257)[:-1], np.linspace(0, height, 257)[:-1])
+    classes = np.array([code for code, _ in LAND_COVER], np.uint8)
+    edges = np.quantile(sample, np.cumsum([share for _, share in LAND_COVER])[:-1])
+    write_raster(os.path.join(workspace, LAND_USE), bounds, cell_size, srs, gdal.GDT_Byte, 0,
+                 lambda x, y: classes[np.searchsorted(edges, patches(x, y))])
+
+    outline = polygon(study_area(stream(REGIONS), box))
+    surrounding = polygon([(bounds[0], bounds[1]), (bounds[2], bounds[1]), (bounds[2], bounds[3]), (bounds[0], bounds[3])])
+    write_features(os.path.join(workspace, REGIONS), srs, ogr.wkbPolygon, {'NAME_1': ogr.OFTString},
+                   [(outline, {'NAME_1': 'Grand Casablanca'}),
+                    (surrounding.Difference(outline), {'NAME_1': 'Chaouia - Ouardigha'})])
+
+    rng = stream(ROADS)
+    centres, radii = towns(rng, bounds)
+    write_features(os.path.join(workspace, ROADS), srs, ogr.wkbLineString, {'highway': ogr.OFTString},
+                   [(line(vertices), {'highway': kind}) for vertices, kind in road_network(rng, centres, radii)])
+
+    track, stations = railway(stream(RAILWAYS), centres, radii)
+    write_features(os.path.join(workspace, RAILWAYS), srs, ogr.wkbLineString, {'railway': ogr.OFTString},
+                   [(line(track), {'railway': 'rail'})])
+    write_features(os.path.join(workspace, TRAIN_STOPS), srs, ogr.wkbPoint, {'name': ogr.OFTString},
+                   [(point(x, y), {'name': f'Station {i + 1}'}) for i, (x, y) in enumerate(stations)])
+
+    write_features(os.path.join(workspace, WATERWAYS), srs, ogr.wkbLineString, {'waterway': ogr.OFTString},
+                   [(line(vertices), {'waterway': 'river'}) for vertices in rivers(stream(WATERWAYS), bounds)])
+
+    rng = stream(HEALTH)
+    facilities = scatter(rng, centres, radii, 1 / 250, 2, bounds)
+    kinds = rng.choice([kind for kind, _ in HEALTHCARE], len(facilities), p=[share for _, share in HEALTHCARE])
+    write_features(os.path.join(workspace, HEALTH), srs, ogr.wkbPoint, {'healthcare': ogr.OFTString},
+                   [(point(x, y), {'healthcare': kind}) for (x, y), kind in zip(facilities, kinds)])
+
+    for layer, per_metre, base in ((HOTELS, 1 / 400, 1), (BUS_STOPS, 1 / 100, 4)):
+        write_features(os.path.join(workspace, layer), srs, ogr.wkbPoint, {'name': ogr.OFTString},
+                       [(point(x, y), {'name': f'{i + 1}'})
+                        for i, (x, y) in enumerate(scatter(stream(layer), centres, radii, per_metre, base, bounds))])
+
+    rng = stream(AIRPORTS)
+    count = max(1, int(round(width * height / 1e6 / 2000)))
+    write_features(os.path.join(workspace, AIRPORTS), srs, ogr.wkbPoint, {'name': ogr.OFTString},
+                   [(point(rng.uniform(bounds[0], bounds[2]), rng.uniform(bounds[1], bounds[3])), {'name': f'Airport {i + 1}'})
+                    for i in range(count)])
+
+    with open(settings_path, 'w') as f:
+        json.dump(settings, f, indent=1)
+    return settings
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# The model's modules live at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    # A workspace with the extent and mask layers of the synthetic analysis grid in fixtures.py
+    pytest.importorskip('osgeo')
+    from fixtures import make_workspace
+    make_workspace(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def engine(workspace):
+    from fixtures import numpy_engine
+    return numpy_engine(workspace)
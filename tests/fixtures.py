@@ -0,0 +1,80 @@
+import numpy as np
+
+from engines import Environment, NumpyEngine
+from formats import NODATA
+from synthetic import gdal, ogr, osr, point, polygon, write_features
+from tiling import Window
+
+# Analysis grid of the test workspaces: 150 rows by 130 columns of 30 m cells in UTM zone 29N from ORIGIN (the
+# upper left corner). The extent layer covers the grid and the mask layer all but its last 10 columns.
+EPSG = 32629
+ORIGIN = (300000.0, 3705000.0)
+CELL_SIZE = 30.0
+ROWS, COLS = 150, 130
+MASKED_COLS = 120
+FULL = Window(0, 0, ROWS, COLS)
+
+
+def srs():
+    reference = osr.SpatialReference()
+    reference.ImportFromEPSG(EPSG)
+    return reference
+
+
+def cell_box(row0, col0, row1, col1):
+    # Polygon over cells row0 to row1 - 1 and col0 to col1 - 1 of the grid
+    x0, x1 = ORIGIN[0] + col0 * CELL_SIZE, ORIGIN[0] + col1 * CELL_SIZE
+    y0, y1 = ORIGIN[1] - row0 * CELL_SIZE, ORIGIN[1] - row1 * CELL_SIZE
+    return polygon([(x0, y0), (x1, y0), (x1, y1), (x0, y1)])
+
+
+def cell_centre(row, col):
+    return point(ORIGIN[0] + (col + 0.5) * CELL_SIZE, ORIGIN[1] - (row + 0.5) * CELL_SIZE)
+
+
+def write_array(path, array, cell_size=CELL_SIZE, origin=ORIGIN):
+    # Float32 GeoTIFF of array with its upper left corner at origin; NaN cells are NoData
+    ds = gdal.GetDriverByName('GTiff').Create(str(path), array.shape[1], array.shape[0], 1, gdal.GDT_Float32)
+    ds.SetGeoTransform((origin[0], cell_size, 0.0, origin[1], 0.0, -cell_size))
+    ds.SetProjection(srs().ExportToWkt())
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(NODATA)
+    band.WriteArray(np.where(np.isnan(array), NODATA, array).astype(np.float32))
+    ds = None
+
+
+def write_shapes(path, geometries, geometry_type=None, kinds=None):
+    # Shapefile of geometries with a text field kind
+    geometry_type = geometry_type or ogr.wkbPolygon
+    kinds = kinds or [''] * len(geometries)
+    write_features(str(path), srs(), geometry_type, {'kind': ogr.OFTString},
+                   [(geometry, {'kind': kind}) for geometry, kind in zip(geometries, kinds)])
+
+
+def read_features(path, field=None):
+    # (geometry, value of field) of each feature in a feature class; the value is None without a field
+    ds = ogr.Open(str(path))
+    return [(feature.GetGeometryRef().Clone(), feature.GetField(field) if field else None) for feature in ds.GetLayer()]
+
+
+def make_workspace(folder):
+    write_shapes(folder / 'area.shp', [cell_box(0, 0, ROWS, COLS)])
+    write_shapes(folder / 'mask.shp', [cell_box(0, 0, ROWS, MASKED_COLS)])
+
+
+def numpy_engine(folder, **settings):
+    settings = {'cell_size': CELL_SIZE, 'extent': 'area.shp', 'mask': 'mask.shp', 'snap_raster': None, 'epsg': EPSG,
+                'engine': 'numpy', **settings}
+    return NumpyEngine(Environment(str(folder), **settings))
+
+
+def read_array(engine, path):
+    # A whole raster as the engine reads it: float32 values with NoData as NaN
+    return engine.read(path).compute(FULL)
+
+
+def masked(array):
+    # array as written by the engine: NaN outside the mask layer
+    array = np.array(array, np.float32)
+    array[:, MASKED_COLS:] = np.nan
+    return array
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from distance import capped_column_distances, capped_row_distances, euclidean_distance
+from fixtures import CELL_SIZE, COLS, FULL, ROWS, cell_centre, write_shapes
+from synthetic import ogr, point
+from tiling import Window
+
+ndimage = pytest.importorskip('scipy.ndimage')
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_euclidean_distance_matches_scipy(seed):
+    rng = np.random.default_rng(seed)
+    rows, cols = rng.integers(1, 60, 2)
+    sources = rng.random((rows, cols)) < rng.choice([0.001, 0.01, 0.05, 0.3])
+    sources[rng.integers(rows), rng.integers(cols)] = True
+    cell_size = float(rng.choice([1, 10, 30]))
+    reference = ndimage.distance_transform_edt(~sources) * cell_size
+
+    np.testing.assert_allclose(euclidean_distance(sources, cell_size), reference, rtol=1e-9, atol=1e-9)
+    for max_distance in (2.5 * cell_size, 7 * cell_size, 1e9):
+        np.testing.assert_allclose(euclidean_distance(sources, cell_size, max_distance),
+                                   np.minimum(reference, max_distance), rtol=1e-9, atol=1e-9)
+
+
+def test_euclidean_distance_without_sources():
+    sources = np.zeros((4, 5), bool)
+    assert np.isinf(euclidean_distance(sources, 30.0)).all()
+    np.testing.assert_array_equal(euclidean_distance(sources, 30.0, 100.0), 100.0)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_capped_distance_in_strips_matches_scipy(seed):
+    # The column pass over strips that read the cap above and below, then the row pass over strips that
+    # read it to either side, as the numpy engine streams capped distances
+    rng = np.random.default_rng(seed)
+    rows, cols = rng.integers(20, 120, 2)
+    sources = rng.random((rows, cols)) < 0.005
+    cell_size = float(rng.choice([1, 10, 30]))
+    max_distance = float(rng.uniform(2, 30)) * cell_size
+    reach = int(np.ceil(max_distance / cell_size))
+    size = int(rng.integers(5, 40))
+
+    columns = np.zeros((rows, cols), np.uint16)
+    for row in range(0, rows, size):
+        row0, row1 = max(row - reach, 0), min(row + size + reach, rows)
+        strip = capped_column_distances(sources[row0:row1], reach)
+        columns[row:row + size] = strip[row - row0:row - row0 + size]
+
+    distances = np.zeros((rows, cols))
+    for col in range(0, cols, size):
+        col0, col1 = max(col - reach, 0), min(col + size + reach, cols)
+        strip = capped_row_distances(columns[:, col0:col1], cell_size, max_distance)
+        distances[:, col:col + size] = strip[:, col - col0:col - col0 + size]
+
+    reference = ndimage.distance_transform_edt(~sources) * cell_size if sources.any() else np.full((rows, cols), np.inf)
+    np.testing.assert_allclose(distances, np.minimum(reference, max_distance), rtol=1e-9, atol=1e-9)
+
+
+def test_engine_distance_matches_scipy(engine, workspace):
+    rng = np.random.default_rng(2)
+    cells = np.column_stack([rng.integers(0, ROWS, 6), rng.integers(0, COLS, 6)])
+    write_shapes(workspace / 'points.shp', [cell_centre(row, col) for row, col in cells], ogr.wkbPoint)
+    sources = np.zeros((ROWS, COLS), bool)
+    sources[cells[:, 0], cells[:, 1]] = True
+    reference = ndimage.distance_transform_edt(~sources) * CELL_SIZE
+
+    np.testing.assert_allclose(engine.distance('points.shp').compute(FULL), reference, rtol=1e-6)
+    for max_distance in (100.0, 900.0):
+        distance = engine.distance('points.shp', max_distance)
+        np.testing.assert_allclose(distance.compute(FULL), np.minimum(reference, max_distance), rtol=1e-6)
+        np.testing.assert_allclose(distance.compute(Window(20, 30, 40, 50)), np.minimum(reference, max_distance)[20:60, 30:80],
+                                   rtol=1e-6)
+
+
+def test_engine_distance_without_sources(engine, workspace):
+    # No sources is NoData without a maximum distance and the maximum distance with one
+    write_shapes(workspace / 'far.shp', [point(0, 0)], ogr.wkbPoint)
+    assert np.isnan(engine.distance('far.shp').compute(FULL)).all()
+    np.testing.assert_array_equal(engine.distance('far.shp', 300.0).compute(FULL), 300)
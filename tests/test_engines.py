@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from engines import horn_slope
+
+
+def test_horn_slope_matches_the_arcgis_worked_example():
+    # The 3 x 3 example of the ArcGIS "How Slope works" page: 5 m cells, 75.25 degrees
+    padded = np.array([[50, 45, 50], [30, 30, 30], [8, 10, 10]], np.float32)
+    assert horn_slope(padded, 5.0)[0, 0] == pytest.approx(75.25, abs=0.01)
+
+
+def test_horn_slope_of_a_plane():
+    rows, cols = np.mgrid[0:12, 0:15]
+    cell_size = 30.0
+    # Rises 3 m per cell to the east and 4 m per cell to the south: a gradient of 5 / 30
+    plane = (3 * cols + 4 * rows).astype(np.float32)
+    slope = horn_slope(plane, cell_size)
+    assert slope.shape == (10, 13)
+    np.testing.assert_allclose(slope, np.degrees(np.arctan(5 / cell_size)), rtol=1e-5)
+
+
+def test_horn_slope_nodata_neighbours_take_the_centre_value():
+    padded = np.full((3, 3), 10.0, np.float32)
+    padded[0, :] = np.nan
+    # With the top row replaced by the centre value the surface is flat
+    assert horn_slope(padded, 30.0)[0, 0] == 0
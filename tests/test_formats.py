@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import pytest
+
+from fixtures import COLS, ROWS, cell_box, masked, numpy_engine, read_array, write_array, write_shapes
+from formats import BLOCK_SIZE, FORMATS, MASK, SCORE
+from synthetic import gdal
+
+
+def test_score_round_trip_is_within_half_a_step():
+    values = np.random.default_rng(0).uniform(0, 31.99, 10000)
+    values[:3] = np.nan
+    valid = np.ones(values.shape, bool)
+    valid[3:6] = False
+
+    stored = SCORE.encode(values, valid)
+    assert stored.dtype == np.uint16
+    assert (stored[:6] == SCORE.nodata).all()
+    np.testing.assert_allclose(stored[6:] * SCORE.scale, values[6:], rtol=0, atol=1 / 4096)
+
+
+def test_values_that_do_not_fit_raise():
+    with pytest.raises(ValueError, match='do not fit mask rasters'):
+        MASK.encode(np.array([1.0, 300.0]), np.ones(2, bool))
+
+
+def test_engine_writes_typed_rasters_that_read_back(engine, workspace):
+    values = np.random.default_rng(1).uniform(1, 10, (ROWS, COLS)).astype(np.float32)
+    values[:4] = np.nan
+    stored = {'mask': np.where(values > 5, 1, np.nan), 'score': values, 'distance': values * 100,
+              'region': np.floor(values), 'float': values - 5}
+
+    for kind, expected in stored.items():
+        raster_format = FORMATS[kind]
+        write_array(workspace / f'{kind}_values.tif', expected)
+        engine.save(engine.read(f'{kind}_values.tif'), f'{kind}.tif', kind)
+
+        ds = gdal.Open(str(workspace / f'{kind}.tif'))
+        band = ds.GetRasterBand(1)
+        assert gdal.GetDataTypeName(band.DataType) == raster_format.gdal_type
+        assert band.GetNoDataValue() == pytest.approx(raster_format.nodata)
+        assert (band.GetScale() or 1.0) == raster_format.scale
+        ds = band = None
+        np.testing.assert_allclose(read_array(engine, f'{kind}.tif'), masked(expected), rtol=1e-6, atol=raster_format.scale / 2)
+        assert not os.path.exists(workspace / f'{kind}.tif.partial.tif')
+
+
+def test_engine_writes_tiled_rasters_with_overviews(workspace):
+    # Overviews are only built for rasters larger than a block
+    write_shapes(workspace / 'large.shp', [cell_box(0, 0, 1100, 1100)])
+    engine = numpy_engine(workspace, extent='large.shp', mask=None)
+    write_array(workspace / 'values.tif', np.random.default_rng(2).uniform(1, 10, (1100, 1100)).astype(np.float32))
+    engine.save(engine.read('values.tif'), 'score.tif', 'score')
+
+    ds = gdal.Open(str(workspace / 'score.tif'))
+    band = ds.GetRasterBand(1)
+    assert band.GetBlockSize() == [BLOCK_SIZE, BLOCK_SIZE]
+    assert band.GetOverviewCount() >= 1
+    if gdal.GetDriverByName('COG') is not None:
+        assert ds.GetMetadata('IMAGE_STRUCTURE').get('LAYOUT') == 'COG'
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from engines import horn_slope
+from fixtures import (CELL_SIZE, COLS, FULL, MASKED_COLS, ORIGIN, ROWS, cell_box, masked, numpy_engine, read_array,
+                      read_features, write_array, write_shapes)
+from transforms import remap_range, remap_value
+
+pytest.importorskip('osgeo')
+
+
+def test_grid_is_the_extent_without_a_snap_raster(engine):
+    spec = engine.spec()
+    assert (spec.x0, spec.y0, spec.cell_size, spec.rows, spec.cols) == (*ORIGIN, CELL_SIZE, ROWS, COLS)
+
+
+def test_grid_snaps_outwards_to_the_snap_raster(workspace):
+    write_array(workspace / 'snap.tif', np.zeros((4, 4), np.float32), origin=(ORIGIN[0] + 10, ORIGIN[1] - 10))
+    spec = numpy_engine(workspace, snap_raster='snap.tif').spec()
+    assert (spec.x0, spec.y0, spec.rows, spec.cols) == (ORIGIN[0] - 20, ORIGIN[1] + 20, ROWS + 1, COLS + 1)
+
+
+def test_missing_snap_raster(workspace):
+    with pytest.raises(FileNotFoundError, match='missing.tif'):
+        numpy_engine(workspace, snap_raster='missing.tif').spec()
+
+
+def test_mask_is_the_cells_centred_in_the_mask_layer(engine):
+    mask = engine.mask(FULL)
+    assert mask[:, :MASKED_COLS].all()
+    assert not mask[:, MASKED_COLS:].any()
+
+
+def test_saved_rasters_read_back_with_nodata_outside_the_mask(engine, workspace):
+    values = np.random.default_rng(0).uniform(0, 100, (ROWS, COLS)).astype(np.float32)
+    values[5:9, 7:11] = np.nan
+    write_array(workspace / 'values.tif', values)
+
+    engine.save(engine.read('values.tif'), 'copy.tif')
+    engine.save(engine.read('values.tif') * 2 + 1, 'algebra.tif')
+    np.testing.assert_array_equal(read_array(engine, 'copy.tif'), masked(values))
+    np.testing.assert_allclose(read_array(engine, 'algebra.tif'), masked(values * 2 + 1), rtol=1e-6)
+
+
+def test_unaligned_rasters_are_resampled_to_the_grid(engine, workspace):
+    coarse = np.arange(ROWS // 2 * (COLS // 2), dtype=np.float32).reshape(ROWS // 2, COLS // 2)
+    write_array(workspace / 'coarse.tif', coarse, cell_size=2 * CELL_SIZE)
+    np.testing.assert_array_equal(read_array(engine, 'coarse.tif'), coarse.repeat(2, 0).repeat(2, 1))
+
+
+def test_reclassify_matches_remap(engine, workspace):
+    land_use = np.random.default_rng(1).choice([10, 20, 30, 40, 50], (ROWS, COLS)).astype(np.float32)
+    write_array(workspace / 'land_use.tif', land_use)
+
+    engine.save(engine.reclassify_value(engine.read('land_use.tif'), [[10, 1], [30, 1]]), 'by_value.tif', 'mask')
+    engine.save(engine.reclassify_range(engine.read('land_use.tif'), [[0, 25, 1]]), 'by_range.tif', 'mask')
+    np.testing.assert_array_equal(read_array(engine, 'by_value.tif'), masked(remap_value(land_use, [[10, 1], [30, 1]])))
+    np.testing.assert_array_equal(read_array(engine, 'by_range.tif'), masked(remap_range(land_use, [[0, 25, 1]])))
+
+
+def test_slope_matches_horn_slope(engine, workspace):
+    x, y = np.meshgrid(np.arange(COLS), np.arange(ROWS))
+    dem = (50 * np.sin(x / 9) + 30 * np.cos(y / 13)).astype(np.float32)
+    write_array(workspace / 'dem.tif', dem)
+
+    expected = horn_slope(np.pad(dem.astype(np.float64), 1, constant_values=np.nan), CELL_SIZE)
+    np.testing.assert_allclose(engine.slope(engine.read('dem.tif')).compute(FULL), expected, rtol=1e-6)
+
+
+def test_select_features_measure_and_rasterize(engine, workspace):
+    write_shapes(workspace / 'zones.shp', [cell_box(0, 0, 10, 10), cell_box(0, 10, 10, 20), cell_box(20, 0, 30, 10)],
+                 kinds=['park', 'park', 'farm'])
+
+    engine.select_features('zones.shp', "kind =\n 'park'", 'parks.shp')
+    engine.select_features('zones.shp', "kind = 'park'", 'park.shp', dissolve=True)
+    assert [kind for _, kind in read_features(workspace / 'parks.shp', 'kind')] == ['park', 'park']
+    [(park, _)] = read_features(workspace / 'park.shp')
+    assert park.GetArea() == pytest.approx(200 * CELL_SIZE ** 2)
+
+    engine.calculate_area('parks.shp', 'area')
+    assert [area for _, area in read_features(workspace / 'parks.shp', 'area')] == pytest.approx([100 * CELL_SIZE ** 2] * 2)
+    engine.polygon_to_raster('parks.shp', 'area', 'park_area.tif')
+    expected = np.full((ROWS, COLS), np.nan, np.float32)
+    expected[:10, :20] = 100 * CELL_SIZE ** 2
+    np.testing.assert_array_equal(read_array(engine, 'park_area.tif'), expected)
+
+
+def test_raster_to_polygon_outlines_the_masked_values(engine, workspace):
+    values = np.full((ROWS, COLS), np.nan, np.float32)
+    values[10:20, 10:30] = 1
+    values[50:60, 100:130] = 2
+    write_array(workspace / 'values.tif', values)
+
+    engine.raster_to_polygon(engine.read('values.tif'), 'outlines.shp')
+    areas = {code: geometry.GetArea() for geometry, code in read_features(workspace / 'outlines.shp', 'gridcode')}
+    assert areas == pytest.approx({1: 200 * CELL_SIZE ** 2, 2: (MASKED_COLS - 100) * 10 * CELL_SIZE ** 2})
@@ -0,0 +1,57 @@
+import numpy as np
+
+from fixtures import COLS, ROWS, masked, read_array, write_array
+from overlay import fused_overlay
+
+
+def mask(rng, shape):
+    # 1 where suitable and NoData (NaN) elsewhere, like the mask rasters
+    return np.where(rng.random(shape) < 0.8, 1, np.nan).astype(np.float32)
+
+
+def test_fused_overlay_matches_a_weighted_sum_per_weight_set_and_variant():
+    rng = np.random.default_rng(0)
+    shape = (37, 51)
+    criteria = rng.uniform(1, 10, (4, *shape)).astype(np.float32)
+    criteria[2, :3] = np.nan
+    weights = rng.dirichlet(np.ones(4), 3)
+    masks = [mask(rng, shape) for _ in range(2)]
+    variants = [mask(rng, shape) for _ in range(3)]
+
+    final_masks, scores = {}, {}
+    for output in fused_overlay(criteria, weights, masks, variants):
+        if output[0] == 'mask':
+            final_masks[output[1]] = output[2].copy()
+        else:
+            scores[output[1], output[2]] = output[3].copy()
+
+    for j, variant in enumerate(variants):
+        np.testing.assert_array_equal(final_masks[j], masks[0] * masks[1] * variant)
+        for i, row in enumerate(weights):
+            naive = sum(weight * criterion for weight, criterion in zip(row, criteria)) * masks[0] * masks[1] * variant
+            np.testing.assert_allclose(scores[i, j], naive, rtol=1e-5)
+    assert len(scores) == len(weights) * len(variants)
+
+
+def test_engine_overlay_matches_a_weighted_sum_of_the_input_rasters(engine, workspace):
+    rng = np.random.default_rng(1)
+    shape = (ROWS, COLS)
+    criteria = rng.uniform(1, 10, (3, *shape)).astype(np.float32)
+    weights = [[0.2, 0.3, 0.5], [0.6, 0.2, 0.2]]
+    masks = [mask(rng, shape) for _ in range(2)]
+    variants = [mask(rng, shape) for _ in range(2)]
+    for name, arrays in (('criterion', criteria), ('mask', masks), ('variant', variants)):
+        for k, array in enumerate(arrays):
+            write_array(workspace / f'{name}_{k}.tif', array)
+
+    outputs = [f'score_{i}_{j}.tif' for i in range(len(weights)) for j in range(len(variants))]
+    engine.weighted_overlay([f'criterion_{k}.tif' for k in range(3)], weights, ['mask_0.tif', 'mask_1.tif'],
+                            ['variant_0.tif', 'variant_1.tif'], outputs, ['final_0.tif', 'final_1.tif'])
+
+    for j, variant in enumerate(variants):
+        final_mask = masks[0] * masks[1] * variant
+        np.testing.assert_array_equal(read_array(engine, f'final_{j}.tif'), masked(final_mask))
+        for i, row in enumerate(weights):
+            naive = sum(weight * criterion for weight, criterion in zip(row, criteria)) * final_mask
+            # Scores are stored to the nearest 1/2048
+            np.testing.assert_allclose(read_array(engine, f'score_{i}_{j}.tif'), masked(naive), rtol=0, atol=1 / 4096 + 1e-5)
@@ -0,0 +1,16 @@
+import types
+
+import pipeline
+from pipeline import function_name
+
+
+def stage_function():
+    pass
+
+
+def test_function_name_is_the_same_run_as_a_script_or_imported(monkeypatch):
+    monkeypatch.setitem(pipeline.sys.modules, '__main__', types.SimpleNamespace(__file__='/repo/workflow.py'))
+    script = types.FunctionType(stage_function.__code__, {'__name__': '__main__'}, 'stage_function')
+    imported = types.FunctionType(stage_function.__code__, {'__name__': 'workflow'}, 'stage_function')
+    assert script.__module__ == '__main__'
+    assert function_name(script) == function_name(imported) == 'workflow.stage_function'
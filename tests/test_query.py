@@ -0,0 +1,46 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from query import QueryService, query_paths
+
+pytest.importorskip('scipy.ndimage')
+
+MODEL = {
+    'weights': {'base': {'health': 0.5, 'roads': 0.5}},
+    'regions': {'water': 'near', 'threshold': 7.5, 'min_area': 0},
+}
+
+
+@pytest.fixture
+def service(tmp_path):
+    # One level of two criteria: a block scoring 10 on both and 5 everywhere else, all of it suitable
+    criteria_paths, mask_paths, index = query_paths(1)
+    os.makedirs(tmp_path / 'query')
+    criteria = np.full((2, 40, 50), 5, np.float32)
+    criteria[:, 10:16, 20:30] = 10
+    np.save(tmp_path / criteria_paths[0], criteria)
+    np.save(tmp_path / mask_paths[0], np.ones((1, 40, 50), np.float32))
+    with open(tmp_path / index, 'w') as f:
+        json.dump({'criteria': ['health', 'roads'], 'variants': ['near'], 'x0': 0.0, 'y0': 1200.0, 'crs': '',
+                   'levels': [{'criteria': criteria_paths[0], 'masks': mask_paths[0], 'cell_size': 30,
+                               'rows': 40, 'cols': 50}]}, f)
+    return QueryService(str(tmp_path), MODEL)
+
+
+def test_regions_cover_the_area_cells_when_weights_sum_above_one(service):
+    weights = {'health': 0.56}
+    assert service.overlay(weights)['max'] == pytest.approx(10.6)
+    area = service.area(weights)
+    regions = service.regions(weights)
+    assert area['cells'] == 60
+    assert regions['count'] == 1
+    assert regions['regions'][0]['cells'] == area['cells']
+    assert regions['regions'][0]['max_score'] == pytest.approx(10.6)
+
+
+def test_repeated_queries_are_cached(service):
+    assert not service.area({'health': 0.4})['cached']
+    assert service.area({'health': 0.4})['cached']
@@ -0,0 +1,138 @@
+import csv
+import os
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from fixtures import CELL_SIZE, COLS, MASKED_COLS, ROWS, numpy_engine, read_array, read_features, write_array
+from formats import FORMATS
+from regions import MAXIMUM_SCORE, extract_regions
+from tiling import windows
+
+ndimage = pytest.importorskip('scipy.ndimage')
+
+
+class Spec:
+    def __init__(self, rows, cols, cell_size):
+        self.x0, self.y0 = 0.0, rows * cell_size
+        self.rows, self.cols, self.cell_size = rows, cols, cell_size
+
+
+class Grid:
+    def __init__(self, array):
+        self.array = array
+
+    def compute(self, window):
+        return self.array[window.row:window.row + window.rows, window.col:window.col + window.cols].astype(np.float32)
+
+
+class ArrayEngine:
+    # The parts of NumpyEngine that extract_regions uses, over in-memory arrays split into fixed size tiles
+    def __init__(self, rasters, tile_size, cell_size, folder):
+        self.rasters = rasters
+        self._spec = Spec(*next(iter(rasters.values())).shape, cell_size)
+        self.tile_size = tile_size
+        self.folder = folder
+
+    def spec(self):
+        return self._spec
+
+    def path(self, path):
+        return os.path.join(self.folder, path)
+
+    def read(self, path):
+        return Grid(self.rasters[path])
+
+    def tiles(self, cell_bytes, halo=0):
+        return windows(self._spec.rows, self._spec.cols, self.tile_size)
+
+    def map_tiles(self, func, tiles):
+        for window in tiles:
+            yield window, func(window)
+
+    def create(self, path, kind='float'):
+        self.rasters[path] = np.zeros((self._spec.rows, self._spec.cols), FORMATS[kind].dtype)
+        return path
+
+    def encode(self, window, array, kind='float'):
+        return FORMATS[kind].encode(array, np.ones(array.shape, bool))
+
+    def write_window(self, target, window, array):
+        self.rasters[target][window.row:window.row + window.rows, window.col:window.col + window.cols] = array
+
+    def finish(self, target):
+        pass
+
+
+def read_table(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+@pytest.mark.parametrize('seed', range(25))
+def test_tiled_regions_match_whole_raster_labelling(seed, tmp_path):
+    rng = np.random.default_rng(seed)
+    rows, cols = rng.integers(5, 80, 2)
+    score = ndimage.gaussian_filter(rng.random((rows, cols)), 1.5) * 12
+    score[rng.random((rows, cols)) < 0.05] = np.nan
+    threshold = float(np.nanpercentile(score, 60))
+    min_cells = int(rng.integers(1, 10))
+    engine = ArrayEngine({'score.tif': score}, int(rng.integers(3, 20)), 1.0, tmp_path)
+
+    rows_written = extract_regions(engine, 'score.tif', threshold, min_cells, 'regions.tif', 'regions.csv')
+
+    labels, count = ndimage.label((score >= threshold) & (score <= MAXIMUM_SCORE))
+    sizes = np.bincount(labels.ravel(), minlength=count + 1)
+    kept = [label for label in range(1, count + 1) if sizes[label] >= min_cells]
+    output = engine.rasters['regions.tif'].astype(np.int64)
+    assert len(rows_written) == len(kept)
+    # Same regions whatever their numbering: each kept label pairs with one region id and each id with one label
+    pairs = set(zip(labels[output > 0].tolist(), output[output > 0].tolist()))
+    assert sorted(label for label, _ in pairs) == kept
+    assert len({region for _, region in pairs}) == len(pairs)
+    assert not output[~np.isin(labels, kept)].any()
+
+    for row in rows_written:
+        cells = output == row['region']
+        assert row['cells'] == cells.sum()
+        assert row['mean_score'] == pytest.approx(score[cells].mean(), rel=1e-5)
+        assert row['max_score'] == pytest.approx(score[cells].max(), rel=1e-5)
+    assert len(read_table(tmp_path / 'regions.csv')) == len(rows_written)
+
+
+def test_no_cells_in_range(tmp_path):
+    engine = ArrayEngine({'score.tif': np.full((10, 10), 5.0, np.float32)}, 4, 30.0, tmp_path)
+    assert extract_regions(engine, 'score.tif', 7.5, 1, 'regions.tif', 'regions.csv', polygons='regions.shp') == []
+    assert not engine.rasters['regions.tif'].any()
+    assert read_table(tmp_path / 'regions.csv') == []
+    assert not (tmp_path / 'regions.shp').exists()
+
+
+def test_engine_regions_match_whole_raster_labelling(workspace):
+    # 0.2 MB splits the grid into 71 cell tiles; regions stay inside the mask layer
+    rng = np.random.default_rng(3)
+    smooth = ndimage.gaussian_filter(rng.random((ROWS, COLS)), 3)
+    score = (1 + 9 * (smooth - smooth.min()) / (smooth.max() - smooth.min())).astype(np.float32)
+    score[:, MASKED_COLS - 1:] = 1
+    write_array(workspace / 'score.tif', score)
+    threshold = float(np.percentile(score, 80))
+    engine = numpy_engine(workspace, memory_mb=0.2)
+
+    rows_written = engine.extract_regions('score.tif', threshold, 5 * CELL_SIZE ** 2, 'regions.tif', 'regions.csv',
+                                          'regions.shp')
+
+    labels, count = ndimage.label((score >= threshold) & (score <= MAXIMUM_SCORE))
+    sizes = np.bincount(labels.ravel(), minlength=count + 1)
+    kept = [label for label in range(1, count + 1) if sizes[label] >= 5]
+    output = np.nan_to_num(read_array(engine, 'regions.tif')).astype(np.int64)
+    assert len(rows_written) == len(kept) > 1
+    pairs = set(zip(labels[output > 0].tolist(), output[output > 0].tolist()))
+    assert sorted(label for label, _ in pairs) == kept
+    assert len({region for _, region in pairs}) == len(pairs)
+    assert len(read_table(workspace / 'regions.csv')) == len(rows_written)
+
+    areas = Counter()
+    for geometry, region in read_features(workspace / 'regions.shp', 'gridcode'):
+        areas[region] += geometry.GetArea()
+    assert areas == pytest.approx({row['region']: row['area'] for row in rows_written})
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from formats import MAX_WEIGHT_SUM, SCORE
+from scenarios import ahp_perturbations, ahp_weights, load_pairwise, load_weights
+
+
+def write(tmp_path, text):
+    path = tmp_path / 'weights.csv'
+    path.write_text(text)
+    return str(path)
+
+
+def test_load_weights_skips_the_header(tmp_path):
+    sets = load_weights(write(tmp_path, 'health,roads\n0.4,0.6\n0.5,0.5\n'), 2)
+    np.testing.assert_array_equal(sets, [[0.4, 0.6], [0.5, 0.5]])
+
+
+@pytest.mark.parametrize('text, message', [
+    ('0.4,0.6\n0.5\n', 'weight set 2 has 1 weights'),
+    ('0.4,0.6\n-0.5,1.5\n', 'negative weights'),
+    ('1.6,1.6\n', 'sum to more than'),
+    ('health,roads\n', 'no weight sets'),
+])
+def test_load_weights_rejects_bad_weight_sets(tmp_path, text, message):
+    with pytest.raises(ValueError, match=message):
+        load_weights(write(tmp_path, text), 2)
+
+
+def test_largest_weight_sum_fits_score_rasters():
+    SCORE.encode(np.array([10 * MAX_WEIGHT_SUM]), np.ones(1, bool))
+    with pytest.raises(ValueError):
+        SCORE.encode(np.array([32.0]), np.ones(1, bool))
+
+
+def test_load_pairwise(tmp_path):
+    pairwise = load_pairwise(write(tmp_path, 'health,roads,bus\n1,3,5\n0.333,1,2\n0.2,0.5,1\n'), 3)
+    assert pairwise.shape == (3, 3)
+    with pytest.raises(ValueError, match='3 x 3'):
+        load_pairwise(write(tmp_path, '1,3\n0.333,1\n'), 3)
+    with pytest.raises(ValueError, match='positive'):
+        load_pairwise(write(tmp_path, '1,-3\n0.333,1\n'), 2)
+
+
+def test_ahp_perturbations_are_weight_sets_around_the_judgements():
+    pairwise = np.array([[1, 3, 5], [1 / 3, 1, 2], [1 / 5, 1 / 2, 1]])
+    sets = ahp_perturbations(pairwise, 200, spread=0.1, seed=0)
+    assert sets.shape == (200, 3)
+    np.testing.assert_allclose(sets.sum(axis=1), 1)
+    np.testing.assert_allclose(sets.mean(axis=0), ahp_weights(pairwise), atol=0.02)
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from fixtures import COLS, ROWS, cell_centre, numpy_engine, read_array, write_array, write_shapes
+from synthetic import ogr
+from tiling import MIN_TILE_SIZE, strip_length_for, tile_size_for, windows
+
+
+def test_windows_cover_the_raster_once():
+    covered = np.zeros((70, 45), int)
+    for window in windows(70, 45, 16, 20):
+        covered[window.row:window.row + window.rows, window.col:window.col + window.cols] += 1
+    assert (covered == 1).all()
+
+
+def test_tile_size_fits_the_memory_limit():
+    size = tile_size_for(16, 40, 3)
+    assert (size + 6) ** 2 * 40 <= 16 * 2 ** 20
+    assert tile_size_for(1024, 4, 0, 512) % 512 == 0
+    with pytest.raises(MemoryError, match='at least 1 MB is needed'):
+        tile_size_for(0.01, 40, 3)
+
+
+def test_strip_length_fits_the_memory_limit():
+    assert strip_length_for(4, 41, 512, total=100) == 100
+    length = strip_length_for(4, 41, 512, 20)
+    assert length >= MIN_TILE_SIZE
+    assert (length + 40) * 512 * 41 <= 4 * 2 ** 20
+    with pytest.raises(MemoryError, match='at least 6 MB is needed'):
+        strip_length_for(1, 41, 512, 100)
+
+
+def test_engine_results_do_not_depend_on_memory_or_threads(workspace):
+    # 1 MB and 3 MB over two threads split the grid into several tiles and strips; 1024 MB reads it whole
+    x, y = np.meshgrid(np.arange(COLS), np.arange(ROWS))
+    write_array(workspace / 'dem.tif', (50 * np.sin(x / 9) + 30 * np.cos(y / 13)).astype(np.float32))
+    write_shapes(workspace / 'points.shp', [cell_centre(10, 10), cell_centre(140, 70), cell_centre(75, 125)], ogr.wkbPoint)
+
+    results = []
+    for memory_mb, threads in ((1024, 1), (1, 1), (3, 2)):
+        engine = numpy_engine(workspace, memory_mb=memory_mb, threads=threads)
+        engine.save(engine.slope(engine.read('dem.tif')), f'slope_{memory_mb}.tif')
+        engine.save(engine.distance('points.shp', 900), f'distance_{memory_mb}.tif', 'distance')
+        results.append((read_array(engine, f'slope_{memory_mb}.tif'), read_array(engine, f'distance_{memory_mb}.tif')))
+
+    for slope, distance in results[1:]:
+        np.testing.assert_array_equal(slope, results[0][0])
+        np.testing.assert_array_equal(distance, results[0][1])
+
+
+def test_engine_reports_the_memory_it_needs(workspace):
+    engine = numpy_engine(workspace, memory_mb=0.1)
+    write_array(workspace / 'dem.tif', np.zeros((ROWS, COLS), np.float32))
+    with pytest.raises(MemoryError, match='MB is needed'):
+        engine.save(engine.slope(engine.read('dem.tif')), 'slope.tif')
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from distance import euclidean_distance
+from fixtures import FULL, cell_centre, read_array, write_shapes
+from synthetic import ogr
+from transforms import DistanceLookup, Rescale, remap_range, remap_value
+
+
+def test_remap_range():
+    values = np.array([0, 5, 5.5, np.nan, 10], np.float32)
+    np.testing.assert_array_equal(remap_range(values, [[0, 5, 1]]), [1, 1, np.nan, np.nan, np.nan])
+
+
+def test_remap_range_earlier_ranges_win():
+    values = np.array([1, 3, 6], np.float32)
+    np.testing.assert_array_equal(remap_range(values, [[0, 4, 1], [2, 8, 2]]), [1, 1, 2])
+
+
+def test_remap_value():
+    values = np.array([10, 30, 40, 20, 50, np.nan, 5], np.float32)
+    np.testing.assert_array_equal(remap_value(values, [[10, 1], [30, 1], [40, 2]]),
+                                  [1, 1, 2, np.nan, np.nan, np.nan, np.nan])
+
+
+def test_remap_value_later_pairs_win():
+    np.testing.assert_array_equal(remap_value(np.array([7], np.float32), [[7, 1], [7, 3]]), [3])
+
+
+def test_rescale_exponential_reference_values():
+    # exp((x - shift) * base_factor) stretched from its values at the thresholds onto 1..10
+    rescale = Rescale('TfExponential', [0, 0.001, 0, None, 1000, None], 1, 10)
+    values = np.array([0, 250, 500, 1000], np.float32)
+    np.testing.assert_allclose(rescale(values), [1, 2.487666, 4.397866, 10], atol=1e-5)
+
+
+def test_rescale_small_reference_values():
+    # 1 / (1 + (x / midpoint) ** spread) falls from 10 at the lower threshold to 1 at the upper one
+    rescale = Rescale('TfSmall', [2000, 5, 100, None, 4000, None], 1, 10)
+    values = np.array([100, 1000, 2000, 3000, 4000], np.float32)
+    np.testing.assert_allclose(rescale(values), [10, 9.718753, 5.359376, 1.79875, 1], atol=1e-5)
+
+
+def test_rescale_values_beyond_the_thresholds():
+    rescale = Rescale('TfSmall', [2000, 5, 100, 0, 4000, None], 1, 10)
+    result = rescale(np.array([50, 5000, np.nan], np.float32))
+    # Below the lower threshold takes value_below; above the upper one keeps the value at the threshold
+    assert result[0] == 0
+    assert result[1] == pytest.approx(1)
+    assert np.isnan(result[2])
+
+
+@pytest.mark.parametrize('function, params', [('TfExponential', [0, -0.0003]), ('TfSmall', [1500, 3])])
+def test_distance_lookup_matches_direct_evaluation(function, params):
+    rng = np.random.default_rng(1)
+    cell_size, max_distance = 30.0, 3000.0
+    distances = euclidean_distance(rng.random((200, 200)) < 0.001, cell_size, max_distance).astype(np.float32)
+    distances[0, :5] = np.nan
+    rescale = Rescale(function, [*params, 0, None, max_distance, None], 1, 10)
+    np.testing.assert_allclose(DistanceLookup(rescale, cell_size, max_distance)(distances.copy()), rescale(distances),
+                               atol=1e-4)
+
+
+def write_points(workspace):
+    write_shapes(workspace / 'points.shp', [cell_centre(10, 10), cell_centre(100, 40), cell_centre(60, 110)], ogr.wkbPoint)
+
+
+def test_engine_rescale_of_capped_distances_matches_direct_evaluation(engine, workspace):
+    write_points(workspace)
+    distance = engine.distance('points.shp', 3000.0)
+    args = [1500, 3, 0, None, 3000.0, None]
+    rescaled = engine.rescale(distance, 'TfSmall', args, 1, 10, max_distance=3000.0)
+    np.testing.assert_allclose(rescaled.compute(FULL), Rescale('TfSmall', args, 1, 10)(distance.compute(FULL)), atol=1e-4)
+
+
+def test_engine_overlay_rescales_criteria_as_it_reads_them(engine, workspace):
+    # The fused overlay reads the distances and rescales them; the plain one reads saved rescaled criteria
+    write_points(workspace)
+    transforms = [{'function': 'TfSmall', 'args': [1500, 3, 0, None, 3000.0, None], 'from_scale': 1, 'to_scale': 10,
+                   'max_distance': 3000.0},
+                  {'function': 'TfExponential', 'args': [0, -0.0003, 0, None, 3000.0, None], 'from_scale': 1, 'to_scale': 10,
+                   'max_distance': 3000.0}]
+    engine.save(engine.distance('points.shp', 3000.0), 'distance.tif', 'distance')
+    engine.save(engine.read('distance.tif') * 0 + 1, 'mask.tif', 'mask')
+    for k, transform in enumerate(transforms):
+        engine.save(engine.rescale(engine.read('distance.tif'), **transform), f'rescaled_{k}.tif', 'score')
+
+    engine.weighted_overlay(['distance.tif', 'distance.tif'], [[0.4, 0.6]], ['mask.tif'], ['mask.tif'], ['fused.tif'],
+                            transforms=transforms)
+    engine.weighted_overlay(['rescaled_0.tif', 'rescaled_1.tif'], [[0.4, 0.6]], ['mask.tif'], ['mask.tif'], ['plain.tif'])
+    # Each path rounds to the score format once or twice
+    np.testing.assert_allclose(read_array(engine, 'fused.tif'), read_array(engine, 'plain.tif'), rtol=0, atol=1 / 1024)
@@ -0,0 +1,70 @@
+import math
+from collections import namedtuple
+
+# Default tile edge in cells; a 1024 x 1024 float32 tile is 4 MB
+TILE_SIZE = 1024
+
+# Smallest tile worth processing; below this per-tile overhead dominates
+MIN_TILE_SIZE = 64
+
+Window = namedtuple('Window', 'row col rows cols')
+
+
+def windows(rows, cols, tile_size=TILE_SIZE, tile_cols=None):
+    # Row-major tiles covering a rows x cols raster; tiles are tile_size rows by tile_cols (default: tile_size)
+    # columns and edge tiles are clipped to the raster
+    tile_cols = tile_cols or tile_size
+    for row in range(0, rows, tile_size):
+        for col in range(0, cols, tile_cols):
+            yield Window(row, col, min(tile_size, rows - row), min(tile_cols, cols - col))
+
+
+def expand(window, halo, rows, cols):
+    # Grow a window by halo cells on every side, clipped to the raster. Also returns the
+    # ((top, bottom), (left, right)) padding needed to restore the full halo at raster edges.
+    row0, col0 = max(window.row - halo, 0), max(window.col - halo, 0)
+    row1, col1 = min(window.row + window.rows + halo, rows), min(window.col + window.cols + halo, cols)
+    pad = ((row0 - (window.row - halo), (window.row + window.rows + halo) - row1),
+           (col0 - (window.col - halo), (window.col + window.cols + halo) - col1))
+    return Window(row0, col0, row1 - row0, col1 - col0), pad
+
+
+def crop(array, outer, window):
+    # Cut window out of an array that covers the (larger) outer window
+    row, col = window.row - outer.row, window.col - outer.col
+    return array[row:row + window.rows, col:col + window.cols]
+
+
+def tile_size_for(memory_mb, cell_bytes, halo=0, block=1):
+    """Largest square tile whose working set fits in memory_mb.
+
+    cell_bytes is the memory needed per cell of a (halo expanded) tile by everything
+    that is alive while the tile is processed. When at least one block fits, the size
+    is rounded down to whole blocks so tiles line up with the blocks of tiled rasters.
+    """
+    size = int(math.sqrt(memory_mb * 2 ** 20 / cell_bytes)) - 2 * halo
+    if size < MIN_TILE_SIZE:
+        needed = math.ceil((MIN_TILE_SIZE + 2 * halo) ** 2 * cell_bytes / 2 ** 20)
+        raise MemoryError(f'A memory limit of {memory_mb:g} MB is too small for {MIN_TILE_SIZE} cell tiles with a {halo} cell halo; at least {needed} MB is needed')
+    if size >= block:
+        size -= size % block
+    return size
+
+
+def strip_length_for(memory_mb, cell_bytes, width, halo=0, block=1, total=None):
+    """Longest strip width cells across whose working set fits in memory_mb.
+
+    Like tile_size_for, but for strips that read a halo of halo cells beyond both ends
+    of their length and none across their width (width already includes any cells read
+    beside the strip). The length is rounded down to whole blocks when one fits. total
+    is the raster's length, if known; a strip covering all of it reads no halo.
+    """
+    if total is not None and total * width * cell_bytes <= memory_mb * 2 ** 20:
+        return total
+    length = int(memory_mb * 2 ** 20 / (cell_bytes * width)) - 2 * halo
+    if length < MIN_TILE_SIZE:
+        needed = math.ceil((MIN_TILE_SIZE + 2 * halo) * width * cell_bytes / 2 ** 20)
+        raise MemoryError(f'A memory limit of {memory_mb:g} MB is too small for {MIN_TILE_SIZE} by {width} cell strips with a {halo} cell halo; at least {needed} MB is needed')
+    if length >= block:
+        length -= length % block
+    return length
@@ -0,0 +1,146 @@
+import math
+
+import numpy as np
+
+# Largest lookup table (entries) worth building; beyond this evaluating the function per cell is cheaper
+MAX_TABLE_SIZE = 1 << 24
+
+
+# Membership functions of the arcpy.sa transformation classes. Each works in place on a float64
+# array and returns it; the first arguments of each class are the parameters below and the last
+# four are the thresholds handled by Rescale.
+
+def exponential(x, shift, base_factor):
+    x -= shift
+    x *= base_factor
+    return np.exp(x, out=x)
+
+
+def small(x, midpoint, spread):
+    x /= midpoint
+    np.power(x, spread, out=x)
+    x += 1
+    return np.reciprocal(x, out=x)
+
+
+def large(x, midpoint, spread):
+    x /= midpoint
+    np.power(x, -spread, out=x)
+    x += 1
+    return np.reciprocal(x, out=x)
+
+
+def linear(x, minimum, maximum):
+    # Rises from minimum to maximum (falls if minimum > maximum) and is flat outside them
+    x -= minimum
+    x /= maximum - minimum
+    return np.clip(x, 0, 1, out=x)
+
+
+def gaussian(x, midpoint, spread):
+    x -= midpoint
+    np.square(x, out=x)
+    x *= -spread
+    return np.exp(x, out=x)
+
+
+TRANSFORMS = {
+    'TfExponential': exponential,
+    'TfSmall': small,
+    'TfLarge': large,
+    'TfLinear': linear,
+    'TfGaussian': gaussian,
+}
+
+# Points between the thresholds where a non-monotonic function peaks, by transformation class
+PEAKS = {
+    'TfGaussian': lambda midpoint, spread: [midpoint],
+}
+
+
+class Rescale:
+    """RescaleByFunction as a callable from a float32 tile (NoData as NaN) to a float32 tile.
+
+    args are the transformation class arguments: the function's parameters followed by
+    lower threshold, value below, upper threshold and value above. Function values at
+    the thresholds (and any peak between them) set the range that is stretched onto
+    from_scale..to_scale; cells beyond a threshold without an explicit value take the
+    value at that threshold.
+    """
+
+    def __init__(self, function, args, from_scale, to_scale):
+        *self.params, self.lower, self.value_below, self.upper, self.value_above = args
+        self.membership = TRANSFORMS[function]
+        self.from_scale = from_scale
+
+        points = [self.lower, self.upper]
+        points += [peak for peak in PEAKS.get(function, lambda *params: [])(*self.params) if self.lower < peak < self.upper]
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            f = self.membership(np.array(points, np.float64), *self.params)
+        self.f_min = f.min()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.stretch = (to_scale - from_scale) / (f.max() - self.f_min)
+
+    def __call__(self, values):
+        x = np.clip(values.astype(np.float64), self.lower, self.upper)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            self.membership(x, *self.params)
+            x -= self.f_min
+            x *= self.stretch
+            x += self.from_scale
+        if self.value_below is not None:
+            x[values < self.lower] = self.value_below
+        if self.value_above is not None:
+            x[values > self.upper] = self.value_above
+        return x.astype(np.float32)
+
+
+def distance_table_size(cell_size, max_distance):
+    return int(math.floor((max_distance / cell_size) ** 2)) + 2
+
+
+class DistanceLookup:
+    """A transform of a capped Euclidean distance surface as a single table gather per cell.
+
+    Exact distance transforms on a grid only take the values sqrt(n) x cell_size for whole
+    numbers n (squared distances in cells), plus max_distance where they are capped. The
+    transform is evaluated once for each of those values; a cell's table index is its
+    squared distance in cells rounded to the nearest whole number, so results match the
+    direct evaluation to within float32 precision of the distances.
+    """
+
+    def __init__(self, transform, cell_size, max_distance):
+        count = distance_table_size(cell_size, max_distance) - 1
+        distances = np.append(np.sqrt(np.arange(count, dtype=np.float64)) * cell_size, max_distance)
+        self.table = transform(np.minimum(distances, max_distance).astype(np.float32))
+        self.inverse_cell = np.float32(1 / cell_size)
+        self.max_distance = max_distance
+
+    def __call__(self, values):
+        index = values * self.inverse_cell
+        np.square(index, out=index)
+        np.rint(index, out=index)
+        nodata = np.isnan(values)
+        index[nodata] = 0
+        np.minimum(index, len(self.table) - 2, out=index)
+        index[values >= self.max_distance] = len(self.table) - 1
+        out = self.table[index.astype(np.int32)]
+        out[nodata] = np.nan
+        return out
+
+
+def remap_range(values, ranges):
+    # ranges is a list of [start, end, new value]; earlier ranges win where they overlap and unmatched cells are NaN
+    out = np.full(values.shape, np.nan, np.float32)
+    for start, end, value in reversed(ranges):
+        out[(values >= start) & (values <= end)] = value
+    return out
+
+
+def remap_value(values, pairs):
+    # pairs is a list of [old value, new value]; later pairs win, unmatched cells are NaN. One sorted search for every pair at once
+    mapping = {old: new for old, new in pairs}
+    old = np.array(sorted(mapping), np.float64)
+    new = np.array([mapping[key] for key in sorted(mapping)], np.float64)
+    index = np.minimum(np.searchsorted(old, values), len(old) - 1)
+    return np.where(old[index] == values, new[index], np.nan).astype(np.float32)
@@ -1,384 +1,444 @@
-import arcpy
-import os
-import sys
-
-walk_dir = 'C:/Users/Jacky/School/GEOG4480/data_layers'
-utm_29n = arcpy.SpatialReference(32629)
-arcpy.env.workspace = walk_dir
-arcpy.env.cellSize = 30
-arcpy.env.extent = 'administrative_regions/casablanca.shp'
-arcpy.env.mask = 'administrative_regions/casablanca.shp'
-arcpy.env.snapRaster = 'land_use/REPROJECTED_n29_30_2020lc030.tif'
-arcpy.env.outputCoordinateSystem = utm_29n
-arcpy.env.overwriteOutput = True
-
-# Reproject data layers to WGS 1984 UTM Zone 29N
-for root, folders, files in os.walk(walk_dir):
-    for file in files:
-        # Only reproject if data isn't already reprojected
-        if 'REPROJECTED' not in file:
-            original_path = os.path.join(root, file)
-            projected_path = os.path.join(root, f'REPROJECTED_{file}')
-
-            if file[-4:] == '.tif':
-                # Use nearest neighbour for land use data as its categorical; otherwise use cubic convolution resampling
-                mode = 'NEAREST' if 'land_use' in original_path else 'CUBIC'
-
-                print(f'Reproject {original_path} to {utm_29n.name} using {mode} resampling...')
-
-                arcpy.management.ProjectRaster(original_path, projected_path, utm_29n, 'CUBIC')
-            elif file[-4:] == '.shp':
-                print(f'Reproject {original_path} to {utm_29n.name}...')
-
-                arcpy.management.Project(original_path, projected_path, utm_29n)
-
-# Select Grand Casablanca and convert to single polygon
-print('Creating Grand Casablanca polygon...')
-casablanca_query = '''
-NAME_1 = 'Grand Casablanca'
-'''
-grand_casablanca = arcpy.SelectLayerByAttribute_management('administrative_regions/casablanca_reprojected.shp', 'NEW_SELECTION', casablanca_query)
-arcpy.Dissolve_management(grand_casablanca, 'administrative_regions/casablanca.shp')
-
-# Set extent, mask and snap rasters again to ensure they are using data that have been reprojected and exist
-arcpy.env.extent = 'administrative_regions/casablanca.shp'
-arcpy.env.mask = 'administrative_regions/casablanca.shp'
-arcpy.env.snapRaster = 'land_use/REPROJECTED_n29_30_2020lc030.tif'
-
-# Select clinics + hospitals
-print('Selecting hosptials and clinics in Grand Casablanca...')
-health_query = '''
-healthcare = 'hospital' OR healthcare = 'clinic'
-'''
-hospital_clinic = arcpy.SelectLayerByAttribute_management('health_facilities_points/REPROJECTED_hotosm_mar_health_facilities_points.shp', 'NEW_SELECTION', health_query)
-arcpy.management.CopyFeatures(hospital_clinic, 'health_facilities_points/hospital_clinic.shp')
-
-# Slope mask
-print('Calculating slope using DEM to create slope mask...')
-slope_degrees = arcpy.sa.Slope('dem/REPROJECTED_N33W008_FABDEM_V1-2.tif', 'DEGREE')
-slope_mask = arcpy.sa.Reclassify(slope_degrees, 'VALUE', arcpy.sa.RemapRange([[0, 5, 1]]), 'NODATA')
-slope_mask.save('dem/mask_slope.tif')
-
-# Land use mask
-print('Create land use (suitable land uses: Grasslands, Shrubland and Farmland) mask...')
-land_class_reclassified = arcpy.sa.Reclassify('land_use/REPROJECTED_n29_30_2020lc030.tif', 'VALUE', arcpy.sa.RemapValue([[10, 1], [30, 1], [40, 1]]), 'NODATA')
-land_class_reclassified.save('land_use/mask_land.tif')
-
-# Road line distance accumulation + mask
-print('Perform distance accumulatation on roads...')
-road_distance = arcpy.sa.DistanceAccumulation('road_lines/REPROJECTED_hotosm_mar_roads_lines.shp.shp')
-road_distance.save('road_lines/road_distance.tif')
-print('Create road mask to exclude road surfaces and their surrounding 10 m regions...')
-road_mask = arcpy.sa.Reclassify(road_distance, 'VALUE', arcpy.sa.RemapRange([[10, 1337, 1]]), 'NODATA')
-road_mask.save('road_lines/mask_road.tif')
-
-# Railway line distance accumulation + mask
-print('Perform distance accumulatation on railways...')
-railway_distance = arcpy.sa.DistanceAccumulation('railway_lines/REPROJECTED_hotosm_mar_railways_lines.shp')
-railway_distance.save('railway_lines/railway_distance.tif')
-print('Create railway mask to exclude railbeds and their surrounding 200 m regions...')
-railway_mask = arcpy.sa.Reclassify(railway_distance, 'VALUE', arcpy.sa.RemapRange([[200, 20641, 1]]), 'NODATA')
-railway_mask.save('railway_lines/mask_rail.tif')
-
-# Waterbody distance accumulation + mask
-print('Perform distance accumulatation on waterbodies...')
-waterbody_distance = arcpy.sa.DistanceAccumulation('waterways/REPROJECTED_hotosm_mar_waterways_lines.shp')
-waterbody_distance.save('waterways/waterbody_distance.tif')
-print('Create 250 m waterbody mask to exclude waterbodies and their surrounding 250 m regions...')
-waterbody_mask_250 = arcpy.sa.Reclassify(waterbody_distance, 'VALUE', arcpy.sa.RemapRange([[250, 14096, 1]]), 'NODATA')
-waterbody_mask_250.save('waterways/mask_water_250.tif')
-print('Create 500 m waterbody mask to exclude waterbodies and their surrounding 500 m regions...')
-waterbody_mask_500 = arcpy.sa.Reclassify(waterbody_distance, 'VALUE', arcpy.sa.RemapRange([[500, 14096, 1]]), 'NODATA')
-waterbody_mask_500.save('waterways/mask_water_500.tif')
-print('Create 1000 m waterbody mask to exclude waterbodies and their surrounding 1000 m regions...')
-waterbody_mask_1000 = arcpy.sa.Reclassify(waterbody_distance, 'VALUE', arcpy.sa.RemapRange([[1000, 14096, 1]]), 'NODATA')
-waterbody_mask_1000.save('waterways/mask_water_1000.tif')
-
-# Final masks
-road_mask = arcpy.Raster('road_lines/mask_road.tif')
-railway_mask = arcpy.Raster('railway_lines/mask_rail.tif')
-slope_mask = arcpy.Raster('dem/mask_slope.tif')
-landuse_mask = arcpy.Raster('land_use/mask_land.tif')
-water_250_mask = arcpy.Raster('waterways/mask_water_250.tif')
-water_500_mask = arcpy.Raster('waterways/mask_water_500.tif')
-water_1000_mask = arcpy.Raster('waterways/mask_water_1000.tif')
-
-print('Calculate final mask using 250 m waterbody mask...')
-mask_crofty = road_mask * railway_mask * slope_mask * landuse_mask * water_250_mask
-print('Calculate final mask using 500 m waterbody mask...')
-mask_brundle = road_mask * railway_mask * slope_mask * landuse_mask * water_500_mask
-print('Calculate final mask using 1000 m waterbody mask...')
-mask_kravitz = road_mask * railway_mask * slope_mask * landuse_mask * water_1000_mask
-
-mask_crofty.save('mask_crofty.tif')
-mask_brundle.save('mask_brundle.tif')
-mask_kravitz.save('mask_kravitz.tif')
-
-# Bus stop distance accumulation
-print('Perform distance accumulatation on bus stops...')
-bus_distance = arcpy.sa.DistanceAccumulation('bus_stops/REPROJECTED_bus-stops.shp')
-bus_distance.save('bus_stops/bus_distance.tif')
-
-# Airport distance accumulation
-print('Perform distance accumulatation on airports...')
-airport_distance = arcpy.sa.DistanceAccumulation('airports_points/REPROJECTED_hotosm_mar_airports_points.shp')
-airport_distance.save('airports_points/airport_distance.tif')
-
-# Hotel distance accumulation
-print('Perform distance accumulatation on hotels...')
-hotel_distance = arcpy.sa.DistanceAccumulation('hotels/REPROJECTED_hotels.shp')
-hotel_distance.save('hotels/hotel_distance.tif')
-
-# Health distance accumulation
-print('Perform distance accumulatation on hosptial and clinics...')
-health_distance = arcpy.sa.DistanceAccumulation('health_facilities_points/hospital_clinic.shp')
-health_distance.save('health_facilities_points/health_distance.tif')
-
-# Train stops distance accumulation
-print('Perform distance accumulatation on train stops...')
-train_stop_distance = arcpy.sa.DistanceAccumulation('train_stops/REPROJECTED_train-stops.shp')
-train_stop_distance.save('train_stops/train_stop_distance.tif')
-
-# Standardise roads
-print('Rescale roads using an exponential function to standardise...')
-rescaled_road_distance = arcpy.sa.RescaleByFunction('road_lines/road_distance.tif', arcpy.sa.TfExponential(0, -0.001722935025391958, 0, None, 1336.4317626953, None), 1, 10)
-rescaled_road_distance.save('suitability_model/rescaled_roads.tif')
-
-# Standardise health
-print('Rescale hosptial and clinics using an exponential function to standardise...')
-rescaled_health_distance = arcpy.sa.RescaleByFunction('health_facilities_points/health_distance.tif', arcpy.sa.TfExponential(0, -8.336368521733462e-05, 0, None, 27620.9609375, None), 1, 10)
-rescaled_health_distance.save('suitability_model/rescaled_health.tif')
-
-# Standardise bus stops
-print('Rescale bus stops using a small function to standardise...')
-rescaled_bus_distance = arcpy.sa.RescaleByFunction('bus_stops/bus_distance.tif', arcpy.sa.TfSmall(4370.65380859375, 5, 0, None, 8741.3076171875, None), 1, 10)
-rescaled_bus_distance.save('suitability_model/rescaled_bus.tif')
-
-# Standardise airports
-print('Rescale airports using a small function to standardise...')
-rescaled_airport_distance = arcpy.sa.RescaleByFunction('airports_points/airport_distance.tif', arcpy.sa.TfSmall(10197.626953125, 5, 0, None, 20395.25390625, None), 1, 10)
-rescaled_airport_distance.save('suitability_model/rescaled_airports.tif')
-
-# Standardise hotels
-print('Rescale hotels using a small function to standardise...')
-rescaled_airport_distance = arcpy.sa.RescaleByFunction('hotels/hotel_distance.tif', arcpy.sa.TfSmall(11622.482421875, 5, 0, None, 23244.96484375, None), 1, 10)
-rescaled_airport_distance.save('suitability_model/rescaled_hotels.tif')
-
-# Standardise train stops
-print('Rescale train stops using a small function to standardise...')
-rescaled_train_distance = arcpy.sa.RescaleByFunction('train_stops/train_stop_distance.tif', arcpy.sa.TfSmall(13236.3115234375, 5, 0, None, 26472.623046875, None), 1, 10)
-rescaled_train_distance.save('suitability_model/rescaled_train_stops.tif')
-
-# Suitability models
-
-airports = arcpy.Raster('suitability_model/rescaled_airports.tif')
-bus = arcpy.Raster('suitability_model/rescaled_bus.tif')
-health = arcpy.Raster('suitability_model/rescaled_health.tif')
-hotels = arcpy.Raster('suitability_model/rescaled_hotels.tif')
-trains = arcpy.Raster('suitability_model/rescaled_train_stops.tif')
-roads = arcpy.Raster('suitability_model/rescaled_roads.tif')
-masks = {
-    'crofty': arcpy.Raster('mask_crofty.tif'),
-    'brundle': arcpy.Raster('mask_brundle.tif'),
-    'kravitz': arcpy.Raster('mask_kravitz.tif'),
-}
-
-weights = {
-    'annaliese': [
-        0.12,
-        0.15,
-        0.30,
-        0.14,
-        0.04,
-        0.26
-    ],
-    'jacky': [
-        0.09,
-        0.11,
-        0.32,
-        0.12,
-        0.04,
-        0.32
-    ],
-    'marina': [
-        0.13,
-        0.08,
-        0.43,
-        0.14,
-        0.04,
-        0.26
-    ]
-}
-
-print('Calculate suitability score raster using weight set 1 and 250 m waterbody mask...')
-equation_annaliese_crofty = ((airports * weights['annaliese'][0]) \
-                            + (bus * weights['annaliese'][1]) \
-                            + (health*weights['annaliese'][2]) \
-                            + (hotels * weights['annaliese'][3]) \
-                            + (trains * weights['annaliese'][4]) \
-                            + (roads * weights['annaliese'][5])) \
-                            * masks['crofty']
-equation_annaliese_crofty.save('vettel_suitability_crofty.tif')
-
-print('Calculate suitability score raster using weight set 1 and 500 m waterbody mask...')
-equation_annaliese_brundle = ((airports * weights['annaliese'][0]) \
-                            + (bus * weights['annaliese'][1]) \
-                            + (health*weights['annaliese'][2]) \
-                            + (hotels * weights['annaliese'][3]) \
-                            + (trains * weights['annaliese'][4]) \
-                            + (roads * weights['annaliese'][5])) \
-                            * masks['brundle']
-equation_annaliese_brundle.save('vettel_suitability_brundle.tif')
-
-print('Calculate suitability score raster using weight set 1 and 1000 m waterbody mask...')
-equation_annaliese_kravitz = ((airports * weights['annaliese'][0]) \
-                            + (bus * weights['annaliese'][1]) \
-                            + (health*weights['annaliese'][2]) \
-                            + (hotels * weights['annaliese'][3]) \
-                            + (trains * weights['annaliese'][4]) \
-                            + (roads * weights['annaliese'][5])) \
-                            * masks['kravitz']
-equation_annaliese_kravitz.save('vettel_suitability_kravitz.tif')
-
-print('Calculate suitability score raster using weight set 2 and 250 m waterbody mask...')
-equation_jacky_crofty = ((airports * weights['jacky'][0]) \
-                            + (bus * weights['jacky'][1]) \
-                            + (health*weights['jacky'][2]) \
-                            + (hotels * weights['jacky'][3]) \
-                            + (trains * weights['jacky'][4]) \
-                            + (roads * weights['jacky'][5])) \
-                            * masks['crofty']
-equation_jacky_crofty.save('villeneuve_suitability_crofty.tif')
-
-print('Calculate suitability score raster using weight set 2 and 500 m waterbody mask...')
-equation_jacky_brundle = ((airports * weights['jacky'][0]) \
-                            + (bus * weights['jacky'][1]) \
-                            + (health*weights['jacky'][2]) \
-                            + (hotels * weights['jacky'][3]) \
-                            + (trains * weights['jacky'][4]) \
-                            + (roads * weights['jacky'][5])) \
-                            * masks['brundle']
-equation_jacky_brundle.save('villeneuve_suitability_brundle.tif')
-
-print('Calculate suitability score raster using weight set 2 and 1000 m waterbody mask...')
-equation_jacky_kravitz = ((airports * weights['jacky'][0]) \
-                            + (bus * weights['jacky'][1]) \
-                            + (health*weights['jacky'][2]) \
-                            + (hotels * weights['jacky'][3]) \
-                            + (trains * weights['jacky'][4]) \
-                            + (roads * weights['jacky'][5])) \
-                            * masks['kravitz']
-equation_jacky_kravitz.save('villeneuve_suitability_kravitz.tif')
-
-print('Calculate suitability score raster using weight set 3 and 250 m waterbody mask...')
-equation_marina_crofty = ((airports * weights['marina'][0]) \
-                            + (bus * weights['marina'][1]) \
-                            + (health*weights['marina'][2]) \
-                            + (hotels * weights['marina'][3]) \
-                            + (trains * weights['marina'][4]) \
-                            + (roads * weights['marina'][5])) \
-                            * masks['crofty']
-equation_marina_crofty.save('senna_suitability_crofty.tif')
-
-print('Calculate suitability score raster using weight set 3 and 500 m waterbody mask...')
-equation_marina_brundle = ((airports * weights['marina'][0]) \
-                            + (bus * weights['marina'][1]) \
-                            + (health*weights['marina'][2]) \
-                            + (hotels * weights['marina'][3]) \
-                            + (trains * weights['marina'][4]) \
-                            + (roads * weights['marina'][5])) \
-                            * masks['brundle']
-equation_marina_brundle.save('senna_suitability_brundle.tif')
-
-print('Calculate suitability score raster using weight set 3 and 1000 m waterbody mask...')
-equation_marina_kravitz = ((airports * weights['marina'][0]) \
-                            + (bus * weights['marina'][1]) \
-                            + (health*weights['marina'][2]) \
-                            + (hotels * weights['marina'][3]) \
-                            + (trains * weights['marina'][4]) \
-                            + (roads * weights['marina'][5])) \
-                            * masks['kravitz']
-equation_marina_kravitz.save('senna_suitability_kravitz.tif')
-
-print('Select scores higher than 7.5 and reclassify selected values to a binary raster...')
-vettel_binary = arcpy.sa.Reclassify('vettel_suitability_crofty.tif', 'VALUE', arcpy.sa.RemapRange([[7.5, 10, 1]]), 'NODATA')
-villeneuve_binary = arcpy.sa.Reclassify('villeneuve_suitability_crofty.tif', 'VALUE', arcpy.sa.RemapRange([[7.5, 10, 1]]), 'NODATA')
-senna_binary = arcpy.sa.Reclassify('senna_suitability_crofty.tif', 'VALUE', arcpy.sa.RemapRange([[7.5, 10, 1]]), 'NODATA')
-
-print('Convert binary raster to a polygon shapefile...')
-arcpy.conversion.RasterToPolygon(vettel_binary, 'vettel_binary.shp', 'SIMPLIFY', 'VALUE')
-arcpy.conversion.RasterToPolygon(villeneuve_binary, 'villeneuve_binary.shp', 'SIMPLIFY', 'VALUE')
-arcpy.conversion.RasterToPolygon(senna_binary, 'senna_binary.shp', 'SIMPLIFY', 'VALUE')
-
-print('Calculate area statistic for each parcel of suitable land...')
-vettel_binary_with_area = arcpy.management.CalculateGeometryAttributes('vettel_binary.shp', 'SHAPE_AREA AREA', None, 'SQUARE_METERS', None, 'SAME_AS_INPUT')
-villeneuve_binary_with_area = arcpy.management.CalculateGeometryAttributes('villeneuve_binary.shp', 'SHAPE_AREA AREA', None, 'SQUARE_METERS', None, 'SAME_AS_INPUT')
-senna_binary_with_area = arcpy.management.CalculateGeometryAttributes('senna_binary.shp', 'SHAPE_AREA AREA', None, 'SQUARE_METERS', None, 'SAME_AS_INPUT')
-
-selected_area_query = '''
-SHAPE_AREA >= 1500000
-'''
-
-print('Select final suitable regions whose area is over 1.5 sq km/15000000 sq m...')
-vettel_selected_area = arcpy.SelectLayerByAttribute_management(vettel_binary_with_area, 'NEW_SELECTION', selected_area_query)
-villeneuve_selected_area = arcpy.SelectLayerByAttribute_management(villeneuve_binary_with_area, 'NEW_SELECTION', selected_area_query)
-senna_selected_area = arcpy.SelectLayerByAttribute_management(senna_binary_with_area, 'NEW_SELECTION', selected_area_query)
-
-print('Convert suitable regions polygon shapefile to a raster...')
-arcpy.conversion.PolygonToRaster(vettel_selected_area, 'SHAPE_AREA', 'vettel_final_regions.tif')
-arcpy.conversion.PolygonToRaster(villeneuve_selected_area, 'SHAPE_AREA', 'villeneuve_final_regions.tif')
-arcpy.conversion.PolygonToRaster(senna_selected_area, 'SHAPE_AREA', 'senna_final_regions.tif')
-
-print('Reclassify as binary raster...')
-vettel_intermediate_binary = arcpy.sa.Reclassify('vettel_final_regions.tif', 'VALUE', arcpy.sa.RemapRange([[0, sys.float_info.max, 1]]), 'NODATA')
-villeneuve_intermediate_binary = arcpy.sa.Reclassify('villeneuve_final_regions.tif', 'VALUE', arcpy.sa.RemapRange([[0, sys.float_info.max, 1]]), 'NODATA')
-senna_intermediate_binary = arcpy.sa.Reclassify('senna_final_regions.tif', 'VALUE', arcpy.sa.RemapRange([[0, sys.float_info.max, 1]]), 'NODATA')
-
-crofty = arcpy.Raster('waterways/mask_water_250.tif')
-brundle = arcpy.Raster('waterways/mask_water_500.tif')
-kravitz = arcpy.Raster('waterways/mask_water_1000.tif')
-
-vettel_suitability_crofty = arcpy.Raster('vettel_suitability_crofty.tif')
-vettel_suitability_brundle = arcpy.Raster('vettel_suitability_brundle.tif')
-vettel_suitability_kravitz = arcpy.Raster('vettel_suitability_kravitz.tif')
-villeneuve_suitability_crofty = arcpy.Raster('villeneuve_suitability_crofty.tif')
-villeneuve_suitability_brundle = arcpy.Raster('villeneuve_suitability_brundle.tif')
-villeneuve_suitability_kravitz = arcpy.Raster('villeneuve_suitability_kravitz.tif')
-senna_suitability_crofty = arcpy.Raster('senna_suitability_crofty.tif')
-senna_suitability_brundle = arcpy.Raster('senna_suitability_brundle.tif')
-senna_suitability_kravitz = arcpy.Raster('senna_suitability_kravitz.tif')
-
-print('Calculate final suitable regions + scores using weight set 1 and 250 m waterbody mask...')
-vettel_final_regions_crofty = vettel_suitability_crofty * vettel_intermediate_binary
-print('Calculate final suitable regions + scores using weight set 1 and 500 m waterbody mask...')
-vettel_final_regions_brundle = vettel_suitability_brundle * vettel_intermediate_binary
-print('Calculate final suitable regions + scores using weight set 1 and 1000 m waterbody mask...')
-vettel_final_regions_kravitz = vettel_suitability_kravitz * vettel_intermediate_binary
-
-print('Calculate final suitable regions + scores using weight set 2 and 250 m waterbody mask...')
-villeneuve_final_regions_crofty = villeneuve_suitability_crofty * villeneuve_intermediate_binary
-print('Calculate final suitable regions + scores using weight set 2 and 500 m waterbody mask...')
-villeneuve_final_regions_brundle = villeneuve_suitability_brundle * villeneuve_intermediate_binary
-print('Calculate final suitable regions + scores using weight set 2 and 1000 m waterbody mask...')
-villeneuve_final_regions_kravitz = villeneuve_suitability_kravitz * villeneuve_intermediate_binary
-
-print('Calculate final suitable regions + scores using weight set 3 and 250 m waterbody mask...')
-senna_final_regions_crofty = senna_suitability_crofty * senna_intermediate_binary
-print('Calculate final suitable regions + scores using weight set 3 and 500 m waterbody mask...')
-senna_final_regions_brundle = senna_suitability_brundle * senna_intermediate_binary
-print('Calculate final suitable regions + scores using weight set 3 and 1000 m waterbody mask...')
-senna_final_regions_kravitz = senna_suitability_kravitz * senna_intermediate_binary
-
-vettel_final_regions_crofty.save('finalregions_vettel_crofty.tif')
-vettel_final_regions_brundle.save('finalregions_vettel_brundle.tif')
-vettel_final_regions_kravitz.save('finalregions_vettel_kravitz.tif')
-
-villeneuve_final_regions_crofty.save('finalregions_villeneuve_crofty.tif')
-villeneuve_final_regions_brundle.save('finalregions_villeneuve_brundle.tif')
-villeneuve_final_regions_kravitz.save('finalregions_villeneuve_kravitz.tif')
-
-senna_final_regions_crofty.save('finalregions_senna_crofty.tif')
-senna_final_regions_brundle.save('finalregions_senna_brundle.tif')
-senna_final_regions_kravitz.save('finalregions_senna_kravitz.tif')
-
-print('Operation complete!')
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+import config
+from engines import ENGINES, get_engine
+from pipeline import Pipeline, Stage, as_paths, dataset_files
+
+# Reprojected layers are written next to their source with this prefix
+REPROJECTED_PREFIX = 'REPROJECTED_'
+
+# Record of every reprojected layer in the workspace
+REPROJECTION_CATALOG = 'reprojected.json'
+
+
+def reproject(env, source, output, resampling, margin, clip=None):
+    engine = get_engine(env)
+    clipped = f', clipped to {margin:g} m around {clip}' if clip else ''
+    if source[-4:] == '.tif':
+        print(f'Reproject {source} to {engine.crs_name()} using {resampling} resampling{clipped}...')
+        engine.project_raster(source, output, resampling, clip, margin)
+    else:
+        print(f'Reproject {source} to {engine.crs_name()}{clipped}...')
+        engine.project_features(source, output, clip, margin)
+
+
+def read_catalog(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def source_digest(path, previous):
+    # Size, modification time and sha256 of a layer (all shapefile parts); the hash is reused while size and time match
+    parts = dataset_files(path)
+    size = sum(os.path.getsize(part) for part in parts)
+    mtime_ns = max(os.stat(part).st_mtime_ns for part in parts)
+    if previous and previous.get('source_size') == size and previous.get('source_mtime_ns') == mtime_ns:
+        return size, mtime_ns, previous['source_sha256']
+
+    sha = hashlib.sha256()
+    for part in parts:
+        with open(part, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+    return size, mtime_ns, sha.hexdigest()
+
+
+def reprojection_catalog(env, layers, catalog, entries):
+    print(f'Record {len(entries)} reprojected layers in {catalog}...')
+    path = os.path.join(env.workspace, catalog)
+    previous = read_catalog(path)
+    records = {}
+    for entry in entries:
+        size, mtime_ns, sha256 = source_digest(os.path.join(env.workspace, entry['source']), previous.get(entry['source']))
+        output_mtime = max(os.stat(part).st_mtime for part in dataset_files(os.path.join(env.workspace, entry['output'])))
+        records[entry['source']] = {
+            **entry,
+            'crs': f'EPSG:{env.epsg}',
+            'source_size': size,
+            'source_mtime_ns': mtime_ns,
+            'source_modified': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(mtime_ns / 1e9)),
+            'source_sha256': sha256,
+            'output_modified': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(output_mtime)),
+        }
+    with open(path, 'w') as f:
+        json.dump(records, f, indent=1, sort_keys=True)
+
+
+def select(env, source, output, where, dissolve, label):
+    print(f'Selecting {label}...')
+    get_engine(env).select_features(source, where, output, dissolve=dissolve)
+
+
+def slope_mask(env, dem, output, max_degrees, grid=None):
+    print('Calculating slope using DEM to create slope mask...')
+    engine = get_engine(env)
+    slope_degrees = engine.slope(engine.read(dem))
+    engine.save(engine.reclassify_range(slope_degrees, [[0, max_degrees, 1]]), output, 'mask')
+
+
+def land_mask(env, land_use, output, classes, label, grid=None):
+    print(f'Create land use (suitable land uses: {label}) mask...')
+    engine = get_engine(env)
+    engine.save(engine.reclassify_value(engine.read(land_use), [[value, 1] for value in classes]), output, 'mask')
+
+
+def distance(env, features, output, label, max_distance, grid=None):
+    print(f'Perform distance accumulatation on {label}...')
+    engine = get_engine(env)
+    engine.save(engine.distance(features, max_distance), output, 'distance')
+
+
+def buffer_mask(env, distance, output, minimum, maximum, label, grid=None):
+    print(f'Create {label} mask to exclude {label} and their surrounding {minimum} m regions...')
+    engine = get_engine(env)
+    engine.save(engine.reclassify_range(engine.read(distance), [[minimum, maximum, 1]]), output, 'mask')
+
+
+def rescale(env, distance, output, function, args, label, max_distance, grid=None):
+    print(f'Rescale {label} using {function} to standardise...')
+    engine = get_engine(env)
+    engine.save(engine.rescale(engine.read(distance), function, args, 1, 10, max_distance), output, 'score')
+
+
+def suitability(env, criteria, masks, variants, outputs, variant_outputs, weights, transforms=None, grid=None):
+    print(f'Calculate final masks and suitability score rasters for {len(weights)} weight sets and {len(variants)} waterbody masks in one pass...')
+    get_engine(env).weighted_overlay(criteria, weights, masks, variants, outputs, variant_outputs, transforms)
+
+
+def regions(env, suitability, output, table, polygons, threshold, min_area, grid=None):
+    print(f'Select regions scoring at least {threshold} whose area is over {min_area} sq m...')
+    regions = get_engine(env).extract_regions(suitability, threshold, min_area, output, table, polygons)
+    print(f'Found {len(regions)} suitable regions')
+
+
+def final_regions(env, suitability, regions, output, label, grid=None):
+    print(f'Calculate final suitable regions + scores using {label}...')
+    engine = get_engine(env)
+    intermediate_binary = engine.reclassify_range(engine.read(regions), [[0, sys.float_info.max, 1]])
+    engine.save(engine.read(suitability) * intermediate_binary, output, 'score')
+
+
+# Stages that write rasters on the analysis grid; grid lists the extent, mask and snap raster layers they
+# depend on (see grid_inputs)
+GRID_STAGES = (slope_mask, land_mask, distance, buffer_mask, rescale, suitability, regions, final_regions)
+
+
+def criterion_transform(model, name):
+    # Keyword arguments of Engine.rescale() that turn a criterion's distance surface into its 1 to 10 score
+    criterion = model['criteria'][name]
+    args = [*criterion['parameters'], criterion['lower_threshold'], criterion.get('value_below'),
+            criterion['upper_threshold'], criterion.get('value_above')]
+    return {'function': criterion['function'], 'args': args, 'from_scale': 1, 'to_scale': 10,
+            'max_distance': model['distances'][criterion['distance']]['max_distance']}
+
+
+def overlay_criteria(model):
+    """Rasters the overlay reads for each criterion, in the order of each weight set, and their transforms.
+
+    Normally these are the rescaled criteria and transforms is None. With fuse_rescale
+    they are the distance surfaces and each is rescaled as the overlay reads it.
+    """
+    if not model.get('overlay', {}).get('fuse_rescale', False):
+        return [criterion['output'] for criterion in model['criteria'].values()], None
+    paths = [model['distances'][criterion['distance']]['output'] for criterion in model['criteria'].values()]
+    return paths, [criterion_transform(model, name) for name in model['criteria']]
+
+
+def weight_sets(model):
+    # Weights of each modelled weight set as lists in the order of overlay_criteria
+    return [[model['weights'][person][name] for name in model['criteria']] for person in model['models']]
+
+
+def mask_paths(model):
+    # Exclusion masks shared by every final mask
+    return [mask['output'] for mask in model['masks'].values()]
+
+
+def water_mask_paths(model):
+    water = model['water']
+    return [water['output'].format(buffer=buffer) for buffer in water['buffers'].values()]
+
+
+def model_stages(env, model):
+    """Stages of one model (the base model or a variant) in the order they are declared."""
+    stages = []
+    distances = model['distances']
+
+    for name, selection in model.get('selections', {}).items():
+        stages.append(Stage(name, select,
+                            inputs={'source': selection['source']},
+                            outputs={'output': selection['output']},
+                            params={'where': selection['where'], 'dissolve': selection.get('dissolve', False),
+                                    'label': selection['label']}))
+
+    for name, entry in distances.items():
+        stages.append(Stage(name, distance, inputs={'features': entry['features']}, outputs={'output': entry['output']},
+                            params={'label': entry['label'], 'max_distance': entry['max_distance']}))
+
+    # Masks
+    for name, mask in model['masks'].items():
+        if mask['type'] == 'slope':
+            stages.append(Stage(f'{name}_mask', slope_mask,
+                                inputs={'dem': mask['dem']},
+                                outputs={'output': mask['output']},
+                                params={'max_degrees': mask['max_degrees']}))
+        elif mask['type'] == 'land_use':
+            stages.append(Stage(f'{name}_mask', land_mask,
+                                inputs={'land_use': mask['land_use']},
+                                outputs={'output': mask['output']},
+                                params={'classes': mask['classes'], 'label': mask['label']}))
+        else:
+            stages.append(Stage(f'{name}_mask', buffer_mask,
+                                inputs={'distance': distances[mask['distance']]['output']},
+                                outputs={'output': mask['output']},
+                                params={'minimum': mask['minimum'], 'maximum': mask['maximum'], 'label': mask['label']}))
+
+    water = model['water']
+    for buffer, output in zip(water['buffers'].values(), water_mask_paths(model)):
+        stages.append(Stage(f'water_mask_{buffer}', buffer_mask,
+                            inputs={'distance': distances[water['distance']]['output']},
+                            outputs={'output': output},
+                            params={'minimum': buffer, 'maximum': water['maximum'], 'label': water['label']}))
+
+    # Standardise criteria, unless the overlay rescales them as it reads them
+    criteria, transforms = overlay_criteria(model)
+    if transforms is None:
+        for name, criterion in model['criteria'].items():
+            transform = criterion_transform(model, name)
+            stages.append(Stage(f'rescale_{name}', rescale,
+                                inputs={'distance': distances[criterion['distance']]['output']},
+                                outputs={'output': criterion['output']},
+                                params={'function': transform['function'], 'args': transform['args'], 'label': name,
+                                        'max_distance': transform['max_distance']}))
+
+    # Final masks and suitability models; the shared masks are computed once for every waterbody variant
+    models = model['models']
+    buffers = water['buffers']
+    params = {'weights': weight_sets(model)}
+    if transforms is not None:
+        params['transforms'] = transforms
+    stages.append(Stage('suitability', suitability,
+                        inputs={'criteria': criteria, 'masks': mask_paths(model), 'variants': water_mask_paths(model)},
+                        outputs={
+                            'outputs': [f'{name}_suitability_{variant}.tif' for name in models.values() for variant in buffers],
+                            'variant_outputs': [f'mask_{variant}.tif' for variant in buffers],
+                        },
+                        params=params))
+
+    selection = model['regions']
+    for person, name in models.items():
+        stages.append(Stage(f'{name}_regions', regions,
+                            inputs={'suitability': f'{name}_suitability_{selection["water"]}.tif'},
+                            outputs={'output': f'{name}_final_regions.tif', 'table': f'{name}_regions.csv',
+                                     'polygons': f'{name}_regions.shp'},
+                            params={'threshold': selection['threshold'], 'min_area': selection['min_area']}))
+
+        for variant, buffer in buffers.items():
+            stages.append(Stage(f'finalregions_{name}_{variant}', final_regions,
+                                inputs={'suitability': f'{name}_suitability_{variant}.tif', 'regions': f'{name}_final_regions.tif'},
+                                outputs={'output': f'finalregions_{name}_{variant}.tif'},
+                                params={'label': f'{person} weights and {buffer} m waterbody mask'}))
+
+    stages.extend(reprojection_stages(env, model, stages))
+    grid_inputs(env, stages)
+    return stages
+
+
+def upstream_paths(stages, path):
+    # Every path the stages read, directly or through other stages, to produce path
+    producers = {os.path.normpath(output): stage for stage in stages
+                 for value in stage.outputs.values() for output in as_paths(value)}
+    paths, queue = set(), [os.path.normpath(path)]
+    while queue:
+        stage = producers.get(queue.pop())
+        if stage is None:
+            continue
+        for value in stage.inputs.values():
+            for source in map(os.path.normpath, as_paths(value)):
+                if source not in paths:
+                    paths.add(source)
+                    queue.append(source)
+    return paths
+
+
+def grid_inputs(env, stages):
+    """Make the extent, mask and snap raster of env inputs of every raster stage when stages produce them.
+
+    These layers fix the grid and mask of every raster, so the raster stages run after
+    the stages that write them and rerun when they change. Stages they are built from
+    (such as the selection of the study area) are left alone.
+    """
+    produced = {os.path.normpath(path) for stage in stages for value in stage.outputs.values() for path in as_paths(value)}
+    grid = list(dict.fromkeys(path for path in (env.extent, env.mask, env.snap_raster)
+                              if path and os.path.normpath(path) in produced))
+    if not grid:
+        return
+    sources = {os.path.normpath(path) for path in grid}.union(*(upstream_paths(stages, path) for path in grid))
+    for stage in stages:
+        outputs = {os.path.normpath(path) for value in stage.outputs.values() for path in as_paths(value)}
+        if stage.func in GRID_STAGES and not outputs & sources:
+            stage.inputs['grid'] = grid
+
+
+def reprojection_stages(env, model, stages):
+    """One stage per source layer in the workspace that reprojects it, plus a stage recording them in the catalog.
+
+    Source layers are the .tif and .shp files that no stage produces and that are not
+    themselves reprojected layers (by prefix or because the catalog lists them as an
+    output). Each is clipped to the study extent grown by the farthest distance cap, so
+    distances to features just outside the study area are unchanged; layers the extent
+    is built from are reprojected whole. The pipeline reruns a reprojection only when
+    its source, settings or clip layer change.
+    """
+    settings = model.get('reproject', {})
+    margin = max(entry['max_distance'] for entry in model['distances'].values())
+    produced = {os.path.normpath(path) for stage in stages for value in stage.outputs.values() for path in as_paths(value)}
+    catalogued = {os.path.normpath(entry['output']) for entry in read_catalog(os.path.join(env.workspace, REPROJECTION_CATALOG)).values()}
+
+    reprojections = []
+    for root, folders, files in os.walk(env.workspace):
+        if root == env.workspace:
+            folders[:] = [folder for folder in folders if folder not in settings.get('exclude', [])]
+        for file in sorted(files):
+            original_path = os.path.relpath(os.path.join(root, file), env.workspace)
+            key = os.path.normpath(original_path)
+            if file.startswith(REPROJECTED_PREFIX) or key in produced or key in catalogued or file[-4:] not in ('.tif', '.shp'):
+                continue
+
+            # Use nearest neighbour for categorical data; otherwise use cubic convolution resampling
+            categorical = any(folder in original_path for folder in settings.get('categorical', []))
+            reprojections.append(Stage(f'reproject_{original_path}', reproject,
+                                       inputs={'source': original_path},
+                                       outputs={'output': os.path.join(os.path.dirname(original_path), REPROJECTED_PREFIX + file)},
+                                       params={'resampling': 'NEAREST' if categorical else 'CUBIC', 'margin': margin}))
+
+    extent_sources = upstream_paths(stages + reprojections, env.extent) if env.extent else set()
+    for stage in reprojections:
+        if env.extent and os.path.normpath(stage.outputs['output']) not in extent_sources:
+            stage.inputs['clip'] = env.extent
+
+    if reprojections:
+        entries = [{'source': stage.inputs['source'], 'output': stage.outputs['output'], 'clip': stage.inputs.get('clip'),
+                    'margin': margin, 'resampling': stage.params['resampling'] if stage.inputs['source'][-4:] == '.tif' else None}
+                   for stage in reprojections]
+        reprojections.append(Stage('reprojection_catalog', reprojection_catalog,
+                                   inputs={'layers': [entry['output'] for entry in entries]},
+                                   outputs={'catalog': REPROJECTION_CATALOG},
+                                   params={'entries': entries}))
+    return reprojections
+
+
+def add_variant(pipeline, stages, variant):
+    # Stages identical to one already in the pipeline (after following moved inputs) are shared;
+    # the others are renamed variant/stage and write under variants/<variant>/
+    moved = {}
+
+    def follow(value):
+        paths = [moved.get(os.path.normpath(path), path) for path in as_paths(value)]
+        return paths if isinstance(value, (list, tuple)) else paths[0]
+
+    for stage in stages:
+        inputs = {role: follow(value) for role, value in stage.inputs.items()}
+        shared = pipeline.stages.get(stage.name)
+        if (shared is not None and shared.func is stage.func and shared.inputs == inputs
+                and shared.outputs == stage.outputs and shared.params == stage.params):
+            continue
+
+        outputs = {}
+        for role, value in stage.outputs.items():
+            paths = []
+            for path in as_paths(value):
+                moved[os.path.normpath(path)] = os.path.join('variants', variant, path)
+                paths.append(moved[os.path.normpath(path)])
+            outputs[role] = paths if isinstance(value, (list, tuple)) else paths[0]
+        pipeline.add(Stage(f'{variant}/{stage.name}', stage.func, inputs, outputs, stage.params))
+
+
+def build_pipeline(env, model, variants=None):
+    """Stage graph of a study area for the base model and the given variants (default: all of them)."""
+    pipeline = Pipeline(env.workspace, env)
+    for variant, merged in config.variant_models(model, variants):
+        stages = model_stages(env, merged)
+        if variant is None:
+            for stage in stages:
+                pipeline.add(stage)
+        else:
+            add_variant(pipeline, stages, variant)
+    return pipeline
+
+
+def missing_inputs(pipeline):
+    # Source files that no stage produces and that do not exist in the workspace
+    missing = []
+    for stage in pipeline.stages.values():
+        for value in stage.inputs.values():
+            for path in as_paths(value):
+                if not pipeline.produces(path) and not os.path.exists(pipeline.path(path)) and path not in missing:
+                    missing.append(path)
+    return missing
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the suitability model, skipping stages that are up to date.')
+    parser.add_argument('stages', nargs='*', help='only run these stages (and anything they depend on)')
+    parser.add_argument('--config', default=config.DEFAULT_CONFIG, help='model file (TOML or YAML)')
+    parser.add_argument('--area', action='append', help='study area to run; repeat for several (default: every area)')
+    parser.add_argument('--variant', action='append', help='variant to run besides the base model; repeat for several (default: every variant)')
+    parser.add_argument('--check', action='store_true', help='validate the model file and inputs, then exit')
+    parser.add_argument('--force', action='store_true', help='rerun stages even if they are up to date')
+    parser.add_argument('--engine', choices=sorted(ENGINES), help='raster engine to run the model with (default: from the model file)')
+    parser.add_argument('--memory', type=int, help='working memory (MB) per tiled operation with the numpy engine')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='number of independent stages to run at once (default: one per CPU)')
+    parser.add_argument('--threads', type=int, help='tiles to compute at once within a stage with the numpy engine')
+    parser.add_argument('--list', action='store_true', help='list stages in run order and exit')
+    parser.add_argument('--report', default=time.strftime('reports/run_%Y%m%d_%H%M%S'),
+                        help='path prefix in the workspace for the JSON and CSV run report')
+    args = parser.parse_args()
+
+    try:
+        model = config.load_config(args.config, args.engine)
+        areas = args.area or list(model['areas'])
+        unknown = [f'areas.{area}: no such study area' for area in areas if area not in model['areas']]
+        unknown += [f'variants.{name}: no such variant' for name in args.variant or [] if name not in model.get('variants', {})]
+        if unknown:
+            raise config.ConfigError(args.config, unknown)
+    except config.ConfigError as error:
+        sys.exit(str(error))
+
+    # Build every study area's stage graph before running any, so problems show up before hours of processing
+    pipelines = {}
+    problems = []
+    for area in areas:
+        env = config.environment(model, area, engine=args.engine, memory_mb=args.memory, threads=args.threads)
+        try:
+            pipelines[area] = pipeline = build_pipeline(env, model, args.variant)
+            pipeline.order(args.stages or None)
+        except (KeyError, ValueError) as error:
+            problems.append(f'{area}: {error}')
+            continue
+        problems.extend(f'{area}: {path} does not exist and no stage produces it' for path in missing_inputs(pipeline))
+    if problems:
+        sys.exit('\n'.join(problems))
+
+    if args.check:
+        print(f'{args.config} is valid: ' + ', '.join(f'{area} ({len(pipeline.stages)} stages)' for area, pipeline in pipelines.items()))
+        sys.exit()
+
+    if args.list:
+        for area, pipeline in pipelines.items():
+            for name in pipeline.order(args.stages or None):
+                print(f'{area}: {name}' if len(pipelines) > 1 else name)
+        sys.exit()
+
+    for area, pipeline in pipelines.items():
+        print(f'Running {area}...')
+        pipeline.run(args.stages or None, force=args.force, jobs=args.jobs, report=args.report)
+
+    print('Operation complete!')